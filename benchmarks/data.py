@@ -0,0 +1,252 @@
+"""
+Seeded synthetic portfolio data, shaped like the documents the service stores.
+
+Documents are generated with the institutions and instruments they reference embedded, as they were stored before
+they were referenced instead, and migrated to the current schema once seeded.
+
+The same seed always generates the same documents, so query plans and benchmark timings are comparable across runs.
+
+Usage: python -m benchmarks.data <mongo uri> [database] [users] [securities] [days] [transactions] [seed]
+"""
+import importlib
+import pkgutil
+import random
+import sys
+from contextlib import contextmanager, ExitStack
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from pymongo import MongoClient
+
+import src.operations
+from src.config import password_context
+from src.migrations import migrate, SCHEMA_VERSION
+from src.models.accounts import AccountType
+from src.models.institutions import InstitutionType
+from src.models.instruments import InstrumentType
+from src.models.transactions import TransactionStatus
+
+
+EXCHANGES = (
+    ('NDQ', 'Nasdaq', 'USD'),
+    ('NYSE', 'New York Stock Exchange', 'USD'),
+    ('LSE', 'London Stock Exchange', 'GBP')
+)
+BANKS = (('BOI', 'Bank of Ireland'), ('AIB', 'Allied Irish Banks'))
+BROKERS = (('MS', 'Morgan Stanley'), ('IBKR', 'Interactive Brokers'))
+CURRENCIES = (('EUR', 'Euro', 1.0), ('USD', 'US Dollar', 0.9), ('GBP', 'Pound Sterling', 1.15))
+
+# Password of every generated user, and username of the generated admin user
+PASSWORD = 'b3nchmark'
+ADMIN_USERNAME = 'admin'
+
+# Share of transactions left pending, and of the rest cancelled
+PENDING_RATIO = 0.05
+CANCELLED_RATIO = 0.05
+
+
+def _institutions():
+    return [
+        *({'type': InstitutionType.exchange, 'code': code, 'name': name} for code, name, _ in EXCHANGES),
+        *({'type': InstitutionType.bank, 'code': code, 'name': name} for code, name in BANKS),
+        *({'type': InstitutionType.broker, 'code': code, 'name': name} for code, name in BROKERS)
+    ]
+
+
+def _instruments(institutions: list, securities: int, rng: random.Random):
+    exchanges = [i for i in institutions if i['type'] == InstitutionType.exchange]
+    currencies = [
+        {'type': InstrumentType.currency, 'description': name, 'symbol': code, 'code': code}
+        for code, name, _ in CURRENCIES
+    ]
+    securities = [
+        {
+            'type': InstrumentType.security,
+            'description': f'Security {n}',
+            'symbol': f'S{n:04d}',
+            'code': f'{exchange["code"]}:S{n:04d}',
+            'exchange': exchange
+        }
+        for n, exchange in ((n, rng.choice(exchanges)) for n in range(securities))
+    ]
+    return currencies + securities
+
+
+def _values(instruments: list, dates: list, rng: random.Random):
+    """Daily values as random walks: currencies quoted in euros, securities in their exchange's currency."""
+    quote_currencies = {code: currency for code, _, currency in EXCHANGES}
+    values = []
+    for instrument in instruments:
+        if instrument['type'] == InstrumentType.currency:
+            if instrument['code'] == 'EUR':
+                continue
+
+            currency, price = 'EUR', next(rate for code, _, rate in CURRENCIES if code == instrument['code'])
+
+        else:
+            currency, price = quote_currencies[instrument['exchange']['code']], rng.uniform(10, 500)
+
+        for date in dates:
+            price *= 1 + rng.gauss(0, 0.01)
+            values.append({'instrument': instrument, 'date': date, 'values': {currency: round(price, 4)}})
+
+    return values
+
+
+def _accounts(username: str, institutions: dict):
+    return [
+        {'type': AccountType.cash, 'code': 'WALLET', 'description': 'Wallet', 'owner': username, 'assets': []},
+        {
+            'type': AccountType.bank,
+            'code': 'CURRENT',
+            'description': 'Current account',
+            'owner': username,
+            'holder': institutions['BOI'],
+            'assets': []
+        },
+        {
+            'type': AccountType.investment,
+            'code': 'BROKERAGE',
+            'description': 'Brokerage account',
+            'owner': username,
+            'holder': institutions['MS'],
+            'assets': []
+        }
+    ]
+
+
+def _entry(account: dict, instrument: dict, quantity: float, status: TransactionStatus):
+    return {
+        'account': {k: account[k] for k in ('type', 'code', 'description')},
+        'balance': {'instrument': instrument, 'quantity': quantity},
+        'status': status
+    }
+
+
+def _transactions(username: str, accounts: list, instruments: list, start: datetime, end: datetime, count: int,
+                  rng: random.Random):
+    """Deposits into the current account and security purchases paid from it, spread over the period."""
+    _, current, brokerage = accounts
+    currencies = {i['code']: i for i in instruments if i['type'] == InstrumentType.currency}
+    securities = [i for i in instruments if i['type'] == InstrumentType.security]
+    step = (end - start) / max(count, 1)
+    transactions = []
+    for n in range(count):
+        roll = rng.random()
+        status = TransactionStatus.pending if roll < PENDING_RATIO else \
+            TransactionStatus.cancelled if roll < PENDING_RATIO + CANCELLED_RATIO else TransactionStatus.completed
+
+        if n % 4 == 0:
+            amount = round(rng.uniform(500, 5000), 2)
+            total = {'instrument': currencies['EUR'], 'quantity': amount}
+            entries = [_entry(current, currencies['EUR'], amount, status)]
+
+        else:
+            security = rng.choice(securities)
+            quantity = rng.randint(1, 20)
+            amount = round(quantity * rng.uniform(10, 500), 2)
+            total = {'instrument': currencies['USD'], 'quantity': amount}
+            entries = [
+                _entry(brokerage, security, quantity, status),
+                _entry(current, currencies['USD'], -amount, status)
+            ]
+
+        transactions.append({
+            'owner': username,
+            'code': (start + step * n).isoformat()[:19],
+            'description': f'Transaction {n}',
+            'status': status,
+            'total': total,
+            'entries': entries
+        })
+
+        if status == TransactionStatus.completed:
+            for entry in entries:
+                account = next(a for a in accounts if a['code'] == entry['account']['code'])
+                _add_asset(account, entry['balance'])
+
+    return transactions
+
+
+def _add_asset(account: dict, balance: dict):
+    for asset in account['assets']:
+        if asset['instrument']['code'] == balance['instrument']['code']:
+            asset['quantity'] += balance['quantity']
+            return
+
+    account['assets'].append(dict(balance))
+
+
+def generate(users: int = 20, securities: int = 100, days: int = 365, transactions: int = 500, seed: int = 0,
+             end: datetime = datetime(2020, 12, 31)):
+    """Documents of every stored collection, by collection name."""
+    rng = random.Random(seed)
+    dates = [end - timedelta(days=n) for n in reversed(range(days))]
+    institutions = _institutions()
+    instruments = _instruments(institutions, securities, rng)
+    by_code = {i['code']: i for i in institutions}
+    # Hashing is slow on purpose, so every user shares the same hash
+    hashed_password = password_context.hash(PASSWORD)
+
+    documents = {
+        'institutions': institutions,
+        'instruments': instruments,
+        'values': _values(instruments, dates, rng),
+        'users': [{'username': ADMIN_USERNAME, 'is_admin': True, 'hashed_password': hashed_password}],
+        'accounts': [],
+        'transactions': []
+    }
+    for n in range(users):
+        username = f'user{n:04d}'
+        accounts = _accounts(username, by_code)
+        documents['users'].append({
+            'username': username,
+            'is_admin': False,
+            'base_currency': 'EUR',
+            'hashed_password': hashed_password
+        })
+        documents['transactions'].extend(
+            _transactions(username, accounts, instruments, dates[0], end, transactions, rng)
+        )
+        documents['accounts'].extend(accounts)
+
+    return documents
+
+
+def seed_database(database, schema_version: int = SCHEMA_VERSION, **kwargs):
+    """
+    Replace the contents of database with generated documents and migrate it to schema_version, returning each
+    collection size.
+    """
+    documents = generate(**kwargs)
+    for collection in database.list_collection_names():
+        database.drop_collection(collection)
+
+    for collection, docs in documents.items():
+        # Insert copies, so the generated documents are not modified with the ids of the inserted ones
+        database[collection].insert_many([dict(doc) for doc in docs])
+
+    # Building the indexes once everything is inserted is faster than updating them on every insert
+    migrate(database, schema_version)
+
+    return {collection: len(docs) for collection, docs in documents.items()}
+
+
+@contextmanager
+def using_database(database):
+    """Point every operation module to database instead of the configured one."""
+    with ExitStack() as stack:
+        for module in pkgutil.iter_modules(src.operations.__path__):
+            module = importlib.import_module(f'src.operations.{module.name}')
+            if hasattr(module, 'database'):
+                stack.enter_context(patch.object(module, 'database', database))
+
+        yield database
+
+
+if __name__ == '__main__':
+    uri, name = sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else 'portfolio_benchmark'
+    options = dict(zip(('users', 'securities', 'days', 'transactions', 'seed'), map(int, sys.argv[3:])))
+    counts = seed_database(MongoClient(uri)[name], **options)
+    for collection, count in counts.items():
+        print(f'{collection:<14}{count:>10}')
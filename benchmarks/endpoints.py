@@ -0,0 +1,290 @@
+"""
+Drive every route of the service through an in-process client against seeded synthetic data, reporting latency
+percentiles, throughput, errors and memory allocated per request for each endpoint. GET /updates is left out, as its
+event stream never ends.
+
+Runs against the MongoDB server at --uri, or mongomock when none is given (timings are then of the stand-in, and the
+transaction completions and cancellations, which need array filters it does not support, are left out). Results can be
+saved as a baseline and compared with a later run, unless requests failed, which makes the run exit with an error.
+
+benchmarks/baselines/endpoints-mongomock.json is the baseline of a mongomock run with --users 5 --securities 50
+--days 90 --transactions 50 --iterations 20 --seed 0, to be compared with runs of the same options.
+
+Usage: python -m benchmarks.endpoints [--uri URI] [--iterations N] [--users N] [--securities N] [--days N]
+                                      [--transactions N] [--seed N] [--save FILE] [--compare FILE] [--only SUBSTRING]
+"""
+import argparse
+import itertools
+import json
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+from src.config import PROFILE_HEADER
+from src.models.transactions import TransactionStatus
+from src.service import service
+from .data import seed_database, using_database, PASSWORD, ADMIN_USERNAME
+
+
+# Requests per endpoint traced to measure allocations (tracing slows requests down, so it is kept out of timings)
+ALLOCATION_SAMPLES = 5
+
+PERCENTILES = (50, 95, 99)
+
+# Endpoints issuing updates with array filters, which mongomock does not support
+ARRAY_FILTER_ENDPOINTS = ('PUT /transactions/{code}/complete', 'PUT /transactions/{code}/cancel')
+
+
+def percentile(values: list, percentile: int):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(percentile / 100 * (len(values) - 1))))]
+
+
+def _login(client: TestClient, username: str):
+    response = client.post('/sessions', data={'username': username, 'password': PASSWORD})
+    response.raise_for_status()
+    return {'Authorization': f'Bearer {response.json()["access_token"]}'}
+
+
+@contextmanager
+def _distinct_transaction_codes():
+    """
+    Give every transaction created a code a second apart: codes are creation times with a resolution of one second per
+    owner, so faster creations would collide.
+    """
+    ticks = itertools.count()
+    start = datetime.utcnow()
+
+    class Clock(datetime):
+        @classmethod
+        def utcnow(cls):
+            return start + timedelta(seconds=next(ticks))
+
+    with patch('src.operations.transactions.datetime', Clock):
+        yield
+
+
+def _get_endpoints(client: TestClient, database, args):
+    """Request builders by endpoint, each returning the (method, url, keyword arguments) of its n-th request."""
+    users = [u['username'] for u in database.users.find({'is_admin': False}, {'username': True}).sort('username')]
+    headers = {username: _login(client, username) for username in users}
+    user, admin = headers[users[0]], _login(client, ADMIN_USERNAME)
+    end = database.values.find_one({}, {'date': True}, sort=[('date', -1)])['date']
+    day = lambda n: (end - timedelta(days=n % args.days)).date().isoformat()  # noqa: E731
+    start = (end - timedelta(days=min(args.days - 1, 90))).date().isoformat()
+    # Pending transactions of every user, alternately completed and cancelled
+    pending = [
+        (headers[t['owner']], t['code'])
+        for t in database.transactions.find({'status': TransactionStatus.pending}, {'owner': True, 'code': True})
+    ]
+    if args.uri and len(pending) < 2 * (args.iterations + ALLOCATION_SAMPLES):
+        raise SystemExit(f'{len(pending)} pending transactions seeded, {2 * (args.iterations + ALLOCATION_SAMPLES)} '
+                         f'needed to complete or cancel a different one in every request (seed more transactions)')
+
+    security = database.instruments.find_one({'type': 'security'})['code']
+    sync_token = client.get('/sync', headers=user).json()['token']
+    profile = client.get('/institutions', headers={**admin, PROFILE_HEADER: '1'}).headers[PROFILE_HEADER].split(';')[0]
+    transaction = {
+        'description': 'Benchmark',
+        'total': {'instrument': 'USD', 'quantity': 100},
+        'entries': [
+            {'account': 'BROKERAGE', 'balance': {'instrument': security, 'quantity': 1}},
+            {'account': 'CURRENT', 'balance': {'instrument': 'USD', 'quantity': -100}}
+        ]
+    }
+
+    return {
+        'POST /users': lambda n: ('post', '/users', {'json': {'username': f'bench{n}', 'password': PASSWORD}}),
+        'POST /sessions': lambda n: ('post', '/sessions', {'data': {'username': users[0], 'password': PASSWORD}}),
+        'GET /sessions/current': lambda n: ('get', '/sessions/current', {'headers': user}),
+        'POST /institutions': lambda n: ('post', '/institutions', {
+            'json': {'type': 'bank', 'name': f'Bank {n}', 'code': f'BENCH{n}'}, 'headers': admin
+        }),
+        'GET /institutions': lambda n: ('get', '/institutions', {'headers': user}),
+        'PUT /institutions/{code}': lambda n: ('put', f'/institutions/BENCH{n}', {
+            'json': {'type': 'bank', 'name': f'Bank {n} renamed', 'code': f'BENCH{n}'}, 'headers': admin
+        }),
+        'DELETE /institutions/{code}': lambda n: ('delete', f'/institutions/BENCH{n}', {'headers': admin}),
+        'POST /instruments': lambda n: ('post', '/instruments', {
+            'json': {'type': 'security', 'description': f'Bench {n}', 'symbol': f'B{n}', 'exchange': 'NDQ'},
+            'headers': admin
+        }),
+        'GET /instruments': lambda n: ('get', '/instruments', {'headers': user}),
+        'GET /instruments/search': lambda n: ('get', '/instruments/search', {
+            'params': {'q': ('s', 'se', 'sec', 'security 1')[n % 4]}, 'headers': user
+        }),
+        'PUT /instruments/{code}': lambda n: ('put', f'/instruments/NDQ:B{n}', {
+            'json': {'type': 'security', 'description': f'Bench {n} renamed', 'symbol': f'B{n}', 'exchange': 'NDQ'},
+            'headers': admin
+        }),
+        'DELETE /instruments/{code}': lambda n: ('delete', f'/instruments/NDQ:B{n}', {'headers': admin}),
+        'PUT /instruments/{code}/values/{date_code}': lambda n: ('put', f'/instruments/USD/values/{day(n)}', {
+            'json': {'values': {'EUR': 0.9}}, 'headers': admin
+        }),
+        'GET /instruments/{code}/values/{date_code}': lambda n: ('get', f'/instruments/USD/values/{day(n)}', {
+            'headers': user
+        }),
+        'GET /instruments/{code}/rates/{date_code}': lambda n: ('get', f'/instruments/USD/rates/{day(n)}', {
+            'params': {'target': 'GBP'}, 'headers': user
+        }),
+        'POST /accounts': lambda n: ('post', '/accounts', {
+            'json': {'type': 'cash', 'code': f'BENCH{n}', 'description': f'Account {n}'}, 'headers': user
+        }),
+        'GET /accounts': lambda n: ('get', '/accounts', {'headers': user}),
+        'PUT /accounts/{code}': lambda n: ('put', f'/accounts/BENCH{n}', {
+            'json': {'type': 'cash', 'code': f'BENCH{n}', 'description': f'Account {n} renamed'}, 'headers': user
+        }),
+        'DELETE /accounts/{code}': lambda n: ('delete', f'/accounts/BENCH{n}', {'headers': user}),
+        'POST /transactions': lambda n: ('post', '/transactions', {
+            'json': transaction, 'headers': headers[users[n % len(users)]]
+        }),
+        'GET /transactions': lambda n: ('get', '/transactions', {'headers': user}),
+        'PUT /transactions/{code}/complete': lambda n: (
+            'put', f'/transactions/{pending[(2 * n) % len(pending)][1]}/complete',
+            {'headers': pending[(2 * n) % len(pending)][0]}
+        ),
+        'PUT /transactions/{code}/cancel': lambda n: (
+            'put', f'/transactions/{pending[(2 * n + 1) % len(pending)][1]}/cancel',
+            {'headers': pending[(2 * n + 1) % len(pending)][0]}
+        ),
+        'GET /portfolio/values': lambda n: ('get', '/portfolio/values', {
+            'params': {'start': start, 'end': day(0)}, 'headers': user
+        }),
+        'GET /portfolio/returns': lambda n: ('get', '/portfolio/returns', {
+            'params': {'start': start, 'end': day(0)}, 'headers': user
+        }),
+        'GET /portfolio/allocation': lambda n: ('get', '/portfolio/allocation', {
+            'params': {'by': ('type', 'institution', 'currency', 'exchange')[n % 4]}, 'headers': user
+        }),
+        'GET /snapshots': lambda n: ('get', '/snapshots', {'params': {'start': start, 'end': day(0)}, 'headers': user}),
+        'GET /snapshots/{date_code}': lambda n: ('get', f'/snapshots/{day(n)}', {'headers': user}),
+        'GET /holdings': lambda n: ('get', '/holdings', {'headers': user}),
+        'GET /sync': lambda n: ('get', '/sync', {'params': {'since': sync_token} if n % 2 else {}, 'headers': user}),
+        'GET /metrics': lambda n: ('get', '/metrics', {'headers': admin}),
+        'GET /profiles/{profile_id}': lambda n: ('get', f'/profiles/{profile}', {'headers': admin})
+    }
+
+
+def _measure(client: TestClient, build, iterations: int, offset: int = 0):
+    latencies, errors = [], 0
+    start = time.perf_counter()
+    for n in range(offset, offset + iterations):
+        method, url, kwargs = build(n)
+        request_start = time.perf_counter()
+        response = getattr(client, method)(url, **kwargs)
+        latencies.append(time.perf_counter() - request_start)
+        errors += response.status_code >= 400
+
+    return latencies, errors, time.perf_counter() - start
+
+
+def _measure_allocations(client: TestClient, build, samples: int, offset: int):
+    allocated = []
+    for n in range(offset, offset + samples):
+        method, url, kwargs = build(n)
+        # Restarted for every request, as resetting the peak alone needs Python 3.9
+        tracemalloc.start()
+        try:
+            getattr(client, method)(url, **kwargs)
+            _, peak = tracemalloc.get_traced_memory()
+
+        finally:
+            tracemalloc.stop()
+
+        allocated.append(peak)
+
+    return sum(allocated) / len(allocated)
+
+
+def run(args):
+    if args.uri:
+        from pymongo import MongoClient
+        database = MongoClient(args.uri)[args.database]
+
+    else:
+        import mongomock
+        database = mongomock.MongoClient()[args.database]
+
+    volumes = {k: getattr(args, k) for k in ('users', 'securities', 'days', 'transactions', 'seed')}
+    counts = seed_database(database, **volumes)
+    print(', '.join(f'{count} {collection}' for collection, count in counts.items()))
+
+    results = {}
+    with using_database(database), _distinct_transaction_codes():
+        client = TestClient(service)
+        endpoints = _get_endpoints(client, database, args)
+        for name, build in endpoints.items():
+            if (args.only and args.only not in name) or (not args.uri and name in ARRAY_FILTER_ENDPOINTS):
+                continue
+
+            latencies, errors, elapsed = _measure(client, build, args.iterations)
+            allocated = _measure_allocations(client, build, ALLOCATION_SAMPLES, args.iterations)
+            results[name] = {
+                **{f'p{p}': percentile(latencies, p) * 1000 for p in PERCENTILES},
+                'throughput': len(latencies) / elapsed,
+                'errors': errors,
+                'allocated_kb': allocated / 1024
+            }
+
+    if args.uri:
+        database.client.drop_database(args.database)
+
+    return {'volumes': volumes, 'iterations': args.iterations, 'results': results}
+
+
+def report(run_data: dict, baseline: dict = None):
+    baseline_results = (baseline or {}).get('results', {})
+    print(f'{"endpoint":<42}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"req/s":>9}{"errors":>8}{"alloc kB":>10}'
+          + ('   p50/p95/p99 vs baseline' if baseline else ''))
+    for name, result in run_data['results'].items():
+        line = f'{name:<42}' + ''.join(f'{result[f"p{p}"]:>9.2f}' for p in PERCENTILES) + \
+            f'{result["throughput"]:>9.1f}{result["errors"]:>8}{result["allocated_kb"]:>10.1f}'
+        previous = baseline_results.get(name)
+        if previous:
+            line += '   ' + '/'.join(
+                f'{(result[f"p{p}"] / previous[f"p{p}"] - 1) * 100:+.0f}%' if previous[f'p{p}'] else 'n/a'
+                for p in PERCENTILES
+            )
+
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--uri', help='MongoDB connection string (mongomock when not given)')
+    parser.add_argument('--database', default='portfolio_benchmark')
+    parser.add_argument('--iterations', type=int, default=100, help='requests per endpoint')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--securities', type=int, default=1000)
+    parser.add_argument('--days', type=int, default=730)
+    parser.add_argument('--transactions', type=int, default=500, help='transactions per user')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', help='file to save the results to, as a baseline for later runs')
+    parser.add_argument('--compare', help='baseline file to compare the results with')
+    parser.add_argument('--only', help='only benchmark endpoints containing this text')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    run_data = run(args)
+    report(run_data, baseline)
+
+    failed = [name for name, result in run_data['results'].items() if result['errors']]
+    if failed:
+        sys.exit(f'Requests failed for {", ".join(failed)}, so the results are not valid')
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(run_data, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
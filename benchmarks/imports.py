@@ -0,0 +1,45 @@
+"""
+Report the import time of modules, each in a fresh interpreter, with the packages that take longest to import.
+
+Usage: python -m benchmarks.imports [module ...] (by default the service, its configuration, migrations and models)
+"""
+import subprocess
+import sys
+from collections import Counter
+
+
+MODULES = ('src.service', 'src.config', 'src.migrations', 'src.models.transactions')
+
+# Packages listed for each module
+TOP_PACKAGES = 8
+
+
+def _import_times(module: str):
+    """Microseconds spent importing module, and importing each top level package (itself excluded) meanwhile."""
+    output = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'], capture_output=True, text=True, check=True
+    ).stderr
+    total, packages = 0, Counter()
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+
+        self_time, cumulative, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        packages[name.split('.')[0]] += int(self_time)
+        if name == module:
+            total = int(cumulative)
+
+    return total, packages
+
+
+def run(modules=MODULES):
+    for module in modules:
+        total, packages = _import_times(module)
+        print(f'{module}: {total / 1000:.1f} ms')
+        for package, self_time in packages.most_common(TOP_PACKAGES):
+            print(f'    {package:<24}{self_time / 1000:>8.1f} ms')
+
+
+if __name__ == '__main__':
+    run(sys.argv[1:] or MODULES)
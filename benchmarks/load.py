@@ -0,0 +1,206 @@
+"""
+Closed-loop load generator: virtual users replay a weighted mix of production traffic against the service in process,
+each sending its next request as soon as the previous one is answered.
+
+Concurrency is ramped up in stages, reporting throughput, error rate and latency percentiles for each one, and the
+stage where throughput stops growing with concurrency as the saturation point.
+
+Runs against the MongoDB server at --uri, or mongomock when none is given.
+
+Usage: python -m benchmarks.load [--uri URI] [--ramp 1,2,4,8,16,32] [--stage-duration SECONDS]
+                                 [--mix login=2,catalog=40,values=38,create=10,complete=10] [--think SECONDS]
+                                 [--users N] [--securities N] [--days N] [--transactions N] [--seed N]
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import timedelta
+
+import httpx
+
+from src.service import service
+from .data import seed_database, using_database, PASSWORD
+from .endpoints import percentile, PERCENTILES
+
+
+# Share of requests of each kind of traffic
+DEFAULT_MIX = {'login': 2, 'catalog': 40, 'values': 38, 'create': 10, 'complete': 10}
+
+# Throughput growth (relative to the previous stage) under which the service is considered saturated
+SATURATION_GROWTH = 0.1
+
+
+class VirtualUser:
+    """A user repeatedly picking its next request from the traffic mix, with its own session and pending transactions."""
+
+    def __init__(self, client: httpx.AsyncClient, username: str, context: dict, rng: random.Random):
+        self.client = client
+        self.username = username
+        self.context = context
+        self.rng = rng
+        self.headers = None
+        self.pending = []
+        self.last_created = 0
+
+    async def login(self):
+        response = await self.client.post('/sessions', data={'username': self.username, 'password': PASSWORD})
+        if response.status_code == 200:
+            self.headers = {'Authorization': f'Bearer {response.json()["access_token"]}'}
+
+        return response
+
+    async def catalog(self):
+        return await self.client.get(self.rng.choice(('/instruments', '/institutions')), headers=self.headers)
+
+    async def values(self):
+        code = self.rng.choice(self.context['instruments'])
+        date = self.context['end'] - timedelta(days=self.rng.randrange(self.context['days']))
+        return await self.client.get(f'/instruments/{code}/values/{date.date().isoformat()}', headers=self.headers)
+
+    async def create(self):
+        if time.monotonic() - self.last_created < 1:
+            # Transaction codes have a resolution of one second per owner
+            return await (self.complete() if self.pending else self.values())
+
+        self.last_created = time.monotonic()
+        response = await self.client.post('/transactions', json=self.context['transaction'], headers=self.headers)
+        if response.status_code == 200:
+            self.pending.append(response.json()['code'])
+
+        return response
+
+    async def complete(self):
+        if not self.pending:
+            return await self.create()
+
+        return await self.client.put(f'/transactions/{self.pending.pop(0)}/complete', headers=self.headers)
+
+    async def run(self, mix: dict, think: float, results: list, stop: asyncio.Event):
+        actions, weights = zip(*mix.items())
+        while not stop.is_set():
+            action = self.rng.choices(actions, weights)[0]
+            start = time.perf_counter()
+            try:
+                status_code = (await getattr(self, action)()).status_code
+
+            except Exception:
+                status_code = None
+
+            results.append((action, time.perf_counter() - start, status_code))
+            if think:
+                await asyncio.sleep(self.rng.expovariate(1 / think))
+
+
+async def _run_stage(users: list, concurrency: int, duration: float, mix: dict, think: float):
+    results, stop = [], asyncio.Event()
+    tasks = [asyncio.create_task(user.run(mix, think, results, stop)) for user in users[:concurrency]]
+    start = time.perf_counter()
+    await asyncio.sleep(duration)
+    stop.set()
+    await asyncio.gather(*tasks)
+    return results, time.perf_counter() - start
+
+
+def _summarise(concurrency: int, results: list, elapsed: float):
+    latencies = [latency for _, latency, _ in results]
+    errors = sum(1 for _, _, status_code in results if status_code is None or status_code >= 400)
+    return {
+        'concurrency': concurrency,
+        'requests': len(results),
+        'throughput': len(results) / elapsed,
+        'error_rate': errors / len(results) if results else 0,
+        **{f'p{p}': percentile(latencies, p) * 1000 if latencies else 0 for p in PERCENTILES}
+    }
+
+
+async def run(args):
+    if args.uri:
+        from pymongo import MongoClient
+        database = MongoClient(args.uri)[args.database]
+
+    else:
+        import mongomock
+        database = mongomock.MongoClient()[args.database]
+
+    mix = DEFAULT_MIX
+    if args.mix:
+        mix = {name: float(weight) for name, weight in (item.split('=') for item in args.mix.split(','))}
+
+    ramp = [int(c) for c in args.ramp.split(',')]
+    users = max(args.users, max(ramp))
+    seed_database(database, users=users, securities=args.securities, days=args.days, transactions=args.transactions,
+                  seed=args.seed)
+
+    instruments = sorted(database.values.distinct('instrument.code'))
+    context = {
+        'instruments': instruments,
+        'end': database.values.find_one({}, {'date': True}, sort=[('date', -1)])['date'],
+        'days': args.days,
+        'transaction': {
+            'description': 'Load',
+            'total': {'instrument': 'USD', 'quantity': 100},
+            'entries': [
+                {'account': 'BROKERAGE', 'balance': {'instrument': instruments[-1], 'quantity': 1}},
+                {'account': 'CURRENT', 'balance': {'instrument': 'USD', 'quantity': -100}}
+            ]
+        }
+    }
+
+    stages = []
+    with using_database(database):
+        transport = httpx.ASGITransport(app=service)
+        async with httpx.AsyncClient(transport=transport, base_url='http://load') as client:
+            rng = random.Random(args.seed)
+            usernames = sorted(u['username'] for u in database.users.find({'is_admin': False}, {'username': True}))
+            virtual_users = [VirtualUser(client, username, context, random.Random(rng.random())) for username in usernames]
+            await asyncio.gather(*(user.login() for user in virtual_users[:max(ramp)]))
+
+            print(f'{"time s":>7}{"users":>7}{"requests":>10}{"req/s":>9}{"errors":>8}'
+                  + ''.join(f'{f"p{p} ms":>9}' for p in PERCENTILES))
+            start = time.perf_counter()
+            for concurrency in ramp:
+                results, elapsed = await _run_stage(virtual_users, concurrency, args.stage_duration, mix, args.think)
+                stage = _summarise(concurrency, results, elapsed)
+                stages.append(stage)
+                print(f'{time.perf_counter() - start:>7.1f}{concurrency:>7}{stage["requests"]:>10}'
+                      f'{stage["throughput"]:>9.1f}{stage["error_rate"]:>8.1%}'
+                      + ''.join(f'{stage[f"p{p}"]:>9.1f}' for p in PERCENTILES))
+
+    if args.uri:
+        database.client.drop_database(args.database)
+
+    saturation = next(
+        (
+            previous for previous, stage in zip(stages, stages[1:])
+            if stage['throughput'] < previous['throughput'] * (1 + SATURATION_GROWTH)
+        ),
+        None
+    )
+    if saturation:
+        print(f'Saturated at {saturation["concurrency"]} concurrent users ({saturation["throughput"]:.1f} req/s)')
+
+    else:
+        print('Not saturated: throughput kept growing with concurrency')
+
+    return stages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--uri', help='MongoDB connection string (mongomock when not given)')
+    parser.add_argument('--database', default='portfolio_load')
+    parser.add_argument('--ramp', default='1,2,4,8,16,32', help='concurrent users of each stage')
+    parser.add_argument('--stage-duration', type=float, default=10, help='seconds each stage runs for')
+    parser.add_argument('--mix', help='weight of each kind of request, e.g. login=2,catalog=40,values=38')
+    parser.add_argument('--think', type=float, default=0, help='mean seconds each user waits between requests')
+    parser.add_argument('--users', type=int, default=32)
+    parser.add_argument('--securities', type=int, default=500)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--transactions', type=int, default=200, help='transactions per user')
+    parser.add_argument('--seed', type=int, default=0)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Compare trial validation of plain unions with discriminated unions dispatched on the type field.
+
+Usage: python -m benchmarks.models [documents] [repetitions]
+"""
+import sys
+import timeit
+
+from pydantic import parse_obj_as
+from pydantic.fields import List, Union
+
+from src.models.accounts import AccountOut, AccountType, CashAccount, FinancialAccount
+from src.models.instruments import Instrument, InstrumentOut, InstrumentType, Security
+
+
+def _instruments(count: int):
+    exchange = {'type': 'exchange', 'name': 'Nasdaq', 'code': 'NDQ'}
+    types = (InstrumentType.currency, InstrumentType.index, InstrumentType.security)
+    return [
+        {
+            'type': types[n % 3],
+            'description': f'Instrument {n}',
+            'symbol': f'I{n}',
+            'code': f'NDQ:I{n}' if types[n % 3] == InstrumentType.security else f'I{n}',
+            **({'exchange': exchange} if types[n % 3] == InstrumentType.security else {})
+        }
+        for n in range(count)
+    ]
+
+
+def _accounts(count: int):
+    types = (AccountType.cash, AccountType.bank, AccountType.investment)
+    instrument = {'type': 'currency', 'description': 'Euro', 'symbol': 'EUR', 'code': 'EUR'}
+    return [
+        {
+            'type': types[n % 3],
+            'code': f'A{n}',
+            'description': f'Account {n}',
+            'owner': 'potato',
+            'assets': [{'instrument': instrument, 'quantity': n}],
+            **({'holder': {'type': 'bank', 'name': 'Bank of Ireland', 'code': 'BOI'}} if n % 3 else {})
+        }
+        for n in range(count)
+    ]
+
+
+def run(count: int = 10000, repetitions: int = 5):
+    cases = {
+        'instruments': (_instruments(count), List[Union[Security, Instrument]], List[InstrumentOut]),
+        'accounts': (_accounts(count), List[Union[FinancialAccount, CashAccount]], List[AccountOut]),
+    }
+
+    print(f'{count} documents, best of {repetitions}')
+    for name, (documents, union, discriminated) in cases.items():
+        timings = [
+            min(timeit.repeat(lambda: parse_obj_as(model, documents), number=1, repeat=repetitions))
+            for model in (union, discriminated)
+        ]
+        print(f'{name:>12}: union {timings[0] * 1000:8.1f} ms, discriminated {timings[1] * 1000:8.1f} ms '
+              f'({timings[0] / timings[1]:.1f}x)')
+
+
+if __name__ == '__main__':
+    run(*(int(a) for a in sys.argv[1:]))
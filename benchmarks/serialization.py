@@ -0,0 +1,92 @@
+"""
+Compare the default response path (response model validation + jsonable_encoder) with the trusted one.
+
+Usage: python -m benchmarks.serialization [documents] [repetitions]
+"""
+import sys
+import time
+
+from bson import ObjectId
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from pydantic.fields import List, Union
+
+from src.models.instruments import Instrument, InstrumentType, Security
+from src.models.transactions import Transaction, TransactionStatus
+from src.responses import trusted
+
+
+def _instruments(count: int):
+    exchange = {'type': 'exchange', 'name': 'Nasdaq', 'code': 'NDQ'}
+    return [
+        {
+            '_id': ObjectId(),
+            'type': InstrumentType.security,
+            'description': f'Security {n}',
+            'symbol': f'S{n}',
+            'code': f'NDQ:S{n}',
+            'exchange': exchange
+        }
+        for n in range(count)
+    ]
+
+
+def _transactions(count: int):
+    instrument = {'_id': ObjectId(), 'type': 'currency', 'description': 'Euro', 'symbol': 'EUR', 'code': 'EUR'}
+    account = {'type': 'cash', 'code': 'WALLET', 'description': 'My wallet'}
+    return [
+        {
+            '_id': ObjectId(),
+            'owner': 'potato',
+            'code': f'2020-04-20T04:20:{n:06d}',
+            'description': f'Transaction {n}',
+            'status': TransactionStatus.completed,
+            'total': {'instrument': instrument, 'quantity': 10},
+            'entries': [
+                {'account': account, 'balance': {'instrument': instrument, 'quantity': q}, 'status': 'completed'}
+                for q in (10, -10)
+            ]
+        }
+        for n in range(count)
+    ]
+
+
+def _build_app(documents: dict):
+    app = FastAPI()
+    for name, (model, data) in documents.items():
+        def operation(data=data):
+            return data
+
+        app.get(f'/default/{name}', response_model=model)(operation)
+        app.get(f'/trusted/{name}', response_model=model)(trusted(operation, model))
+
+    return app
+
+
+def run(count: int = 5000, repetitions: int = 5):
+    documents = {
+        'instruments': (List[Union[Security, Instrument]], _instruments(count)),
+        'transactions': (List[Transaction], _transactions(count)),
+    }
+    client = TestClient(_build_app(documents))
+
+    print(f'{count} documents, best of {repetitions}')
+    for name in documents:
+        timings = {}
+        for path in ('default', 'trusted'):
+            best = None
+            for _ in range(repetitions):
+                start = time.perf_counter()
+                response = client.get(f'/{path}/{name}')
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+
+            assert response.status_code == 200
+            timings[path] = best
+
+        print(f'{name:>14}: default {timings["default"] * 1000:8.1f} ms, trusted {timings["trusted"] * 1000:8.1f} ms '
+              f'({timings["default"] / timings["trusted"]:.1f}x)')
+
+
+if __name__ == '__main__':
+    run(*(int(a) for a in sys.argv[1:]))
@@ -0,0 +1,66 @@
+"""
+Measure the cold start of a worker, in fresh interpreters: importing the service, running its startup hooks and
+answering a first request.
+
+The database is the one configured for the service (set MONGO_URI to point it elsewhere).
+
+Usage: python -m benchmarks.startup [runs] [path]
+"""
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+
+CHILD = '''
+import json
+import time
+
+start = time.time()
+from src.service import service
+imported = time.time()
+
+from fastapi.testclient import TestClient
+client = TestClient(service)
+hooks_start = time.time()
+with client:
+    started = time.time()
+    client.get({path!r})
+    answered = time.time()
+
+print(json.dumps({{
+    'interpreter': start,
+    'import': imported - start,
+    'startup': started - hooks_start,
+    'first_request': answered - started,
+    'answered': answered
+}}))
+'''
+
+STEPS = ('interpreter', 'import', 'startup', 'first_request', 'total')
+
+
+def _measure(path: str):
+    launched = time.time()
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD.format(path=path)], capture_output=True, text=True, check=True
+    ).stdout
+    timings = json.loads(output.strip().splitlines()[-1])
+    timings['total'] = timings.pop('answered') - launched
+    timings['interpreter'] -= launched
+    return timings
+
+
+def run(runs: int = 5, path: str = '/metrics'):
+    results = [_measure(path) for _ in range(runs)]
+
+    print(f'{runs} cold starts, first request to {path}')
+    print(f'{"step":<15}{"median ms":>11}{"min ms":>9}{"max ms":>9}')
+    for step in STEPS:
+        values = [r[step] * 1000 for r in results]
+        print(f'{step:<15}{statistics.median(values):>11.1f}{min(values):>9.1f}{max(values):>9.1f}')
+
+
+if __name__ == '__main__':
+    run(*(int(a) if n == 0 else a for n, a in enumerate(sys.argv[1:])))
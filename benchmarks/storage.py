@@ -0,0 +1,97 @@
+"""
+Measure the storage taken by seeded synthetic data before and after the migration replacing the institutions and
+instruments embedded in documents by references.
+
+Runs against the MongoDB server at --uri, reporting the sizes it reports (storage sizes are compressed), or mongomock
+when none is given, reporting the BSON sizes of the documents.
+
+Usage: python -m benchmarks.storage [--uri URI] [--users N] [--securities N] [--days N] [--transactions N] [--seed N]
+"""
+import argparse
+import time
+
+import bson
+
+from src.migrations import MIGRATIONS, migrate, reference_catalog_documents
+from src.references import REFERENCES
+from .data import seed_database
+
+
+# Schema version the migration to references brings the database to
+REFERENCES_VERSION = next(n for n, (_, m) in enumerate(MIGRATIONS, 1) if m is reference_catalog_documents)
+
+
+def _measure(database, collection: str, server: bool):
+    if server:
+        stats = database.command('collStats', collection)
+        return {'documents': stats['count'], 'size': stats['size'], 'storage': stats['storageSize']}
+
+    sizes = [len(bson.encode(document)) for document in database[collection].find()]
+    return {'documents': len(sizes), 'size': sum(sizes), 'storage': None}
+
+
+def run(args):
+    if args.uri:
+        from pymongo import MongoClient
+        database = MongoClient(args.uri)[args.database]
+
+    else:
+        import mongomock
+        database = mongomock.MongoClient()[args.database]
+
+    volumes = {k: getattr(args, k) for k in ('users', 'securities', 'days', 'transactions', 'seed')}
+    counts = seed_database(database, REFERENCES_VERSION - 1, **volumes)
+    print(', '.join(f'{count} {collection}' for collection, count in counts.items()))
+
+    before = {c: _measure(database, c, bool(args.uri)) for c in REFERENCES}
+    start = time.perf_counter()
+    migrate(database, REFERENCES_VERSION)
+    elapsed = time.perf_counter() - start
+    after = {c: _measure(database, c, bool(args.uri)) for c in REFERENCES}
+
+    if args.uri:
+        database.client.drop_database(args.database)
+
+    return before, after, elapsed
+
+
+def report(before: dict, after: dict, elapsed: float):
+    def change(old, new):
+        return f'{(new / old - 1) * 100:+.0f}%' if old else 'n/a'
+
+    server = any(m['storage'] is not None for m in before.values())
+    print(f'{"collection":<14}{"documents":>11}{"size kB":>11}{"after kB":>11}{"change":>9}{"avg B":>9}{"after B":>9}'
+          + (f'{"storage kB":>12}{"after kB":>11}' if server else ''))
+    for name in before:
+        old, new = before[name], after[name]
+        documents = old['documents'] or 1
+        line = f'{name:<14}{old["documents"]:>11}{old["size"] / 1024:>11.1f}{new["size"] / 1024:>11.1f}' + \
+            f'{change(old["size"], new["size"]):>9}{old["size"] / documents:>9.0f}{new["size"] / documents:>9.0f}'
+        if server:
+            line += f'{old["storage"] / 1024:>12.1f}{new["storage"] / 1024:>11.1f}'
+
+        print(line)
+
+    total_before = sum(m['size'] for m in before.values())
+    total_after = sum(m['size'] for m in after.values())
+    print(f'{"total":<14}{"":>11}{total_before / 1024:>11.1f}{total_after / 1024:>11.1f}'
+          f'{change(total_before, total_after):>9}')
+    print(f'Migrated in {elapsed:.2f}s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--uri', help='MongoDB connection string (mongomock when not given)')
+    parser.add_argument('--database', default='portfolio_benchmark')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--securities', type=int, default=1000)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--transactions', type=int, default=500, help='transactions per user')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    report(*run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+import numpy as np
+
+
+DAYS_PER_YEAR = 365
+
+
+def time_weighted_return(values: np.ndarray, flows: np.ndarray):
+    """
+    Time-weighted return of a series of daily values with the external flows of each day.
+
+    Flows are assumed to happen at the start of their day, so the return of every day is its closing value over the
+    previous closing value plus the flows. Days without capital invested (zero or negative base) are left out.
+    """
+    bases = values[:-1] + flows[1:]
+    invested = bases > 0
+    factors = np.divide(values[1:], bases, out=np.ones_like(bases, dtype=float), where=invested)
+    return float(np.prod(factors) - 1)
+
+
+def _npv(rate: float, times: np.ndarray, amounts: np.ndarray):
+    discounts = np.power(1 + rate, -times)
+    return np.dot(amounts, discounts), np.dot(-times * amounts, discounts / (1 + rate))
+
+
+def internal_rate_of_return(times: np.ndarray, amounts: np.ndarray, guess: float = 0.1, tolerance: float = 1e-10,
+                            max_iterations: int = 50):
+    """
+    Annual rate that brings the net present value of amounts (paid at times, in years) to zero.
+
+    Newton's method converges in a handful of iterations for regular cash flows, when it does not (flat or diverging
+    steps) the root is bracketed and bisected instead. Returns None if the flows have no rate (eg, all of one sign).
+    """
+    times, amounts = np.asarray(times, dtype=float), np.asarray(amounts, dtype=float)
+    if not (np.any(amounts > 0) and np.any(amounts < 0)):
+        return None
+
+    rate = guess
+    for _ in range(max_iterations):
+        value, derivative = _npv(rate, times, amounts)
+        if abs(value) < tolerance:
+            return float(rate)
+
+        if not derivative:
+            break
+
+        step = value / derivative
+        rate -= step
+        if not np.isfinite(rate) or rate <= -1:
+            break
+
+        if abs(step) < tolerance:
+            return float(rate)
+
+    return _bisect_rate(times, amounts, tolerance)
+
+
+def _bisect_rate(times: np.ndarray, amounts: np.ndarray, tolerance: float):
+    low, high = -0.999999, 1.0
+    low_value = _npv(low, times, amounts)[0]
+    high_value = _npv(high, times, amounts)[0]
+    while np.sign(low_value) == np.sign(high_value):
+        high *= 2
+        if high > 1e6:
+            return None
+
+        high_value = _npv(high, times, amounts)[0]
+
+    while high - low > tolerance:
+        middle = (low + high) / 2
+        middle_value = _npv(middle, times, amounts)[0]
+        if np.sign(middle_value) == np.sign(low_value):
+            low, low_value = middle, middle_value
+
+        else:
+            high = middle
+
+    return float((low + high) / 2)
+
+
+def money_weighted_return(values: np.ndarray, flows: np.ndarray):
+    """
+    Annualized money-weighted return (IRR) of a series of daily values with the external flows of each day.
+
+    The initial value and every flow are treated as contributions of the investor and the final value as the amount
+    withdrawn at the end of the period.
+    """
+    amounts = -flows.astype(float)
+    amounts[0] = -values[0]
+    amounts[-1] += values[-1]
+    times = np.arange(len(values)) / DAYS_PER_YEAR
+    relevant = amounts != 0
+
+    return internal_rate_of_return(times[relevant], amounts[relevant])
@@ -0,0 +1,176 @@
+import functools
+import inspect
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from enum import Enum
+
+
+_MISSING = object()
+
+# Every cache created, to be cleared when changes made by other workers may have been missed
+_caches = weakref.WeakSet()
+
+
+class Cache:
+    """
+    Thread-safe in-process LRU cache.
+
+    Entries are kept until evicted or invalidated, unless a fallback TTL is set (see set_fallback_ttl), in which case
+    entries older than it are treated as missing.
+    """
+
+    fallback_ttl = None
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        _caches.add(self)
+
+    def get(self, key, default=None):
+        with self._lock:
+            value, stored = self._data.get(key, (_MISSING, None))
+            if value is _MISSING:
+                return default
+
+            if Cache.fallback_ttl is not None and time.monotonic() - stored > Cache.fallback_ttl:
+                del self._data[key]
+                return default
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def get_or_set(self, key, factory):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = factory()
+            self.set(key, value)
+
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+def set_fallback_ttl(ttl: float = None):
+    """Expire the entries of every cache after ttl seconds, while invalidations may be missed (None to stop)."""
+    Cache.fallback_ttl = ttl
+
+
+def clear_caches():
+    for cache in list(_caches):
+        cache.clear()
+
+
+class Versions:
+    """Counters identifying the current version of some data, to be bumped every time the data changes."""
+
+    def __init__(self):
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self._versions.get(key, 0)
+
+    def bump(self, key):
+        with self._lock:
+            self._versions[key] = self._versions.get(key, 0) + 1
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first one runs, and the rest wait for it and share its result
+    (or exception), which is not kept once the call completes.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+
+            return flight.result
+
+        try:
+            flight.result = function()
+
+        except Exception as e:
+            flight.error = e
+            raise
+
+        finally:
+            with self._lock:
+                del self._flights[key]
+
+            flight.done.set()
+
+        return flight.result
+
+    def __len__(self):
+        return len(self._flights)
+
+
+flights = SingleFlight()
+
+
+def _normalize(value):
+    return value.value if isinstance(value, Enum) else value
+
+
+def single_flight(ignore: tuple = (), **normalizers):
+    """
+    Coalesce concurrent calls to the decorated function with the same normalized arguments into a single call.
+
+    Arguments in ignore (like the user a read does not depend on) are left out of the key, and normalizers map
+    argument names to functions making equivalent values equal. Results are shared, so they must not be modified.
+    """
+    def decorator(function):
+        signature = inspect.signature(function)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            arguments = signature.bind(*args, **kwargs)
+            arguments.apply_defaults()
+            key = (function.__module__, function.__name__, *(
+                (name, normalizers.get(name, _normalize)(value))
+                for name, value in arguments.arguments.items() if name not in ignore
+            ))
+            return flights.do(key, lambda: function(*args, **kwargs))
+
+        return wrapper
+
+    return decorator
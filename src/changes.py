@@ -0,0 +1,144 @@
+import logging
+import threading
+import time
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from .cache import clear_caches, set_fallback_ttl
+from .events import Event, publish
+
+
+logger = logging.getLogger(__name__)
+
+# Error code of change streams that cannot resume because the oplog no longer holds their resume token
+CHANGE_STREAM_HISTORY_LOST = 286
+# Error code of change streams opened on standalone servers, which only replica sets and sharded clusters support
+CHANGE_STREAM_UNSUPPORTED = 40573
+
+
+class ChangeListener:
+    """
+    Publishes a data_changed event for every change to the watched collections, made by this or any other worker, so
+    in-process caches are invalidated everywhere.
+
+    The resume token of the stream is saved to the meta collection, so the stream resumes where it stopped after being
+    dropped. While it is down, invalidations may be missed, so caches fall back to expiring their entries after
+    fallback_ttl seconds, and are cleared when changes cannot be resumed. Servers without change streams (standalone
+    ones) are only tried once, and caches keep expiring their entries.
+
+    Workers of a deployment share the name of their stream, so workers restarted resume where the deployment was.
+    """
+
+    def __init__(self, name: str, collections: tuple, fallback_ttl: float, retry_delay: float = 5,
+                 save_interval: float = 1):
+        self.name = name
+        self.collections = collections
+        self.fallback_ttl = fallback_ttl
+        self.retry_delay = retry_delay
+        self.save_interval = save_interval
+        self.database = None
+        # Whether the stream is up, so every change is being published
+        self.watching = False
+        self._token = None
+        self._saved_token = None
+        self._saved_at = 0
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def _load_token(self):
+        document = self.database.meta.find_one({'_id': f'change_stream:{self.name}'})
+        self._token = self._saved_token = document['token'] if document else None
+
+    def _save_token(self, force: bool = False):
+        if self._token == self._saved_token or not (force or time.monotonic() - self._saved_at >= self.save_interval):
+            return
+
+        self.database.meta.update_one(
+            {'_id': f'change_stream:{self.name}'},
+            {'$set': {'token': self._token}},
+            upsert=True
+        )
+        self._saved_token, self._saved_at = self._token, time.monotonic()
+
+    def _handle(self, change: dict):
+        publish(
+            Event.data_changed,
+            collection=change['ns']['coll'],
+            operation=change['operationType'],
+            key=change.get('documentKey'),
+            document=change.get('fullDocument')
+        )
+
+    def _watch(self):
+        pipeline = [{'$match': {'ns.coll': {'$in': list(self.collections)}}}]
+        with self.database.watch(pipeline, full_document='updateLookup', resume_after=self._token,
+                                 max_await_time_ms=1000) as stream:
+            # Changes missed while the stream was down (if any) are replayed from the resume token
+            set_fallback_ttl(None)
+            self.watching = True
+            try:
+                while not self._stopping.is_set() and stream.alive:
+                    change = stream.try_next()
+                    self._token = stream.resume_token
+                    if change is not None:
+                        self._handle(change)
+
+                    self._save_token()
+
+            finally:
+                self.watching = False
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                if self._token is None:
+                    self._load_token()
+
+                self._watch()
+
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAM_UNSUPPORTED:
+                    logger.warning('Change streams are not supported by the server, expiring cache entries after %s '
+                                   'seconds instead', self.fallback_ttl)
+                    set_fallback_ttl(self.fallback_ttl)
+                    break
+
+                if e.code != CHANGE_STREAM_HISTORY_LOST:
+                    self._dropped(e)
+                    continue
+
+                logger.warning('Changes since the resume token of %s were lost, clearing caches', self.name)
+                self._token = None
+                clear_caches()
+
+            except PyMongoError as e:
+                self._dropped(e)
+
+        try:
+            self._save_token(force=True)
+
+        except PyMongoError:
+            logger.exception('Could not save the resume token of change stream %s', self.name)
+
+    def _dropped(self, error: Exception):
+        logger.warning('Change stream %s dropped (%s), expiring cache entries after %s seconds until it resumes',
+                       self.name, error, self.fallback_ttl)
+        set_fallback_ttl(self.fallback_ttl)
+        self._stopping.wait(self.retry_delay)
+
+    def start(self, database):
+        if self._thread:
+            return
+
+        self.database = database
+        # Until the stream is up, changes by other workers are not seen
+        set_fallback_ttl(self.fallback_ttl)
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name=f'changes-{self.name}', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = None):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
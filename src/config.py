@@ -1,7 +1,13 @@
-from fastapi.security import OAuth2PasswordBearer
-from passlib.context import CryptContext
+import os
+import tempfile
+
 from pymongo import MongoClient
 
+from .changes import ChangeListener
+from .lazy import Lazy
+from .tracing import command_tracker
+from .slow_queries import SlowQueryLog
+
 
 # Database configuration
 
@@ -17,9 +23,31 @@ DB = {
     }
 }
 
-CONNECTION_STRING = '{schema}://{username}:{password}@{host}/{path}'.format(**DB['auth'], **DB['connection'])
+CONNECTION_STRING = os.environ.get('MONGO_URI') or \
+    '{schema}://{username}:{password}@{host}/{path}'.format(**DB['auth'], **DB['connection'])
+
+# Commands slower than this (in seconds) get their query plan explained and logged
+SLOW_QUERY_THRESHOLD = 0.1
+
+slow_query_log = SlowQueryLog(SLOW_QUERY_THRESHOLD)
+
+
+def _connect():
+    # Resolves the SRV record of the connection string, so it is only done when the database is first used
+    return MongoClient(CONNECTION_STRING, event_listeners=[command_tracker, slow_query_log]).portfolio
+
+
+database = Lazy(_connect)
 
-database = MongoClient(CONNECTION_STRING).portfolio
+# Collections whose changes by any worker invalidate the caches of every worker (needs a replica set)
+WATCHED_COLLECTIONS = ('institutions', 'instruments', 'values', 'accounts', 'transactions', 'users')
+# Name of the change stream of the deployment, under which its resume token is saved (set one per deployment sharing
+# the database)
+CHANGE_STREAM_NAME = os.environ.get('CHANGE_STREAM_NAME') or 'default'
+# Seconds after which cached entries expire while the change stream is down
+CHANGE_STREAM_FALLBACK_TTL = 30
+
+change_listener = ChangeListener(CHANGE_STREAM_NAME, WATCHED_COLLECTIONS, CHANGE_STREAM_FALLBACK_TTL)
 
 
 # Auth configuration
@@ -28,8 +56,62 @@ SECRET_KEY = "09d25e094faa6ca2556c818166b7a9563b93f7099f6f0f4caa6cf63b88e8d3e7"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl='/sessions')
-password_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
+
+def _create_password_context():
+    # Importing passlib and loading its bcrypt backend is slow, and only needed to create users or sessions
+    from passlib.context import CryptContext
+    return CryptContext(schemes=['bcrypt'], deprecated='auto')
+
+
+password_context = Lazy(_create_password_context)
+
+
+# Portfolio configuration
+
+# Cost of the units disposed of: the one of the oldest lots (fifo) or the average cost of the holding (average)
+COST_BASIS_METHOD = 'fifo'
+
+
+# Search configuration
+
+# Most results a search may ask for
+SEARCH_MAX_RESULTS = 50
+
+
+# Sync configuration
+
+# Seconds tombstones of deleted documents are kept for: clients syncing less often get all their documents again
+SYNC_DELETIONS_TTL = 30 * 24 * 3600
+# Seconds an operation may take to write its changes after getting their version: changes updated this long before a
+# sync are synced again by the next one
+SYNC_WRITES_TIMEOUT = 60
+
+
+# Updates stream configuration
+
+# Messages kept for a client of the updates stream before it is considered too slow and dropped
+UPDATES_MAX_PENDING = 100
+# Seconds without updates after which a heartbeat is sent
+UPDATES_HEARTBEAT = 15
+
+
+# Metrics configuration
+
+# Bearer token scrapers send to read the metrics, which admin users can read with their own token (unset to only allow
+# admin users)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+
+# Profiling configuration
+
+# Header requesting a profile of the request, holding its expiring signature (see profiling.sign) or any value for
+# admin users
+PROFILE_HEADER = 'X-Profile'
+# Seconds between samples of profiled requests
+PROFILE_INTERVAL = 0.001
+PROFILES_DIRECTORY = os.path.join(tempfile.gettempdir(), 'portfolio-profiles')
+# Number of latest profiles kept in PROFILES_DIRECTORY, older ones being removed as new ones are saved
+PROFILES_KEPT = 100
 
 
 CORS_ORIGINS = (
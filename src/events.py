@@ -0,0 +1,38 @@
+import logging
+from collections import defaultdict
+from enum import Enum
+
+
+logger = logging.getLogger(__name__)
+
+
+class Event(str, Enum):
+    account_changed = 'account_changed'
+    balance_changed = 'balance_changed'
+    value_changed = 'value_changed'
+    instrument_changed = 'instrument_changed'
+    institution_changed = 'institution_changed'
+    # Any stored document changed, by this or any other worker (see changes.ChangeListener)
+    data_changed = 'data_changed'
+
+
+_subscribers = defaultdict(list)
+
+
+def subscribe(event: Event, handler=None):
+    """Register handler to be called with the event data every time event is published (usable as decorator)."""
+    if handler is None:
+        return lambda h: subscribe(event, h)
+
+    _subscribers[event].append(handler)
+    return handler
+
+
+def publish(event: Event, **data):
+    # Subscribers react to changes already stored, so their failures must not fail the operation that published them
+    for handler in _subscribers[event]:
+        try:
+            handler(**data)
+
+        except Exception:
+            logger.exception('Subscriber %s failed for event %s', handler.__name__, event.value)
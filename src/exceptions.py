@@ -1,7 +1,11 @@
 import functools
+import time
 
 from fastapi import status, HTTPException
 
+from .metrics import operation_latency, operations_in_flight, operation_errors
+from .profiling import current_profile
+
 
 class ServiceError(Exception):
     pass
@@ -45,18 +49,34 @@ DEFAULT_RESPONSE = {
 
 
 def handled(controller):
+    operation = controller.__name__
+
     @functools.wraps(controller)
     def wrap_controller(*args, **kwargs):
+        operations_in_flight.inc(operation)
+        start = time.perf_counter()
+        status_code = status.HTTP_200_OK
+        profile = current_profile.get()
+        profiled_thread = profile is not None and profile.add_thread()
+
         try:
             return controller(*args, **kwargs)
 
         except Exception as e:
             response_data = EXCEPTION_RESPONSE.get(type(e), DEFAULT_RESPONSE)
+            status_code = response_data.get('status')
+            operation_errors.inc(operation, status_code)
             raise HTTPException(
-                status_code=response_data.get('status'),
+                status_code=status_code,
                 detail=response_data.get('detail') or f'{e}',
                 headers=response_data.get('headers')
             )
 
-    return wrap_controller
+        finally:
+            if profiled_thread:
+                profile.remove_thread()
+
+            operations_in_flight.dec(operation)
+            operation_latency.observe(time.perf_counter() - start, operation, status_code)
 
+    return wrap_controller
@@ -0,0 +1,228 @@
+import pymongo
+
+from .config import SYNC_DELETIONS_TTL
+
+
+# Indexes of every collection, as (keys, options) pairs
+INDEXES = {
+    'users': [
+        (
+            [
+                ('username', pymongo.ASCENDING)
+            ],
+            {'unique': True}
+        )
+    ],
+    'institutions': [
+        (
+            [
+                ('type', pymongo.ASCENDING),
+                ('code', pymongo.ASCENDING)
+            ],
+            {'unique': True}
+        ),
+        (
+            [
+                ('code', pymongo.ASCENDING)
+            ],
+            {}
+        )
+    ],
+    'instruments': [
+        (
+            [
+                ('type', pymongo.ASCENDING),
+                ('symbol', pymongo.ASCENDING)
+            ],
+            {}
+        ),
+        (
+            [
+                ('code', pymongo.ASCENDING)
+            ],
+            {'unique': True}
+        )
+    ],
+    'accounts': [
+        (
+            [
+                ('owner', pymongo.ASCENDING),
+                ('code', pymongo.ASCENDING)
+            ],
+            {'unique': True}
+        ),
+        (
+            [
+                ('owner', pymongo.ASCENDING),
+                ('version', pymongo.ASCENDING)
+            ],
+            {}
+        ),
+        (
+            [
+                ('owner', pymongo.ASCENDING),
+                ('updated_at', pymongo.ASCENDING)
+            ],
+            {}
+        ),
+        (
+            [
+                ('assets.instrument.code', pymongo.ASCENDING)
+            ],
+            {}
+        )
+    ],
+    'transactions': [
+        (
+            [
+                ('owner', pymongo.ASCENDING),
+                ('code', pymongo.ASCENDING)
+            ],
+            {'unique': True}
+        ),
+        (
+            [
+                ('owner', pymongo.ASCENDING),
+                ('status', pymongo.ASCENDING),
+                ('code', pymongo.ASCENDING)
+            ],
+            {}
+        ),
+        (
+            [
+                ('owner', pymongo.ASCENDING),
+                ('entries.account.code', pymongo.ASCENDING),
+                ('code', pymongo.ASCENDING)
+            ],
+            {}
+        ),
+        (
+            [
+                ('owner', pymongo.ASCENDING),
+                ('entries.balance.instrument.code', pymongo.ASCENDING),
+                ('code', pymongo.ASCENDING)
+            ],
+            {}
+        ),
+        (
+            [
+                ('owner', pymongo.ASCENDING),
+                ('version', pymongo.ASCENDING)
+            ],
+            {}
+        ),
+        (
+            [
+                ('owner', pymongo.ASCENDING),
+                ('updated_at', pymongo.ASCENDING)
+            ],
+            {}
+        ),
+        (
+            [
+                ('owner', pymongo.ASCENDING),
+                ('entries.completed_at', pymongo.ASCENDING)
+            ],
+            {}
+        )
+    ],
+    'deletions': [
+        (
+            [
+                ('owner', pymongo.ASCENDING),
+                ('version', pymongo.ASCENDING)
+            ],
+            {}
+        ),
+        (
+            [
+                ('owner', pymongo.ASCENDING),
+                ('deleted_at', pymongo.ASCENDING)
+            ],
+            {}
+        ),
+        (
+            [
+                ('deleted_at', pymongo.ASCENDING)
+            ],
+            {'expireAfterSeconds': SYNC_DELETIONS_TTL}
+        )
+    ],
+    'values': [
+        (
+            [
+                ('instrument.code', pymongo.ASCENDING),
+                ('date', pymongo.DESCENDING)
+            ],
+            {'unique': True}
+        )
+    ],
+    'snapshots': [
+        (
+            [
+                ('owner', pymongo.ASCENDING),
+                ('date', pymongo.ASCENDING)
+            ],
+            {'unique': True}
+        ),
+        (
+            [
+                ('accounts.assets.instrument', pymongo.ASCENDING),
+                ('date', pymongo.ASCENDING)
+            ],
+            {}
+        ),
+        (
+            [
+                ('date', pymongo.ASCENDING)
+            ],
+            {}
+        )
+    ],
+    'holdings': [
+        (
+            [
+                ('owner', pymongo.ASCENDING),
+                ('account', pymongo.ASCENDING),
+                ('instrument', pymongo.ASCENDING)
+            ],
+            {'unique': True}
+        )
+    ],
+    'lots': [
+        (
+            [
+                ('owner', pymongo.ASCENDING),
+                ('account', pymongo.ASCENDING),
+                ('instrument', pymongo.ASCENDING),
+                ('transaction', pymongo.ASCENDING),
+                ('entry', pymongo.ASCENDING)
+            ],
+            {}
+        ),
+        (
+            [
+                ('owner', pymongo.ASCENDING),
+                ('transaction', pymongo.ASCENDING),
+                ('entry', pymongo.ASCENDING)
+            ],
+            {'unique': True}
+        )
+    ],
+    'disposals': [
+        (
+            [
+                ('owner', pymongo.ASCENDING),
+                ('transaction', pymongo.ASCENDING),
+                ('entry', pymongo.ASCENDING)
+            ],
+            {'unique': True}
+        )
+    ]
+}
+
+
+def create_indexes(database):
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            database[collection].create_index(keys, **options)
@@ -0,0 +1,32 @@
+import threading
+
+
+class Lazy:
+    """
+    Proxy to an object created by factory on first use, so that importing the modules holding it stays cheap.
+
+    Attribute and item access are forwarded to the object, which is only created once even with concurrent first uses.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._target = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._target is not None
+
+    def _get_target(self):
+        if self._target is None:
+            with self._lock:
+                if self._target is None:
+                    self._target = self._factory()
+
+        return self._target
+
+    def __getattr__(self, name: str):
+        return getattr(self._get_target(), name)
+
+    def __getitem__(self, key):
+        return self._get_target()[key]
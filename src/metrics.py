@@ -0,0 +1,161 @@
+import abc
+import threading
+
+
+# Upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class _Shards:
+    """
+    Metric values split by thread: every thread only writes to its own shard, so updates need no locks.
+
+    Readers merge copies of every shard, and shards of finished threads are kept so their values are not lost.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+
+    def get(self):
+        try:
+            return self._local.shard
+
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append(shard)
+
+            return shard
+
+    def copies(self):
+        with self._lock:
+            shards = list(self._shards)
+
+        return [shard.copy() for shard in shards]
+
+
+class Metric(abc.ABC):
+    type = None
+
+    def __init__(self, name: str, description: str, labels: tuple = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._shards = _Shards()
+        registry.append(self)
+
+    def _format_labels(self, values: tuple, **extra):
+        pairs = [*zip(self.labels, values), *extra.items()]
+        if not pairs:
+            return ''
+
+        return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+    @abc.abstractmethod
+    def samples(self):
+        """(name, formatted labels, value) of every sample of the metric."""
+
+    def render(self):
+        return '\n'.join([
+            f'# HELP {self.name} {self.description}',
+            f'# TYPE {self.name} {self.type}',
+            *(f'{name}{labels} {value}' for name, labels, value in self.samples())
+        ])
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, *labels, amount: float = 1):
+        shard = self._shards.get()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def values(self):
+        totals = {}
+        for shard in self._shards.copies():
+            for labels, value in shard.items():
+                totals[labels] = totals.get(labels, 0) + value
+
+        return totals
+
+    def samples(self):
+        return [(self.name, self._format_labels(labels), value) for labels, value in sorted(self.values().items())]
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, description: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, *labels):
+        shard = self._shards.get()
+        counts = shard.get(labels)
+        if counts is None:
+            # One count per bucket, plus the count of values above every bucket and the sum of all values
+            counts = shard[labels] = [0] * (len(self.buckets) + 2)
+
+        for n, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[n] += 1
+                break
+
+        else:
+            counts[-2] += 1
+
+        counts[-1] += value
+
+    def values(self):
+        totals = {}
+        for shard in self._shards.copies():
+            for labels, counts in shard.items():
+                current = totals.setdefault(labels, [0] * len(counts))
+                for n, count in enumerate(list(counts)):
+                    current[n] += count
+
+        return totals
+
+    def samples(self):
+        samples = []
+        for labels, counts in sorted(self.values().items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                samples.append((f'{self.name}_bucket', self._format_labels(labels, le=bound), cumulative))
+
+            samples.append((f'{self.name}_sum', self._format_labels(labels), counts[-1]))
+            samples.append((f'{self.name}_count', self._format_labels(labels), cumulative))
+
+        return samples
+
+
+registry = []
+
+
+def render():
+    """Every registered metric in Prometheus text exposition format."""
+    return '\n'.join(metric.render() for metric in registry) + '\n'
+
+
+operation_latency = Histogram(
+    'operation_duration_seconds', 'Duration of service operations.', ('operation', 'status')
+)
+operations_in_flight = Gauge(
+    'operations_in_flight', 'Service operations currently being processed.', ('operation',)
+)
+operation_errors = Counter(
+    'operation_errors_total', 'Service operations that failed, by mapped response status.', ('operation', 'status')
+)
+subscribers_dropped = Counter(
+    'pubsub_subscribers_dropped_total', 'Subscribers dropped for falling behind the messages published to them.'
+)
@@ -0,0 +1,141 @@
+"""
+Versioned database migrations, applied by a deployment step instead of on every worker start.
+
+Usage: python -m src.migrations [--check]
+"""
+import argparse
+import logging
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+from .config import database as default_database
+from .indexes import create_indexes
+from .models.transactions import TransactionStatus
+from .references import migrate_references
+
+
+logger = logging.getLogger(__name__)
+
+# Document of the meta collection holding the version of the database schema
+SCHEMA_DOCUMENT = 'schema'
+
+
+def reference_catalog_documents(database):
+    migrate_references(database)
+    # Currency values are found by instrument code instead of type, which references no longer keep
+    if 'date_-1_instrument.type_1' in database.values.index_information():
+        database.values.drop_index('date_-1_instrument.type_1')
+
+
+def date_completed_entries(database, batch_size: int = 1000):
+    # Entries completed before their completion time was kept are dated by the code of their transaction
+    requests = []
+    for transaction in database.transactions.find(
+        {'entries': {'$elemMatch': {'status': TransactionStatus.completed, 'completed_at': {'$exists': False}}}},
+        {'code': True, 'entries.status': True, 'entries.completed_at': True}
+    ):
+        completed_at = datetime.fromisoformat(transaction['code'])
+        requests.append(UpdateOne(
+            {'_id': transaction['_id']},
+            {
+                '$set': {
+                    f'entries.{n}.completed_at': completed_at
+                    for n, entry in enumerate(transaction['entries'])
+                    if entry['status'] == TransactionStatus.completed and 'completed_at' not in entry
+                }
+            }
+        ))
+
+        if len(requests) >= batch_size:
+            database.transactions.bulk_write(requests, ordered=False)
+            requests = []
+
+    if requests:
+        database.transactions.bulk_write(requests, ordered=False)
+
+    create_indexes(database)
+
+
+def remove_process_resume_tokens(database):
+    # Change streams were named after each worker process, leaving a resume token behind every restart
+    database.meta.delete_many({'_id': {'$regex': '^change_stream:'}})
+
+
+# Migrations in the order they are applied, as (description, function applying it to the database) pairs: the
+# schema version is the number of migrations applied. Creating indexes only creates the ones missing.
+MIGRATIONS = [
+    ('Create indexes', create_indexes),
+    ('Index document versions and deletions for sync', create_indexes),
+    ('Index transactions by status, account and instrument', create_indexes),
+    ('Reference institutions and instruments instead of embedding them', reference_catalog_documents),
+    ('Index snapshots by date and instrument', create_indexes),
+    ('Remove the resume tokens of change streams named after worker processes', remove_process_resume_tokens),
+    ('Index institutions by code', create_indexes),
+    ('Index document updates and deletions by time for sync', create_indexes),
+    ('Date completed transaction entries and index them by completion time', date_completed_entries),
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+# Versions of the databases already checked by this process
+_checked_versions = {}
+
+
+def get_schema_version(database):
+    document = database.meta.find_one({'_id': SCHEMA_DOCUMENT}, {'version': True})
+    return document['version'] if document else 0
+
+
+def migrate(database, target: int = SCHEMA_VERSION):
+    """Apply every migration between the current schema version and target, returning the versions applied."""
+    applied = []
+    for version in range(get_schema_version(database) + 1, target + 1):
+        description, migration = MIGRATIONS[version - 1]
+        logger.info('Applying migration %d: %s', version, description)
+        migration(database)
+        database.meta.update_one(
+            {'_id': SCHEMA_DOCUMENT},
+            {'$set': {'version': version, 'migrated_at': datetime.utcnow()}},
+            upsert=True
+        )
+        applied.append(version)
+
+    return applied
+
+
+def check_schema_version(database):
+    """
+    Whether the database schema is up to date, logging an error when it is not.
+
+    The version is only read once per database and process, so workers can check it on every start.
+    """
+    key = (id(database.client), database.name)
+    if key not in _checked_versions:
+        _checked_versions[key] = get_schema_version(database)
+
+    version = _checked_versions[key]
+    if version < SCHEMA_VERSION:
+        logger.error('Database schema version %d is behind %d, run python -m src.migrations', version, SCHEMA_VERSION)
+
+    return version >= SCHEMA_VERSION
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--check', action='store_true', help='only check whether migrations are pending')
+    args = parser.parse_args()
+
+    database = default_database
+    version = get_schema_version(database)
+    if args.check:
+        print(f'Schema version {version} of {SCHEMA_VERSION}')
+        raise SystemExit(0 if version >= SCHEMA_VERSION else 1)
+
+    applied = migrate(database)
+    print(f'Applied migrations {applied}' if applied else f'Schema already at version {version}')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
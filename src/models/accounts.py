@@ -1,7 +1,9 @@
 from enum import Enum
+from typing import Literal
 
-from pydantic import BaseModel
-from pydantic.fields import List
+from pydantic import BaseModel, Field
+from pydantic.fields import List, Union
+from typing_extensions import Annotated
 
 from .institutions import Institution, InstitutionType
 from .balances import Balance
@@ -38,8 +40,13 @@ class OwnedAccount(Account):
 
 
 class CashAccount(OwnedAccount):
-    type = AccountType.cash
+    type: Literal[AccountType.cash] = AccountType.cash
 
 
 class FinancialAccount(OwnedAccount):
+    type: Literal[AccountType.bank, AccountType.investment]
     holder: Institution
+
+
+# Any stored account, validated as the model of its type
+AccountOut = Annotated[Union[FinancialAccount, CashAccount], Field(discriminator='type')]
@@ -9,13 +9,12 @@ class Token(BaseModel):
 class UserBase(BaseModel):
     username: str
     is_admin: bool = False
+    base_currency: str = None
 
 
 class UserIn(UserBase):
     password: str
-    # TODO: add field base_currency when Currency model is added
 
 
 class User(UserBase):
     pass
-    # TODO: add field base_currency when Currency model is added
@@ -0,0 +1,20 @@
+from enum import Enum
+
+from pydantic import BaseModel
+
+
+class CostBasisMethod(str, Enum):
+    fifo = 'fifo'
+    average = 'average'
+
+
+class Holding(BaseModel):
+    account: str
+    instrument: str
+    currency: str
+    quantity: float
+    cost: float
+    realized: float
+    price: float = None
+    value: float = None
+    unrealized: float = None
@@ -1,8 +1,10 @@
 from datetime import datetime
 from enum import Enum
+from typing import Literal
 
-from pydantic import BaseModel
-from pydantic.fields import Dict
+from pydantic import BaseModel, Field
+from pydantic.fields import Dict, List, Union
+from typing_extensions import Annotated
 
 from .institutions import Institution
 
@@ -28,14 +30,22 @@ class Instrument(InstrumentBase):
 
 
 class Currency(Instrument):
-    type = InstrumentType.currency
+    type: Literal[InstrumentType.currency] = InstrumentType.currency
+
+
+class Index(Instrument):
+    type: Literal[InstrumentType.index] = InstrumentType.index
 
 
 class Security(Instrument):
-    type = InstrumentType.security
+    type: Literal[InstrumentType.security] = InstrumentType.security
     exchange: Institution
 
 
+# Any stored instrument, validated as the model of its type
+InstrumentOut = Annotated[Union[Currency, Index, Security], Field(discriminator='type')]
+
+
 class ValueIn(BaseModel):
     values: Dict[str, float]
 
@@ -43,3 +53,11 @@ class ValueIn(BaseModel):
 class Value(ValueIn):
     instrument: Instrument
     date: datetime
+
+
+class Rate(BaseModel):
+    source: str
+    target: str
+    date: datetime
+    rate: float
+    path: List[str]
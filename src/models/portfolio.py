@@ -0,0 +1,31 @@
+from datetime import datetime
+from enum import Enum
+
+from pydantic import BaseModel
+
+
+class PortfolioValue(BaseModel):
+    date: datetime
+    value: float
+
+
+class PortfolioReturns(BaseModel):
+    start: datetime
+    end: datetime
+    currency: str
+    account: str = None
+    time_weighted: float
+    money_weighted: float = None
+
+
+class AllocationCategory(str, Enum):
+    type = 'type'
+    institution = 'institution'
+    currency = 'currency'
+    exchange = 'exchange'
+
+
+class Allocation(BaseModel):
+    group: str = None
+    value: float
+    weight: float
@@ -0,0 +1,24 @@
+from datetime import datetime
+
+from pydantic import BaseModel
+from pydantic.fields import List
+
+
+class AssetSnapshot(BaseModel):
+    instrument: str
+    quantity: float
+    value: float = None
+
+
+class AccountSnapshot(BaseModel):
+    code: str
+    value: float
+    assets: List[AssetSnapshot]
+
+
+class Snapshot(BaseModel):
+    owner: str
+    date: datetime
+    currency: str
+    value: float
+    accounts: List[AccountSnapshot]
@@ -0,0 +1,20 @@
+from pydantic import BaseModel
+from pydantic.fields import List
+
+from .accounts import AccountOut
+from .transactions import Transaction
+
+
+class Deletion(BaseModel):
+    collection: str
+    code: str
+
+
+class Changes(BaseModel):
+    # Token to request the changes made after these ones with
+    token: str
+    # Whether these are all the documents of the user, to replace the ones synced before
+    reset: bool
+    accounts: List[AccountOut]
+    transactions: List[Transaction]
+    deleted: List[Deletion]
@@ -1,3 +1,4 @@
+from datetime import datetime
 from enum import Enum
 
 from pydantic import BaseModel
@@ -22,6 +23,7 @@ class TransactionEntry(TransactionEntryIn):
     account: Account
     balance: Balance
     status: TransactionStatus
+    completed_at: datetime = None
 
 
 class TransactionIn(BaseModel):
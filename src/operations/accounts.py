@@ -3,10 +3,15 @@ from fastapi import Depends
 from pymongo.errors import DuplicateKeyError
 
 from ..config import database
+from ..events import Event, publish
 from ..exceptions import ValidationError, NotFoundError, handled
 from ..models.auth import User
 from ..models.accounts import AccountIn, AccountType
+from ..references import REFERENCES, store_references
+from ..responses import get_projection
 from .auth import resolve_user
+from .catalog import get_catalog_documents, resolve_references
+from .sync import next_version, add_deletion
 
 
 def _resolve_account_data(account, user):
@@ -21,12 +26,8 @@ def _resolve_account_data(account, user):
         if not data.get('holder'):
             raise ValidationError(f'Account holder is required for {account.type} account')
 
-        holder_data = database.institutions.find_one(
-            {
-                'type': account.type.holder_type,
-                'code': data['holder']
-            }
-        )
+        holder_key = (account.type.holder_type, data['holder'])
+        holder_data = get_catalog_documents('institutions', [holder_key]).get(holder_key)
         if not holder_data:
             raise ValidationError(f'Institution of type {account.type.holder_type} with code '
                                   f'{account.holder} does not exist')
@@ -39,38 +40,49 @@ def _resolve_account_data(account, user):
 def add_account(account: AccountIn, user: User = Depends(resolve_user)):
     try:
         data = _resolve_account_data(account, user)
-        database.accounts.insert_one(data)
+        database.accounts.insert_one({**store_references('accounts', data), **next_version(user.username)})
 
     except DuplicateKeyError:
         raise ValidationError(f'Account with code {account.code} already exists.')
 
+    publish(Event.account_changed, owner=user.username, code=account.code, account=data)
     return data
 
 
 @handled
-def get_accounts(user: User = Depends(resolve_user), t: AccountType = None):
+def get_accounts(user: User = Depends(resolve_user), t: AccountType = None, fields: str = None):
     filters = {'owner': user.username}
     if t:
         filters['type'] = t
 
-    return [a for a in database.accounts.find(filters).sort(
-        [
-            ('code', pymongo.ASCENDING)
-        ]
-    )]
+    return resolve_references('accounts', list(
+        database.accounts.find(filters, get_projection(fields, REFERENCES['accounts'])).sort(
+            [
+                ('code', pymongo.ASCENDING)
+            ]
+        )
+    ))
 
 
 @handled
 def modify_account(code: str, account: AccountIn, user: User = Depends(resolve_user)):
     data = _resolve_account_data(account, user)
-    res = database.accounts.replace_one({'owner': user.username, 'code': code}, data)
+    res = database.accounts.replace_one(
+        {'owner': user.username, 'code': code},
+        {**store_references('accounts', data), **next_version(user.username)}
+    )
 
     if not res.modified_count:
         raise NotFoundError(f'Account with code {code} does not exist.')
 
+    publish(Event.account_changed, owner=user.username, code=code, account=data)
     return data
 
 
 @handled
 def delete_account(code: str, user: User = Depends(resolve_user)):
-    database.accounts.delete_one({'owner': user.username, 'code': code})
+    res = database.accounts.delete_one({'owner': user.username, 'code': code})
+    if res.deleted_count:
+        add_deletion(user.username, 'accounts', code, next_version(user.username))
+
+    publish(Event.account_changed, owner=user.username, code=code, account=None)
@@ -1,14 +1,17 @@
 from datetime import datetime, timedelta
 
 from fastapi import Depends
-from fastapi.security import OAuth2PasswordRequestForm
+from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jwt import encode, decode, PyJWTError
 from pymongo.errors import DuplicateKeyError
 
-from ..config import database, oauth2_scheme, password_context, \
-    SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
+from ..config import database, password_context, SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
 from ..exceptions import handled, ValidationError, AuthenticationError, AuthorizationError
 from ..models.auth import UserIn, User
+from ..models.instruments import InstrumentType
+
+
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl='/sessions')
 
 
 def resolve_user(token: str = Depends(oauth2_scheme)):
@@ -43,8 +46,16 @@ def validate_admin_user(user: User = Depends(resolve_user)):
 
 @handled
 def add_user(user: UserIn):
+    if user.base_currency and not database.instruments.find_one(
+        {
+            'code': user.base_currency,
+            'type': InstrumentType.currency
+        }
+    ):
+        raise ValidationError(f'Currency with code {user.base_currency} not found')
+
     try:
-        user_data = user.dict()
+        user_data = user.dict(exclude_none=True)
         user_data['hashed_password'] = password_context.hash(user_data.pop('password'))
         database.users.insert_one(user_data)
 
@@ -0,0 +1,104 @@
+from ..cache import Cache
+from ..config import database
+from ..events import Event, subscribe
+from ..models.instruments import InstrumentType
+from ..references import REFERENCE_FIELDS, get_reference_key, iter_references, replace_references
+
+
+_MISSING = object()
+
+# Catalog documents by (catalog, key), None for references to documents that do not exist. Instruments are cached
+# with their exchange resolved.
+catalog_cache = Cache(max_size=8192)
+
+
+def _load(catalog: str, keys: list):
+    # May read a few more documents than needed (those matching fields of different keys), to be served by an index
+    filters = {
+        field: {'$in': sorted({key[n] for key in keys})} for n, field in enumerate(REFERENCE_FIELDS[catalog])
+    }
+    documents = getattr(database, catalog).find(filters, {'_id': False})
+    if catalog == 'instruments':
+        documents = resolve_references('instruments', list(documents))
+
+    return {get_reference_key(catalog, d): d for d in documents}
+
+
+def get_catalog_documents(catalog: str, keys):
+    """Catalog documents with keys (see references.get_reference_key), reading the ones not cached in a single query."""
+    found, missing = {}, []
+    for key in set(keys):
+        document = catalog_cache.get((catalog, key), _MISSING)
+        if document is _MISSING:
+            missing.append(key)
+
+        elif document is not None:
+            found[key] = document
+
+    if missing:
+        loaded = _load(catalog, missing)
+        for key in missing:
+            catalog_cache.set((catalog, key), loaded.get(key))
+
+        found.update(loaded)
+
+    return found
+
+
+def resolve_references(collection: str, documents: list):
+    """
+    Documents of collection with the catalog documents they reference in place of the references, resolving those of
+    every document together.
+
+    References to catalog documents that do not exist are kept as they are.
+    """
+    keys = {catalog: set() for catalog in REFERENCE_FIELDS}
+    for document in documents:
+        for catalog, reference in iter_references(collection, document):
+            keys[catalog].add(get_reference_key(catalog, reference))
+
+    resolved = {catalog: get_catalog_documents(catalog, catalog_keys) for catalog, catalog_keys in keys.items()
+                if catalog_keys}
+
+    def resolve(catalog, reference):
+        return resolved[catalog].get(get_reference_key(catalog, reference), reference)
+
+    return [replace_references(collection, document, resolve) for document in documents]
+
+
+def get_instrument_types(codes):
+    """Type of each instrument in codes, None for the ones that do not exist."""
+    instruments = get_catalog_documents('instruments', [(code,) for code in codes])
+    return {code: instruments.get((code,), {}).get('type') for code in codes}
+
+
+def get_currency_codes():
+    """Codes of every currency, sorted."""
+    return catalog_cache.get_or_set(
+        ('currencies', None),
+        lambda: sorted(database.instruments.distinct('code', {'type': InstrumentType.currency}))
+    )
+
+
+@subscribe(Event.instrument_changed)
+def _invalidate_instrument(code, instrument=None, **_):
+    catalog_cache.invalidate(('instruments', (code,)))
+    if instrument is not None:
+        # Modified instruments may have a new code, which may be cached as missing
+        catalog_cache.invalidate(('instruments', (instrument['code'],)))
+
+    catalog_cache.invalidate(('currencies', None))
+
+
+@subscribe(Event.institution_changed)
+def _invalidate_institution(**_):
+    # Cached instruments embed their exchange
+    catalog_cache.clear()
+
+
+@subscribe(Event.data_changed)
+def _invalidate_changed_catalog(collection, **_):
+    if collection in ('institutions', 'instruments'):
+        # Deleted documents only keep their id, and changed ones only their new code (renamed instruments may be cached
+        # under their previous one), so which entries changed is unknown
+        catalog_cache.clear()
@@ -0,0 +1,226 @@
+from datetime import datetime
+
+import pymongo
+from fastapi import Depends
+from pymongo import UpdateOne
+
+from ..config import database, COST_BASIS_METHOD
+from ..exceptions import handled, NotFoundError, ValidationError
+from ..models.auth import User
+from ..models.holdings import CostBasisMethod
+from ..models.instruments import InstrumentType
+from ..models.transactions import Transaction, TransactionEntry
+from .auth import resolve_user
+from .portfolio import _get_latest_prices
+from .rates import get_rate_matrix
+
+
+def _get_entry_amounts(transaction: Transaction, entries: list):
+    """
+    Share of the transaction total of each lot-tracked entry (securities and indexes).
+
+    Acquisitions and disposals share the total separately, in proportion to the quantity of each entry. Totals have no
+    sign convention, the cost of acquisitions and the proceeds of disposals are always positive.
+    """
+    tracked = [
+        (n, entry) for n, entry in enumerate(transaction.entries)
+        if entry.balance.instrument.type != InstrumentType.currency
+    ]
+    totals = {}
+    for _, entry in tracked:
+        sign = entry.balance.quantity > 0
+        totals[sign] = totals.get(sign, 0) + abs(entry.balance.quantity)
+
+    return [
+        (n, entry, abs(transaction.total.quantity * entry.balance.quantity) / totals[entry.balance.quantity > 0])
+        for n, entry in tracked
+        if entry.balance.quantity and any(entry is e for e in entries)
+    ]
+
+
+def _get_holding(owner: str, entry: TransactionEntry, transaction: Transaction):
+    holding_filter = {'owner': owner, 'account': entry.account.code, 'instrument': entry.balance.instrument.code}
+    holding = database.holdings.find_one(holding_filter)
+    currency = holding['currency'] if holding else transaction.total.instrument.code
+
+    return holding_filter, holding, currency
+
+
+def _convert(amount: float, transaction: Transaction, currency: str):
+    source = transaction.total.instrument.code
+    if source == currency:
+        return amount
+
+    date = datetime.fromisoformat(transaction.code[:10])
+    try:
+        return amount * get_rate_matrix(date).rate(source, currency)
+
+    except NotFoundError:
+        raise ValidationError(f'No conversion rate from {source} to {currency} on or before {date.date()} found.')
+
+
+def _acquire(owner: str, transaction: Transaction, entry_n: int, entry: TransactionEntry, amount: float):
+    holding_filter, _, currency = _get_holding(owner, entry, transaction)
+    cost = _convert(amount, transaction, currency)
+
+    database.lots.insert_one({
+        **holding_filter,
+        'transaction': transaction.code,
+        'entry': entry_n,
+        'quantity': entry.balance.quantity,
+        'remaining': entry.balance.quantity,
+        'cost': cost
+    })
+    database.holdings.update_one(
+        holding_filter,
+        {
+            '$inc': {'quantity': entry.balance.quantity, 'cost': cost},
+            '$setOnInsert': {'currency': currency, 'realized': 0}
+        },
+        upsert=True
+    )
+
+
+def _dispose(owner: str, transaction: Transaction, entry_n: int, entry: TransactionEntry, amount: float):
+    holding_filter, holding, currency = _get_holding(owner, entry, transaction)
+    proceeds = _convert(amount, transaction, currency)
+    quantity = -entry.balance.quantity
+
+    # Lots are always consumed oldest first, only the cost assigned to the disposal depends on the method
+    consumed = []
+    lots_cost = 0
+    pending = quantity
+    for lot in database.lots.find({**holding_filter, 'remaining': {'$gt': 0}}).sort(
+        [
+            ('transaction', pymongo.ASCENDING),
+            ('entry', pymongo.ASCENDING)
+        ]
+    ):
+        taken = min(pending, lot['remaining'])
+        consumed.append({'lot': lot['_id'], 'quantity': taken})
+        lots_cost += lot['cost'] * taken / lot['quantity']
+        pending -= taken
+        if not pending:
+            break
+
+    if consumed:
+        database.lots.bulk_write(
+            [UpdateOne({'_id': c['lot']}, {'$inc': {'remaining': -c['quantity']}}) for c in consumed]
+        )
+
+    if COST_BASIS_METHOD == CostBasisMethod.average and holding and holding['quantity'] > 0:
+        cost = holding['cost'] * min(quantity, holding['quantity']) / holding['quantity']
+
+    else:
+        cost = lots_cost
+
+    database.disposals.insert_one({
+        'owner': owner,
+        'transaction': transaction.code,
+        'entry': entry_n,
+        'consumed': consumed,
+        'quantity': quantity,
+        'cost': cost,
+        'proceeds': proceeds
+    })
+    database.holdings.update_one(
+        holding_filter,
+        {
+            '$inc': {'quantity': -quantity, 'cost': -cost, 'realized': proceeds - cost},
+            '$setOnInsert': {'currency': currency}
+        },
+        upsert=True
+    )
+
+
+def _check_unconsumed(owner: str, transaction: Transaction, entry_ns: list):
+    """Lots acquired by entry_ns of transaction can only be reverted while no disposal consumed them."""
+    for lot in database.lots.find(
+        {'owner': owner, 'transaction': transaction.code, 'entry': {'$in': entry_ns}},
+        {'quantity': True, 'remaining': True}
+    ):
+        if lot['remaining'] < lot['quantity']:
+            raise ValidationError(
+                f'Transaction {transaction.code} acquired lots that were later disposed of, cancel the disposals first'
+            )
+
+
+def _revert(owner: str, transaction: Transaction, entry_n: int, entry: TransactionEntry):
+    holding_filter = {'owner': owner, 'account': entry.account.code, 'instrument': entry.balance.instrument.code}
+    entry_filter = {'owner': owner, 'transaction': transaction.code, 'entry': entry_n}
+
+    if entry.balance.quantity > 0:
+        lot = database.lots.find_one_and_delete(entry_filter)
+        if lot:
+            database.holdings.update_one(holding_filter, {'$inc': {'quantity': -lot['quantity'], 'cost': -lot['cost']}})
+
+    else:
+        disposal = database.disposals.find_one_and_delete(entry_filter)
+        if disposal:
+            if disposal['consumed']:
+                database.lots.bulk_write(
+                    [UpdateOne({'_id': c['lot']}, {'$inc': {'remaining': c['quantity']}}) for c in disposal['consumed']]
+                )
+
+            database.holdings.update_one(
+                holding_filter,
+                {
+                    '$inc': {
+                        'quantity': disposal['quantity'],
+                        'cost': disposal['cost'],
+                        'realized': disposal['cost'] - disposal['proceeds']
+                    }
+                }
+            )
+
+
+def _update_lots(owner: str, transaction: Transaction, entries: list, reverted: bool):
+    """
+    Update the lots, disposals and holdings of owner with entries of transaction, applied or reverted.
+
+    Part of completing and cancelling transactions (before the balances of entries are updated), so failures fail the
+    operation and can be retried instead of leaving the ledger behind the balances. Reverting fails before changing
+    anything when later disposals consumed lots acquired by entries.
+    """
+    amounts = _get_entry_amounts(transaction, entries)
+    if reverted:
+        _check_unconsumed(owner, transaction, [n for n, entry, _ in amounts if entry.balance.quantity > 0])
+
+    for entry_n, entry, amount in amounts:
+        if reverted:
+            _revert(owner, transaction, entry_n, entry)
+
+        elif entry.balance.quantity > 0:
+            _acquire(owner, transaction, entry_n, entry, amount)
+
+        else:
+            _dispose(owner, transaction, entry_n, entry, amount)
+
+
+@handled
+def get_holdings(user: User = Depends(resolve_user), account: str = None):
+    filters = {'owner': user.username}
+    if account:
+        filters['account'] = account
+
+    holdings = [h for h in database.holdings.find(filters).sort(
+        [
+            ('account', pymongo.ASCENDING),
+            ('instrument', pymongo.ASCENDING)
+        ]
+    )]
+
+    # Only securities and indexes are lot-tracked, so every holding is priced through its quotes
+    prices = {}
+    for currency in {h['currency'] for h in holdings}:
+        instruments = {h['instrument']: InstrumentType.security for h in holdings if h['currency'] == currency}
+        prices[currency] = _get_latest_prices(instruments, currency)
+
+    for holding in holdings:
+        price = prices[holding['currency']].get(holding['instrument'])
+        if price is not None:
+            holding['price'] = price
+            holding['value'] = holding['quantity'] * price
+            holding['unrealized'] = holding['value'] - holding['cost']
+
+    return holdings
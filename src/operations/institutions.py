@@ -2,10 +2,13 @@ import pymongo
 from fastapi import Depends
 from pymongo.errors import DuplicateKeyError
 
+from ..cache import single_flight
 from ..config import database
+from ..events import Event, publish
 from ..exceptions import handled, ValidationError, NotFoundError
 from ..models.auth import User
 from ..models.institutions import Institution, InstitutionType
+from ..responses import get_projection
 from .auth import validate_admin_user, resolve_user
 
 
@@ -17,16 +20,18 @@ def add_institution(institution: Institution, _: User = Depends(validate_admin_u
     except DuplicateKeyError:
         raise ValidationError(f'Institution with code {institution.code} already exists.')
 
+    publish(Event.institution_changed, code=institution.code)
     return institution
 
 
 @handled
-def get_institutions(_: User = Depends(resolve_user), t: InstitutionType = None):
+@single_flight(ignore=('_',))
+def get_institutions(_: User = Depends(resolve_user), t: InstitutionType = None, fields: str = None):
     filters = {}
     if t:
         filters['type'] = t
 
-    return [i for i in database.institutions.find(filters).sort(
+    return [i for i in database.institutions.find(filters, get_projection(fields)).sort(
         [
             ('type', pymongo.ASCENDING),
             ('code', pymongo.ASCENDING)
@@ -39,9 +44,12 @@ def modify_institution(code: str, institution: Institution, _: User = Depends(va
     res = database.institutions.replace_one({'code': code}, institution.dict(exclude_none=True))
     if not res.modified_count:
         raise NotFoundError(f'Institution with code {code} does not exist.')
+
+    publish(Event.institution_changed, code=code)
     return institution
 
 
 @handled
 def delete_institution(code: str):
     database.institutions.delete_one({'code': code})
+    publish(Event.institution_changed, code=code)
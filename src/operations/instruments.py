@@ -4,12 +4,18 @@ import pymongo
 from fastapi import Depends
 from pymongo.errors import DuplicateKeyError
 
-from ..config import database
+from ..cache import single_flight
+from ..config import database, SEARCH_MAX_RESULTS
+from ..events import Event, publish, subscribe
 from ..exceptions import handled, ValidationError, NotFoundError
 from ..models.auth import User
 from ..models.institutions import InstitutionType
 from ..models.instruments import InstrumentIn, InstrumentType, ValueIn
+from ..references import REFERENCES, store_references, to_reference
+from ..responses import get_projection
+from ..search import PrefixIndex
 from .auth import validate_admin_user, resolve_user
+from .catalog import get_catalog_documents, resolve_references
 
 
 def _get_date_from_code(date_code):
@@ -20,11 +26,39 @@ def _get_date_from_code(date_code):
         raise ValidationError(f'Incorrect date format {date_code}')
 
 
+# Catalog search, by the words of symbols, codes and descriptions (in decreasing order of relevance)
+instrument_index = PrefixIndex(
+    lambda: resolve_references('instruments', list(database.instruments.find({}, {'_id': False}))),
+    {'symbol': 3, 'code': 2, 'description': 1}
+)
+
+
+@subscribe(Event.instrument_changed)
+def _update_instrument_index(code, instrument, **_):
+    instrument_index.remove(code)
+    if instrument is not None:
+        instrument_index.add({k: v for k, v in instrument.items() if k != '_id'})
+
+
+@subscribe(Event.institution_changed)
+def _reload_exchange_instruments(**_):
+    # Indexed instruments embed their exchange
+    instrument_index.mark_stale()
+
+
+@subscribe(Event.data_changed)
+def _reload_instrument_index(collection, **_):
+    if collection in ('institutions', 'instruments'):
+        # Changes by other workers: which instrument a deletion was of is unknown, so the index is rebuilt
+        instrument_index.mark_stale()
+
+
 def _get_exchange_data(code: str = None):
     if not code:
         raise ValidationError('Instrument of type security must have an exchange')
 
-    data = database.institutions.find_one({'code': code, 'type': InstitutionType.exchange})
+    key = (InstitutionType.exchange, code)
+    data = get_catalog_documents('institutions', [key]).get(key)
     if not data:
         raise ValidationError(f'Exchange with code {code} not found')
 
@@ -43,26 +77,38 @@ def add_instrument(instrument: InstrumentIn, _: User = Depends(validate_admin_us
             data['code'] = instrument.symbol
             data.pop('exchange', None)
 
-        database.instruments.insert_one(data)
+        database.instruments.insert_one(store_references('instruments', data))
 
     except DuplicateKeyError:
         raise ValidationError(f'Instrument with code {data["code"]} already exists.')
 
+    publish(Event.instrument_changed, code=data['code'], instrument=data)
     return data
 
 
 @handled
-def get_instruments(_: User = Depends(resolve_user), t: InstrumentType = None):
+@single_flight(ignore=('_',))
+def get_instruments(_: User = Depends(resolve_user), t: InstrumentType = None, fields: str = None):
     filters = {}
     if t:
         filters['type'] = t
 
-    return [i for i in database.instruments.find(filters).sort(
-        [
-            ('type', pymongo.ASCENDING),
-            ('code', pymongo.ASCENDING)
-        ]
-    )]
+    return resolve_references('instruments', list(
+        database.instruments.find(filters, get_projection(fields, REFERENCES['instruments'])).sort(
+            [
+                ('type', pymongo.ASCENDING),
+                ('code', pymongo.ASCENDING)
+            ]
+        )
+    ))
+
+
+@handled
+def search_instruments(q: str, limit: int = 10, _: User = Depends(resolve_user)):
+    if not 0 < limit <= SEARCH_MAX_RESULTS:
+        raise ValidationError(f'Limit must be between 1 and {SEARCH_MAX_RESULTS}')
+
+    return instrument_index.search(q, limit)
 
 
 @handled
@@ -75,31 +121,32 @@ def modify_instrument(code: str, instrument: InstrumentIn, _: User = Depends(val
         data['code'] = instrument.symbol
         data.pop('exchange', None)
 
-    res = database.instruments.replace_one({'code': code}, data)
+    res = database.instruments.replace_one({'code': code}, store_references('instruments', data))
     if not res.modified_count:
         raise NotFoundError(f'Instrument with code {data["code"]} does not exist.')
 
+    publish(Event.instrument_changed, code=code, instrument=data)
     return data
 
 
 @handled
 def delete_instrument(code: str, _: User = Depends(validate_admin_user)):
     database.instruments.delete_one({'code': code})
-
+    publish(Event.instrument_changed, code=code, instrument=None)
 
 
 @handled
 def set_value(code: str, date_code: str, value: ValueIn, _: User = Depends(validate_admin_user)):
     date = _get_date_from_code(date_code)
-    instrument_data = database.instruments.find_one({'code': code})
+    instrument_data = get_catalog_documents('instruments', [(code,)]).get((code,))
     if not instrument_data:
         raise NotFoundError(f'Instrument with code {code} does not exist.')
 
     set_data = {
-        'instrument': instrument_data,
+        'instrument': to_reference('instruments', instrument_data),
         'date': date,
     }
-    return_data = {**set_data, 'values': {}}
+    return_data = {**set_data, 'instrument': instrument_data, 'values': {}}
 
     for currency_code, quantity in value.values.items():
         set_data[f'values.{currency_code}'] = quantity
@@ -111,10 +158,12 @@ def set_value(code: str, date_code: str, value: ValueIn, _: User = Depends(valid
         upsert=True
     )
 
+    publish(Event.value_changed, instrument=instrument_data, date=date, values=return_data['values'])
     return return_data
 
 
 @handled
+@single_flight(ignore=('_',), date_code=_get_date_from_code)
 def get_value(code: str, date_code: str,  _: User = Depends(resolve_user)):
     date = _get_date_from_code(date_code)
     filters = {
@@ -127,4 +176,4 @@ def get_value(code: str, date_code: str,  _: User = Depends(resolve_user)):
     if not data:
         raise NotFoundError(f'Instrument {code} value for date {date_code} not found.')
 
-    return data
+    return resolve_references('values', [data])[0]
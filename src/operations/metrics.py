@@ -0,0 +1,36 @@
+import hmac
+
+from fastapi import Header, HTTPException, status
+from fastapi.responses import PlainTextResponse
+
+from ..config import METRICS_TOKEN
+from ..exceptions import AuthenticationError
+from ..metrics import render
+from .auth import resolve_user
+
+
+def _is_metrics_allowed(authorization: str):
+    scheme, _, token = authorization.partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        return False
+
+    if METRICS_TOKEN and hmac.compare_digest(token.encode(), METRICS_TOKEN.encode()):
+        return True
+
+    try:
+        return resolve_user(token).is_admin
+
+    except AuthenticationError:
+        return False
+
+
+def get_metrics(authorization: str = Header('')):
+    # Not a handled operation, so reading the metrics is not recorded in them
+    if not _is_metrics_allowed(authorization):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail='Metrics are only available to scrapers with the metrics token and admin users.',
+            headers={'WWW-Authenticate': 'Bearer'}
+        )
+
+    return PlainTextResponse(render(), media_type='text/plain; version=0.0.4')
@@ -0,0 +1,436 @@
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import numpy as np
+import pymongo
+from fastapi import Depends
+
+from ..analytics import time_weighted_return, money_weighted_return
+from ..cache import Cache, Versions
+from ..config import database
+from ..events import Event, subscribe
+from ..exceptions import handled, ValidationError, NotFoundError
+from ..models.auth import User
+from ..models.instruments import InstrumentType
+from ..models.portfolio import AllocationCategory
+from ..models.transactions import TransactionStatus
+from .auth import resolve_user
+from .catalog import get_catalog_documents, get_currency_codes, get_instrument_types
+from .instruments import _get_date_from_code
+from .rates import RateMatrix, get_rate_matrix
+
+
+BalanceChange = namedtuple('BalanceChange', ('date', 'account', 'instrument', 'quantity'))
+Valuation = namedtuple('Valuation', ('dates', 'columns', 'deltas', 'holdings', 'prices'))
+
+# Versions of the data valuations are computed from, part of the key of every cached result
+data_versions = Versions()
+returns_cache = Cache(max_size=4096)
+allocation_cache = Cache(max_size=4096)
+
+
+@subscribe(Event.balance_changed)
+@subscribe(Event.account_changed)
+def _bump_balances_version(owner, **_):
+    data_versions.bump(('balances', owner))
+
+
+@subscribe(Event.value_changed)
+def _bump_values_version(**_):
+    data_versions.bump('values')
+
+
+@subscribe(Event.instrument_changed)
+@subscribe(Event.institution_changed)
+def _clear_results(**_):
+    # Results depend on the types and exchanges of the instruments, which are not versioned
+    returns_cache.clear()
+    allocation_cache.clear()
+
+
+@subscribe(Event.data_changed)
+def _bump_changed_version(collection, document, **_):
+    if collection == 'values':
+        _bump_values_version()
+
+    elif collection in ('instruments', 'institutions'):
+        _clear_results()
+
+    elif collection in ('accounts', 'transactions'):
+        if document is None:
+            # Deleted documents only keep their id, so whose balances changed is unknown
+            returns_cache.clear()
+            allocation_cache.clear()
+
+        else:
+            _bump_balances_version(document['owner'])
+
+
+def _get_data_version(user: User):
+    return data_versions.get(('balances', user.username)), data_versions.get('values')
+
+
+def _forward_fill(matrix: np.ndarray):
+    """Replace every NaN with the last known value of its column (leading NaNs are kept)."""
+    rows = np.where(np.isnan(matrix), 0, np.arange(matrix.shape[0])[:, None])
+    np.maximum.accumulate(rows, axis=0, out=rows)
+    return matrix[rows, np.arange(matrix.shape[1])]
+
+
+def _get_date_rows(dates, start: datetime):
+    """Row of each date in a daily matrix starting at start, everything before start is folded into row 0."""
+    ordinals = np.fromiter((date.toordinal() for date in dates), dtype=int, count=len(dates))
+    return np.clip(ordinals - start.toordinal(), 0, None)
+
+
+def _get_day(moment: datetime):
+    return datetime.combine(moment.date(), datetime.min.time())
+
+
+def _get_today():
+    return _get_day(datetime.utcnow())
+
+
+def _resolve_period(start_code: str, end_code: str = None):
+    start = _get_date_from_code(start_code)
+    end = _get_date_from_code(end_code) if end_code else _get_today()
+    if end < start:
+        raise ValidationError(f'Period end {end_code} is before its start {start_code}')
+
+    return start, end
+
+
+def _resolve_currency(user: User, currency: str = None):
+    currency = currency or user.base_currency
+    if not currency:
+        raise ValidationError('A valuation currency is required when the user has no base currency')
+
+    return currency
+
+
+def _get_balance_changes(user: User, end: datetime, start: datetime = None):
+    """
+    Balance changes of every transaction entry completed up to end (inclusive), from start on if given, dated by the
+    day they were completed.
+    """
+    first, after = start or datetime.min, end + timedelta(days=1)
+    completed = {'$gte': first, '$lt': after} if start else {'$lt': after}
+
+    transactions = database.transactions.find(
+        {
+            'owner': user.username,
+            'entries': {'$elemMatch': {'status': TransactionStatus.completed, 'completed_at': completed}}
+        },
+        {
+            'entries.status': True,
+            'entries.completed_at': True,
+            'entries.account.code': True,
+            'entries.balance.instrument.code': True,
+            'entries.balance.quantity': True
+        }
+    )
+
+    return [
+        BalanceChange(
+            date=_get_day(entry['completed_at']),
+            account=entry['account']['code'],
+            instrument=entry['balance']['instrument']['code'],
+            quantity=entry['balance']['quantity']
+        )
+        for transaction in transactions
+        for entry in transaction['entries']
+        # Entries of the same transaction can be completed on different days
+        if entry['status'] == TransactionStatus.completed and first <= entry['completed_at'] < after
+    ]
+
+
+def _get_holding_deltas(changes, start: datetime, days: int):
+    """Daily quantity changes per (account, instrument) column, their cumulative sum gives the holdings."""
+    columns = sorted({(c.account, c.instrument) for c in changes})
+    deltas = np.zeros((days, len(columns)))
+    if changes:
+        column_index = {column: n for n, column in enumerate(columns)}
+        np.add.at(
+            deltas,
+            (
+                _get_date_rows([c.date for c in changes], start),
+                [column_index[(c.account, c.instrument)] for c in changes]
+            ),
+            [c.quantity for c in changes]
+        )
+
+    return columns, deltas
+
+
+def _get_values(codes: list, start: datetime, end: datetime):
+    """
+    Values of the instruments with codes between start and end (inclusive) sorted by date, after the latest value of
+    each one before start, which forward fills seed the start of the period with.
+    """
+    previous = database.values.aggregate(
+        [
+            {'$match': {'instrument.code': {'$in': codes}, 'date': {'$lt': start}}},
+            {'$sort': {'instrument.code': pymongo.ASCENDING, 'date': pymongo.DESCENDING}},
+            {'$group': {'_id': '$instrument.code', 'date': {'$first': '$date'}, 'values': {'$first': '$values'}}}
+        ]
+    )
+    values = database.values.find(
+        {
+            'instrument.code': {'$in': codes},
+            'date': {'$gte': start, '$lte': end}
+        },
+        {
+            'instrument.code': True,
+            'date': True,
+            'values': True
+        }
+    ).sort('date')
+
+    return sorted(
+        ({'instrument': {'code': v['_id']}, 'date': v['date'], 'values': v['values']} for v in previous),
+        key=lambda v: v['date']
+    ) + list(values)
+
+
+def _get_currency_rates(currencies, currency: str, start: datetime, end: datetime, days: int):
+    """Daily forward-filled rates from each of currencies to currency."""
+    rates = np.full((days, len(currencies)), np.nan)
+    # Every currency quoted up to start is converted with its latest value on the first day
+    by_date = {}
+    for value in _get_values(get_currency_codes(), start, end):
+        by_date.setdefault(max(value['date'], start), {})[value['instrument']['code']] = value
+
+    dates = sorted(by_date)
+    for row, date in zip(_get_date_rows(dates, start), dates):
+        matrix = RateMatrix(list(by_date[date].values()))
+        for column, source in enumerate(currencies):
+            try:
+                rates[row, column] = matrix.rate(source, currency)
+
+            except NotFoundError:
+                pass
+
+    rates[:, [n for n, source in enumerate(currencies) if source == currency]] = 1
+    return _forward_fill(rates)
+
+
+def _get_prices(instruments: dict, currency: str, start: datetime, end: datetime, days: int):
+    """
+    Daily forward-filled prices in currency of instruments (a mapping of instrument code to type).
+
+    Securities and indexes are priced in a single quote currency (currency itself if it is quoted, the first quoted one
+    otherwise) and converted with the rates of each date, currencies are priced by their rate.
+    """
+    codes = sorted(instruments)
+    quoted = [code for code in codes if instruments[code] != InstrumentType.currency]
+    quoted_columns = {code: n for n, code in enumerate(quoted)}
+    native = np.full((days, len(quoted)), np.nan)
+    quote_currencies = {}
+
+    if quoted:
+        values = _get_values(quoted, start, end)
+        for value in values:
+            code = value['instrument']['code']
+            if code not in quote_currencies and value['values']:
+                quote_currencies[code] = currency if currency in value['values'] else min(value['values'])
+
+        rows = _get_date_rows([v['date'] for v in values], start)
+        for row, value in zip(rows, values):
+            code = value['instrument']['code']
+            price = value['values'].get(quote_currencies.get(code))
+            if price is not None:
+                native[row, quoted_columns[code]] = price
+
+    currencies = sorted(
+        {code for code in codes if instruments[code] == InstrumentType.currency} |
+        set(quote_currencies.values()) |
+        {currency}
+    )
+    rates = _get_currency_rates(currencies, currency, start, end, days)
+    currency_columns = {code: n for n, code in enumerate(currencies)}
+
+    prices = np.full((days, len(codes)), np.nan)
+    native = _forward_fill(native)
+    for n, code in enumerate(codes):
+        if instruments[code] == InstrumentType.currency:
+            prices[:, n] = rates[:, currency_columns[code]]
+
+        elif code in quote_currencies:
+            prices[:, n] = native[:, quoted_columns[code]] * rates[:, currency_columns[quote_currencies[code]]]
+
+    return codes, prices
+
+
+def _get_latest_rate_matrix():
+    latest = database.values.find_one(
+        {'instrument.code': {'$in': get_currency_codes()}},
+        {'date': True},
+        sort=[('date', pymongo.DESCENDING)]
+    )
+    return get_rate_matrix(latest['date']) if latest else RateMatrix([])
+
+
+def _get_latest_quotes(instruments: dict, currency: str):
+    """
+    Latest known quote of instruments (a mapping of instrument code to type) as (quote currency, price in currency).
+
+    Instruments are quoted in currency if it is one of their quotes (the first one otherwise), currencies are quoted in
+    themselves. Prices that cannot be converted to currency are None.
+    """
+    rates = _get_latest_rate_matrix()
+    quotes = {}
+
+    def convert(amount, source):
+        try:
+            return amount * rates.rate(source, currency)
+
+        except NotFoundError:
+            return None
+
+    quoted = [code for code, instrument_type in instruments.items() if instrument_type != InstrumentType.currency]
+    latest_values = database.values.aggregate(
+        [
+            {'$match': {'instrument.code': {'$in': quoted}}},
+            {'$sort': {'instrument.code': pymongo.ASCENDING, 'date': pymongo.DESCENDING}},
+            {'$group': {'_id': '$instrument.code', 'values': {'$first': '$values'}}}
+        ]
+    ) if quoted else []
+
+    for value in latest_values:
+        if value['values']:
+            source = currency if currency in value['values'] else min(value['values'])
+            quotes[value['_id']] = (source, convert(value['values'][source], source))
+
+    for code, instrument_type in instruments.items():
+        if instrument_type == InstrumentType.currency:
+            quotes[code] = (code, convert(1, code))
+
+        else:
+            quotes.setdefault(code, (None, None))
+
+    return quotes
+
+
+def _get_latest_prices(instruments: dict, currency: str):
+    """Latest known price in currency of instruments (a mapping of instrument code to type), None if unknown."""
+    return {code: price for code, (_, price) in _get_latest_quotes(instruments, currency).items()}
+
+
+def _get_valuation(user: User, start: datetime, end: datetime, currency: str, opening: tuple = None):
+    """
+    Daily holdings per (account, instrument) between start and end, with the price in currency of each column.
+
+    Holdings start from opening, a (date, balance changes) pair with the holdings at the end of a date before start,
+    when given, so only the transactions after that date are read.
+    """
+    days = (end - start).days + 1
+    dates = [start + timedelta(days=n) for n in range(days)]
+    if opening:
+        opening_date, changes = opening
+        changes = changes + _get_balance_changes(user, end, opening_date + timedelta(days=1))
+
+    else:
+        changes = _get_balance_changes(user, end)
+    columns, deltas = _get_holding_deltas(changes, start, days)
+
+    codes, prices = _get_prices(get_instrument_types({c.instrument for c in changes}), currency, start, end, days)
+    code_index = {code: n for n, code in enumerate(codes)}
+    column_prices = prices[:, [code_index[instrument] for _, instrument in columns]]
+
+    return Valuation(dates, columns, deltas, deltas.cumsum(axis=0), column_prices)
+
+
+@handled
+def get_portfolio_values(start: str, end: str = None, currency: str = None, user: User = Depends(resolve_user)):
+    start_date, end_date = _resolve_period(start, end)
+    valuation = _get_valuation(user, start_date, end_date, _resolve_currency(user, currency))
+    values = np.nansum(valuation.holdings * valuation.prices, axis=1)
+
+    return [{'date': date, 'value': value} for date, value in zip(valuation.dates, values.tolist())]
+
+
+def _get_returns(user: User, start: datetime, end: datetime, currency: str, account: str = None):
+    # The day before start is included to value the holdings the period starts with
+    valuation = _get_valuation(user, start - timedelta(days=1), end, currency)
+    selected = [
+        n for n, (column_account, _) in enumerate(valuation.columns)
+        if not account or column_account == account
+    ]
+
+    values = np.nansum(valuation.holdings[:, selected] * valuation.prices[:, selected], axis=1)
+    flows = np.nansum(valuation.deltas[:, selected] * valuation.prices[:, selected], axis=1)
+    flows[0] = 0
+
+    return {
+        'start': start,
+        'end': end,
+        'currency': currency,
+        'account': account,
+        'time_weighted': time_weighted_return(values, flows),
+        'money_weighted': money_weighted_return(values, flows)
+    }
+
+
+@handled
+def get_portfolio_returns(start: str, end: str = None, account: str = None, currency: str = None,
+                          user: User = Depends(resolve_user)):
+    start_date, end_date = _resolve_period(start, end)
+    currency = _resolve_currency(user, currency)
+    key = (user.username, start_date, end_date, currency, account, _get_data_version(user))
+
+    return returns_cache.get_or_set(key, lambda: _get_returns(user, start_date, end_date, currency, account))
+
+
+# Allocation group of each asset, from its holder code, instrument and quote currency
+ALLOCATION_GROUPS = {
+    AllocationCategory.type: lambda holder, instrument, quote_currency: instrument.get('type'),
+    AllocationCategory.institution: lambda holder, instrument, quote_currency: holder,
+    AllocationCategory.exchange: lambda holder, instrument, quote_currency: instrument.get('exchange', {}).get('code'),
+    AllocationCategory.currency: lambda holder, instrument, quote_currency: quote_currency
+}
+
+
+def _get_allocation(user: User, by: AllocationCategory, currency: str):
+    assets = list(database.accounts.aggregate(
+        [
+            {'$match': {'owner': user.username}},
+            {'$unwind': '$assets'},
+            {'$group': {
+                '_id': {
+                    'holder': '$holder.code',
+                    'instrument': '$assets.instrument.code'
+                },
+                'quantity': {'$sum': '$assets.quantity'}
+            }}
+        ]
+    ))
+    instruments = get_catalog_documents('instruments', {(a['_id']['instrument'],) for a in assets})
+    quotes = _get_latest_quotes(
+        {code: instrument.get('type') for (code,), instrument in instruments.items()}, currency
+    )
+
+    values = {}
+    for asset in assets:
+        code = asset['_id']['instrument']
+        quote_currency, price = quotes.get(code, (None, None))
+        group = ALLOCATION_GROUPS[by](asset['_id'].get('holder'), instruments.get((code,), {}), quote_currency)
+        values[group] = values.get(group, 0) + asset['quantity'] * (price or 0)
+
+    total = sum(values.values())
+    return sorted(
+        (
+            {'group': group, 'value': value, 'weight': value / total if total else 0}
+            for group, value in values.items()
+        ),
+        key=lambda a: a['value'],
+        reverse=True
+    )
+
+
+@handled
+def get_portfolio_allocation(by: AllocationCategory = AllocationCategory.type, currency: str = None,
+                             user: User = Depends(resolve_user)):
+    currency = _resolve_currency(user, currency)
+    key = (user.username, by, currency, _get_data_version(user))
+
+    return allocation_cache.get_or_set(key, lambda: _get_allocation(user, by, currency))
@@ -0,0 +1,79 @@
+import os
+import re
+from datetime import datetime
+
+from fastapi import Depends
+from fastapi.responses import PlainTextResponse
+from starlette.concurrency import run_in_threadpool
+
+from ..config import SECRET_KEY, PROFILE_HEADER, PROFILE_INTERVAL, PROFILES_DIRECTORY, PROFILES_KEPT
+from ..exceptions import handled, AuthenticationError, NotFoundError
+from ..models.auth import User
+from ..profiling import Profile, current_profile, is_signed, remove_old_profiles
+from .auth import resolve_user, validate_admin_user
+
+
+def _get_profile_name(method: str, path: str):
+    return f'{datetime.utcnow():%Y%m%dT%H%M%S%f}-{method}-{re.sub(r"[^A-Za-z0-9]+", "_", path).strip("_")}'
+
+
+async def _is_profiling_allowed(request, header: str):
+    if is_signed(SECRET_KEY, request.method, request.url.path, header):
+        return True
+
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        return False
+
+    try:
+        user = await run_in_threadpool(resolve_user, token)
+
+    except AuthenticationError:
+        return False
+
+    return user.is_admin
+
+
+def _save_profile(profile: Profile):
+    profile.save(PROFILES_DIRECTORY)
+    remove_old_profiles(PROFILES_DIRECTORY, PROFILES_KEPT)
+
+
+async def profile_requests(request, call_next):
+    """
+    Middleware profiling the requests carrying the profiling header, when signed for their path or sent by an admin.
+
+    Profiles are saved as folded stacks, keeping only the latest PROFILES_KEPT, and summarised in the response header
+    with Mongo and lock waits split from CPU time.
+    """
+    header = request.headers.get(PROFILE_HEADER)
+    if not header or not await _is_profiling_allowed(request, header):
+        return await call_next(request)
+
+    profile = Profile(_get_profile_name(request.method, request.url.path), PROFILE_INTERVAL)
+    token = current_profile.set(profile)
+    profile.start()
+    try:
+        response = await call_next(request)
+
+    finally:
+        profile.stop()
+        current_profile.reset(token)
+
+    await run_in_threadpool(_save_profile, profile)
+    response.headers[PROFILE_HEADER] = '; '.join([
+        profile.name,
+        *(f'{category}={profile.time(category) * 1000:.1f}ms' for category in ('cpu', 'mongo', 'wait')),
+        f'total={profile.duration * 1000:.1f}ms'
+    ])
+    return response
+
+
+@handled
+def get_profile(profile_id: str, _: User = Depends(validate_admin_user)):
+    path = os.path.join(PROFILES_DIRECTORY, f'{os.path.basename(profile_id)}.folded')
+    if not os.path.isfile(path):
+        raise NotFoundError(f'Profile {profile_id} not found.')
+
+    with open(path) as f:
+        return PlainTextResponse(f.read())
@@ -0,0 +1,155 @@
+from collections import defaultdict, deque
+
+import pymongo
+from fastapi import Depends
+
+from ..cache import Cache
+from ..config import database
+from ..events import Event, subscribe
+from ..exceptions import handled, NotFoundError
+from ..models.auth import User
+from ..models.instruments import InstrumentType
+from .auth import resolve_user
+from .catalog import catalog_cache, get_currency_codes
+from .instruments import _get_date_from_code
+
+
+class RateMatrix:
+    """
+    Conversion rates between every pair of currencies connected by currency values.
+
+    Values are read as edges of a graph (1 unit of the instrument equals the rate in the value currency, and the
+    inverse), and every pair is resolved through the path with the fewest conversions. The date of the matrix is the
+    one of its latest value.
+    """
+
+    def __init__(self, values, date=None):
+        self.date = date
+        graph = defaultdict(dict)
+        for value in values:
+            source = value['instrument']['code']
+            for target, rate in value['values'].items():
+                if not rate or source == target:
+                    continue
+
+                graph[source][target] = rate
+                # Explicit quotes take precedence over inverted ones
+                graph[target].setdefault(source, 1 / rate)
+
+        self._rates = {source: self._resolve(graph, source) for source in graph}
+
+    @staticmethod
+    def _resolve(graph, source):
+        resolved = {source: (1.0, [source])}
+        pending = deque([source])
+
+        while pending:
+            current = pending.popleft()
+            rate, path = resolved[current]
+            for target, edge_rate in graph[current].items():
+                if target not in resolved:
+                    resolved[target] = (rate * edge_rate, path + [target])
+                    pending.append(target)
+
+        return resolved
+
+    @property
+    def currencies(self):
+        return set(self._rates)
+
+    def resolve(self, source: str, target: str):
+        if source == target:
+            return 1.0, [source]
+
+        try:
+            return self._rates[source][target]
+
+        except KeyError:
+            raise NotFoundError(f'No conversion rate from {source} to {target} found.')
+
+    def rate(self, source: str, target: str):
+        return self.resolve(source, target)[0]
+
+
+# Matrices by the date requested
+rate_matrices = Cache(max_size=366)
+
+
+def get_rate_matrix(date):
+    """
+    Matrix of the latest value of each currency on or before date, as rates are carried forward over dates without
+    them.
+    """
+    def build():
+        values = list(database.values.aggregate([
+            {
+                '$match': {
+                    'instrument.code': {'$in': get_currency_codes()},
+                    'date': {'$lte': date}
+                }
+            },
+            {
+                '$sort': {
+                    'instrument.code': pymongo.ASCENDING,
+                    'date': pymongo.DESCENDING
+                }
+            },
+            {
+                '$group': {
+                    '_id': '$instrument.code',
+                    'date': {'$first': '$date'},
+                    'values': {'$first': '$values'}
+                }
+            }
+        ]))
+        return RateMatrix(
+            [{'instrument': {'code': value['_id']}, 'values': value['values']} for value in values],
+            max((value['date'] for value in values), default=None)
+        )
+
+    return rate_matrices.get_or_set(date, build)
+
+
+def _is_currency(instrument: dict):
+    """Whether instrument is a currency, or may be one (references only hold the code of instruments not cached)."""
+    if 'type' not in instrument:
+        instrument = catalog_cache.get(('instruments', (instrument['code'],))) or {}
+
+    return instrument.get('type', InstrumentType.currency) == InstrumentType.currency
+
+
+@subscribe(Event.value_changed)
+def _invalidate_rate_matrix(instrument, **_):
+    if _is_currency(instrument):
+        # Values are carried forward to every later date
+        rate_matrices.clear()
+
+
+@subscribe(Event.instrument_changed)
+def _invalidate_rate_matrices(**_):
+    rate_matrices.clear()
+
+
+@subscribe(Event.data_changed)
+def _invalidate_changed_rate_matrices(collection, document, **_):
+    if collection == 'instruments' or (collection == 'values' and document is None):
+        # Deleted values only keep their id, so the currency they were of is unknown
+        _invalidate_rate_matrices()
+
+    elif collection == 'values':
+        _invalidate_rate_matrix(document['instrument'])
+
+
+@handled
+def get_rate(code: str, date_code: str, target: str, _: User = Depends(resolve_user)):
+    date = _get_date_from_code(date_code)
+    matrix = get_rate_matrix(date)
+    rate, path = matrix.resolve(code, target)
+
+    return {
+        'source': code,
+        'target': target,
+        'date': matrix.date or date,
+        'rate': rate,
+        'path': path
+    }
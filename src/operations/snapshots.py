@@ -0,0 +1,166 @@
+import math
+from datetime import datetime
+
+import pymongo
+from fastapi import Depends
+from pymongo import ReplaceOne
+
+from ..config import database
+from ..events import Event, subscribe
+from ..exceptions import handled, ValidationError
+from ..models.auth import User
+from ..models.instruments import InstrumentType
+from ..responses import get_projection
+from ..tasks import CoalescingQueue
+from .auth import resolve_user
+from .instruments import _get_date_from_code
+from .portfolio import BalanceChange, Valuation, _get_day, _get_today, _get_valuation, _resolve_currency, \
+    _resolve_period
+
+
+# Quantities below this are leftovers of floating point sums of movements that cancel out
+QUANTITY_TOLERANCE = 1e-9
+
+
+def _get_snapshot(user: User, currency: str, valuation: Valuation, row: int):
+    accounts = {}
+    for (account, instrument), quantity, price in zip(valuation.columns, valuation.holdings[row].tolist(),
+                                                      valuation.prices[row].tolist()):
+        if abs(quantity) < QUANTITY_TOLERANCE:
+            continue
+
+        value = None if math.isnan(price) else quantity * price
+        account_data = accounts.setdefault(account, {'code': account, 'value': 0, 'assets': []})
+        account_data['assets'].append({'instrument': instrument, 'quantity': quantity, 'value': value})
+        account_data['value'] += value or 0
+
+    return {
+        'owner': user.username,
+        'date': valuation.dates[row],
+        'currency': currency,
+        'value': sum(a['value'] for a in accounts.values()),
+        'accounts': list(accounts.values())
+    }
+
+
+def _get_opening(snapshot: dict):
+    """Holdings of a snapshot as the opening of a valuation after its date."""
+    return snapshot['date'], [
+        BalanceChange(snapshot['date'], account['code'], asset['instrument'], asset['quantity'])
+        for account in snapshot['accounts']
+        for asset in account['assets']
+    ]
+
+
+def _build_snapshots(user: User, dates: list, previous: dict = None):
+    """
+    Snapshots of user on each of dates (sorted), from a single valuation of the period they span.
+
+    The holdings of previous, a snapshot before the first date, are taken as they are, so only later transactions are
+    read.
+    """
+    currency = _resolve_currency(user)
+    start = dates[0]
+    valuation = _get_valuation(user, start, dates[-1], currency, _get_opening(previous) if previous else None)
+
+    return [_get_snapshot(user, currency, valuation, (date - start).days) for date in dates]
+
+
+def _refresh_owner_snapshots(owner: str, since: datetime):
+    """
+    Rebuild every materialized snapshot of owner from since on, plus the one of the current day.
+
+    Snapshots before since are up to date (older changes queue an earlier since), so the holdings are carried on from
+    the last of them.
+    """
+    user_data = database.users.find_one({'username': owner})
+    if not (user_data and user_data.get('base_currency')):
+        return
+
+    user = User(**user_data)
+    dates = set(database.snapshots.distinct('date', {'owner': owner, 'date': {'$gte': since}}))
+    today = _get_today()
+    if since <= today:
+        dates.add(today)
+
+    if dates:
+        previous = database.snapshots.find_one(
+            {'owner': owner, 'date': {'$lt': since}},
+            {'date': True, 'accounts': True},
+            sort=[('date', pymongo.DESCENDING)]
+        )
+        database.snapshots.bulk_write(
+            [
+                ReplaceOne({'owner': owner, 'date': snapshot['date']}, snapshot, upsert=True)
+                for snapshot in _build_snapshots(user, sorted(dates), previous)
+            ],
+            ordered=False
+        )
+
+
+def _refresh_snapshots(key: tuple, since: datetime):
+    kind, code = key
+    if kind == 'owner':
+        owners = [code]
+
+    elif kind == 'instrument':
+        # Owners that held the instrument since then, even if they no longer do
+        owners = database.snapshots.distinct(
+            'owner', {'accounts.assets.instrument': code, 'date': {'$gte': since}}
+        )
+
+    else:
+        # Currency rates can change the value of any snapshot in another currency
+        owners = database.snapshots.distinct('owner', {'date': {'$gte': since}})
+
+    for owner in owners:
+        _refresh_owner_snapshots(owner, since)
+
+
+snapshot_queue = CoalescingQueue(_refresh_snapshots, merge=min, name='snapshots')
+
+
+@subscribe(Event.balance_changed)
+def _queue_owner_snapshots(owner, entries, **_):
+    # Holdings change on the day entries were completed, reverting them changes the holdings from then on too
+    snapshot_queue.put(('owner', owner), _get_day(min(entry.completed_at for entry in entries)))
+
+
+@subscribe(Event.value_changed)
+def _queue_value_snapshots(instrument, date, **_):
+    if instrument.get('type') == InstrumentType.currency:
+        snapshot_queue.put(('rates', None), date)
+
+    else:
+        snapshot_queue.put(('instrument', instrument['code']), date)
+
+
+@handled
+def get_snapshot(date_code: str, user: User = Depends(resolve_user)):
+    date = _get_date_from_code(date_code)
+    if date > _get_today():
+        raise ValidationError(f'Snapshot date {date_code} is in the future')
+
+    snapshot = database.snapshots.find_one({'owner': user.username, 'date': date})
+    if not snapshot:
+        # Not materialized (past dates are only materialized once changed, the current day on its first change)
+        snapshot = _build_snapshots(user, [date])[0]
+
+    return snapshot
+
+
+@handled
+def get_snapshots(start: str, end: str = None, user: User = Depends(resolve_user), fields: str = None):
+    start_date, end_date = _resolve_period(start, end)
+
+    return [s for s in database.snapshots.find(
+        {
+            'owner': user.username,
+            'date': {'$gte': start_date, '$lte': end_date}
+        },
+        get_projection(fields)
+    ).sort(
+        [
+            ('date', pymongo.ASCENDING)
+        ]
+    )]
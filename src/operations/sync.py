@@ -0,0 +1,103 @@
+import base64
+import binascii
+from datetime import datetime, timedelta, timezone
+
+from fastapi import Depends
+from pymongo import ReturnDocument
+
+from ..config import database, SYNC_DELETIONS_TTL, SYNC_WRITES_TIMEOUT
+from ..exceptions import handled, ValidationError
+from ..models.auth import User
+from .auth import resolve_user
+from .catalog import resolve_references
+
+
+# Collections of documents owned by users, synced to their clients
+SYNCED_COLLECTIONS = ('accounts', 'transactions')
+
+
+def _get_counter_id(owner: str):
+    return f'sync:{owner}'
+
+
+def next_version(owner: str):
+    """
+    Fields to set on every document of owner written by an operation, so clients can sync the changes.
+
+    Versions are increasing numbers per owner, shared by all the writes of an operation. The writes land after the
+    version is allocated, so changes updated less than SYNC_WRITES_TIMEOUT before a sync are synced again next time
+    (see get_changes).
+    """
+    counter = database.meta.find_one_and_update(
+        {'_id': _get_counter_id(owner)},
+        {'$inc': {'version': 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return {'version': counter['version'], 'updated_at': datetime.utcnow()}
+
+
+def add_deletion(owner: str, collection: str, code: str, version: dict):
+    """Keep a tombstone of a deleted document, for clients to delete it when syncing."""
+    database.deletions.insert_one({
+        'owner': owner,
+        'collection': collection,
+        'code': code,
+        'version': version['version'],
+        'deleted_at': version['updated_at']
+    })
+
+
+def _get_current_version(owner: str):
+    counter = database.meta.find_one({'_id': _get_counter_id(owner)}, {'version': True})
+    return counter['version'] if counter else 0
+
+
+def _encode_token(version: int, issued_at: datetime):
+    return base64.urlsafe_b64encode(f'{version}:{issued_at.timestamp():.0f}'.encode()).decode()
+
+
+def _decode_token(token: str):
+    try:
+        version, issued_at = base64.urlsafe_b64decode(token.encode()).decode().split(':')
+        return int(version), datetime.fromtimestamp(int(issued_at), timezone.utc)
+
+    except (binascii.Error, UnicodeDecodeError, ValueError, OverflowError, OSError):
+        raise ValidationError(f'Invalid sync token {token}.')
+
+
+@handled
+def get_changes(since: str = None, user: User = Depends(resolve_user)):
+    now = datetime.now(timezone.utc)
+    version = None
+    if since:
+        version, issued_at = _decode_token(since)
+        if issued_at < now - timedelta(seconds=SYNC_DELETIONS_TTL):
+            # Tombstones of deletions since then may have expired already
+            version = None
+
+    # Read before the documents, so changes made while reading them are synced again next time
+    current_version = _get_current_version(user.username)
+
+    filters = {'owner': user.username}
+    deletion_filters = {'owner': user.username}
+    if version is not None:
+        # Writes of versions allocated before the previous sync may have landed after it
+        recent = (issued_at - timedelta(seconds=SYNC_WRITES_TIMEOUT)).replace(tzinfo=None)
+        filters['$or'] = [{'version': {'$gt': version}}, {'updated_at': {'$gte': recent}}]
+        deletion_filters['$or'] = [{'version': {'$gt': version}}, {'deleted_at': {'$gte': recent}}]
+
+    changes = {
+        collection: resolve_references(collection, list(database[collection].find(filters)))
+        for collection in SYNCED_COLLECTIONS
+    }
+    deleted = []
+    if version is not None:
+        changed = {(collection, d['code']) for collection, documents in changes.items() for d in documents}
+        # Documents deleted and created again are synced as changed
+        deleted = [
+            d for d in database.deletions.find(deletion_filters, {'collection': True, 'code': True})
+            if (d['collection'], d['code']) not in changed
+        ]
+
+    return {'token': _encode_token(current_version, now), 'reset': version is None, **changes, 'deleted': deleted}
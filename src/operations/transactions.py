@@ -1,15 +1,23 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import pymongo
 from fastapi import Depends
+from pymongo import ReturnDocument
 
 from ..config import database
+from ..events import Event, publish
 from ..exceptions import handled, ValidationError, NotFoundError
 from ..models.auth import User
 from ..models.balances import Balance
 from ..models.accounts import Account
 from ..models.transactions import Transaction, TransactionIn, TransactionEntryIn, TransactionStatus
+from ..references import REFERENCES, store_references, to_reference
+from ..responses import get_projection
 from .auth import resolve_user
+from .catalog import get_catalog_documents, resolve_references
+from .holdings import _update_lots
+from .instruments import _get_date_from_code
+from .sync import next_version
 
 
 def _get_transaction_for_processing(filters: dict, target_status: TransactionStatus):
@@ -20,7 +28,7 @@ def _get_transaction_for_processing(filters: dict, target_status: TransactionSta
     if doc['status'] == target_status:
         raise ValidationError(f'Transaction {filters["code"]} is already {target_status}.')
 
-    return Transaction(**doc)
+    return Transaction(**resolve_references('transactions', [doc])[0])
 
 
 def _resolve_entry_data(entry: TransactionEntryIn, user: User):
@@ -28,7 +36,8 @@ def _resolve_entry_data(entry: TransactionEntryIn, user: User):
     if not account_data:
         raise ValidationError(f'Account with code {entry.account} not found')
 
-    instrument_data = database.instruments.find_one({'code': entry.balance.instrument})
+    instrument_key = (entry.balance.instrument,)
+    instrument_data = get_catalog_documents('instruments', [instrument_key]).get(instrument_key)
     if not instrument_data:
         raise ValidationError(f'Instrument with code {entry.balance.instrument} not found')
 
@@ -39,32 +48,41 @@ def _resolve_entry_data(entry: TransactionEntryIn, user: User):
     return data
 
 
-def _revert_account_balance(user: User, account: Account, balance: Balance):
-    database.accounts.update_one(
+# Fields of the accounts returned by balance updates, published with the balance changes
+BALANCES_PROJECTION = {'_id': False, 'code': True, 'assets': True}
+
+
+def _revert_account_balance(user: User, account: Account, balance: Balance, version: dict):
+    return database.accounts.find_one_and_update(
         {'owner': user.username, 'code': account.code},
-        {'$inc': {'assets.$[asset].quantity': -balance.quantity}},
-        array_filters=[{'asset.instrument.code': balance.instrument.code}]
+        {'$inc': {'assets.$[asset].quantity': -balance.quantity}, '$set': version},
+        BALANCES_PROJECTION,
+        array_filters=[{'asset.instrument.code': balance.instrument.code}],
+        return_document=ReturnDocument.AFTER
     )
 
 
-def _update_account_balance(user: User, account: Account, balance: Balance):
+def _update_account_balance(user: User, account: Account, balance: Balance, version: dict):
     account_filter = {'owner': user.username, 'code': account.code}
 
     account_doc = database.accounts.find_one({**account_filter, 'assets.instrument.code': balance.instrument.code})
     if account_doc:
         # Account contains asset, update it
-        update_doc = {'$inc': {'assets.$[asset].quantity': balance.quantity}}
+        update_doc = {'$inc': {'assets.$[asset].quantity': balance.quantity}, '$set': version}
         array_filters = [{'asset.instrument.code': balance.instrument.code}]
 
     else:
         # Account does not contain asset, push it
-        update_doc = {'$push': {'assets': balance.dict()}}
+        asset = {'instrument': to_reference('instruments', balance.instrument.dict()), 'quantity': balance.quantity}
+        update_doc = {'$push': {'assets': asset}, '$set': version}
         array_filters = None
 
-    database.accounts.update_one(
+    return database.accounts.find_one_and_update(
         account_filter,
         update_doc,
-        array_filters=array_filters
+        BALANCES_PROJECTION,
+        array_filters=array_filters,
+        return_document=ReturnDocument.AFTER
     )
 
 
@@ -75,45 +93,80 @@ def add_transaction(transaction: TransactionIn, user: User = Depends(resolve_use
     data['status'] = TransactionStatus.pending
     data['code'] = datetime.utcnow().isoformat()[:19]
     data['entries'] = [_resolve_entry_data(entry, user) for entry in transaction.entries]
-    data['total']['instrument'] = database.instruments.find_one({'code': transaction.total.instrument})
+    total_key = (transaction.total.instrument,)
+    data['total']['instrument'] = get_catalog_documents('instruments', [total_key]).get(total_key)
 
-    database.transactions.insert_one(data)
+    database.transactions.insert_one({**store_references('transactions', data), **next_version(user.username)})
     return data
 
 
 @handled
-def get_transactions(user: User = Depends(resolve_user), s: TransactionStatus = None):
+def get_transactions(user: User = Depends(resolve_user), s: TransactionStatus = None, start: str = None,
+                     end: str = None, account: str = None, instrument: str = None, fields: str = None):
     filters = {'owner': user.username}
     if s:
         filters['status'] = s
 
-    return [t for t in database.transactions.find(filters).sort(
-        [
-            ('code', pymongo.DESCENDING)
-        ]
-    )]
+    if account:
+        filters['entries.account.code'] = account
+
+    if instrument:
+        filters['entries.balance.instrument.code'] = instrument
+
+    # Codes are the creation times of transactions, so date ranges are code ranges
+    if start:
+        filters.setdefault('code', {})['$gte'] = _get_date_from_code(start).isoformat()
+
+    if end:
+        filters.setdefault('code', {})['$lt'] = (_get_date_from_code(end) + timedelta(days=1)).isoformat()
+
+    return resolve_references('transactions', list(
+        database.transactions.find(filters, get_projection(fields, REFERENCES['transactions'])).sort(
+            [
+                ('code', pymongo.DESCENDING)
+            ]
+        )
+    ))
 
 
 @handled
 def complete_transaction(code: str, user: User = Depends(resolve_user)):
     transaction_filters = {'owner': user.username, 'code': code}
     transaction = _get_transaction_for_processing(transaction_filters, TransactionStatus.completed)
+    version = next_version(user.username)
+    completed_at = datetime.utcnow()
+    applied_entries = []
+    accounts = {}
 
     for entry_n, entry in enumerate(transaction.entries):
         if entry.status != TransactionStatus.completed:
             # TODO: make this block atomic (see https://github.com/kakonawao/portfolio-tracker-service/issues/44)
-            _update_account_balance(user, entry.account, entry.balance)
+            _update_lots(user.username, transaction, [entry], reverted=False)
+            accounts[entry.account.code] = _update_account_balance(user, entry.account, entry.balance, version)
             database.transactions.update_one(
                 transaction_filters,
-                {'$set': {f'entries.{entry_n}.status': TransactionStatus.completed}}
+                {
+                    '$set': {
+                        f'entries.{entry_n}.status': TransactionStatus.completed,
+                        f'entries.{entry_n}.completed_at': completed_at,
+                        **version
+                    }
+                }
             )
             entry.status = TransactionStatus.completed
+            entry.completed_at = completed_at
+            applied_entries.append(entry)
 
     database.transactions.update_one(
         transaction_filters,
-        {'$set': {'status': TransactionStatus.completed}},
+        {'$set': {'status': TransactionStatus.completed, **version}},
     )
     transaction.status = TransactionStatus.completed
+
+    if applied_entries:
+        publish(Event.balance_changed, owner=user.username, transaction=transaction, entries=applied_entries,
+                reverted=False, accounts=[a for a in accounts.values() if a])
+
     return transaction
 
 
@@ -121,23 +174,37 @@ def complete_transaction(code: str, user: User = Depends(resolve_user)):
 def cancel_transaction(code: str, user: User = Depends(resolve_user)):
     transaction_filters = {'owner': user.username, 'code': code}
     transaction = _get_transaction_for_processing(transaction_filters, TransactionStatus.cancelled)
+    version = next_version(user.username)
+    reverted_entries = []
+    accounts = {}
+
+    # Lots of every completed entry are reverted together, so a cancel that cannot be reverted changes nothing
+    completed_entries = [entry for entry in transaction.entries if entry.status == TransactionStatus.completed]
+    if completed_entries:
+        _update_lots(user.username, transaction, completed_entries, reverted=True)
 
     for entry_n, entry in enumerate(transaction.entries):
         if entry.status != TransactionStatus.cancelled:
             # TODO: make this block atomic (see https://github.com/kakonawao/portfolio-tracker-service/issues/44)
             if entry.status == TransactionStatus.completed:
                 # Entry already processed, need to revert it
-                _revert_account_balance(user, entry.account, entry.balance)
+                accounts[entry.account.code] = _revert_account_balance(user, entry.account, entry.balance, version)
+                reverted_entries.append(entry)
 
             database.transactions.update_one(
                 transaction_filters,
-                {'$set': {f'entries.{entry_n}.status': TransactionStatus.cancelled}}
+                {'$set': {f'entries.{entry_n}.status': TransactionStatus.cancelled, **version}}
             )
             entry.status = TransactionStatus.cancelled
 
     database.transactions.update_one(
         transaction_filters,
-        {'$set': {'status': TransactionStatus.cancelled}},
+        {'$set': {'status': TransactionStatus.cancelled, **version}},
     )
     transaction.status = TransactionStatus.cancelled
+
+    if reverted_entries:
+        publish(Event.balance_changed, owner=user.username, transaction=transaction, entries=reverted_entries,
+                reverted=True, accounts=[a for a in accounts.values() if a])
+
     return transaction
@@ -0,0 +1,125 @@
+import json
+
+from fastapi import Depends
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+from ..config import database, change_listener, UPDATES_MAX_PENDING, UPDATES_HEARTBEAT
+from ..events import Event, subscribe
+from ..models.auth import User
+from ..pubsub import Broker
+from .auth import resolve_user
+
+
+broker = Broker(max_pending=UPDATES_MAX_PENDING)
+
+
+def _get_topics(owner: str):
+    instruments = database.accounts.distinct('assets.instrument.code', {'owner': owner})
+    return [('balances', owner), *(('values', code) for code in instruments)]
+
+
+def _push_account(account: dict):
+    broker.publish(('balances', account['owner']), ('account', {
+        'code': account['code'],
+        'assets': [
+            {'instrument': asset['instrument']['code'], 'quantity': asset['quantity']}
+            for asset in account.get('assets', ())
+        ]
+    }))
+
+
+def _push_transaction(transaction: dict):
+    broker.publish(('balances', transaction['owner']), ('transaction', {
+        'code': transaction['code'],
+        'status': transaction['status']
+    }))
+
+
+def _push_value(value: dict):
+    broker.publish(('values', value['instrument']['code']), ('value', {
+        'instrument': value['instrument']['code'],
+        'date': value['date'].isoformat(),
+        'values': value['values']
+    }))
+
+
+# Updates pushed for the changes to documents of each collection
+PUSHERS = {
+    'accounts': _push_account,
+    'transactions': _push_transaction,
+    'values': _push_value
+}
+
+
+@subscribe(Event.data_changed)
+def _push_changes(collection, document, **_):
+    # Deleted documents only keep their id, so whose clients to update is unknown
+    if document is not None and collection in PUSHERS:
+        PUSHERS[collection](document)
+
+
+# Changes made by this worker are only pushed from its own events while the change stream is down
+
+@subscribe(Event.account_changed)
+def _push_account_changes(owner, code, account, **_):
+    if not change_listener.watching and account is not None:
+        _push_account({**account, 'owner': owner, 'code': code})
+
+
+@subscribe(Event.balance_changed)
+def _push_balance_changes(owner, transaction, accounts, **_):
+    if change_listener.watching:
+        return
+
+    _push_transaction(transaction.dict())
+    for account in accounts:
+        _push_account({**account, 'owner': owner})
+
+
+@subscribe(Event.value_changed)
+def _push_value_changes(instrument, date, values, **_):
+    if not change_listener.watching:
+        _push_value({'instrument': instrument, 'date': date, 'values': values})
+
+
+def _format_event(event: str, data: dict):
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+async def _stream(subscription, owner: str):
+    try:
+        while True:
+            message = await subscription.next(UPDATES_HEARTBEAT)
+            if message is None:
+                # Comment line keeping idle connections open through proxies
+                yield ': heartbeat\n\n'
+                continue
+
+            event, data = message
+            if event == 'account':
+                # Instruments may have been added to or removed from the holdings
+                broker.resubscribe(subscription, await run_in_threadpool(_get_topics, owner))
+
+            yield _format_event(event, data)
+
+    except StopAsyncIteration:
+        pass
+
+    finally:
+        broker.unsubscribe(subscription)
+
+
+async def get_updates(user: User = Depends(resolve_user)):
+    """
+    Server-sent events with the changes to the accounts and transactions of the user, made through any worker, and to
+    the values of the instruments they hold.
+
+    Clients falling too far behind receive a dropped event and are disconnected, to reconnect and reload their data.
+    """
+    subscription = broker.subscribe(await run_in_threadpool(_get_topics, user.username))
+    return StreamingResponse(
+        _stream(subscription, user.username),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
@@ -0,0 +1,144 @@
+import hashlib
+import hmac
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+
+# Python functions in which pymongo waits for the server, marking samples as Mongo wait rather than CPU time
+MONGO_WAIT_FUNCTIONS = {'send_message', 'receive_message', '_receive_data_on_socket', 'wait_for_read'}
+
+# Python functions in which threads block on locks or other threads, marking samples as wait time
+WAIT_FUNCTIONS = {'wait', '_wait_for_tstate_lock', 'acquire'}
+
+current_profile = ContextVar('current_profile', default=None)
+
+
+def _get_signature(secret: str, method: str, path: str, expires: int):
+    return hmac.new(secret.encode(), f'{method} {path} {expires}'.encode(), hashlib.sha256).hexdigest()
+
+
+def sign(secret: str, method: str, path: str, expires: int):
+    """
+    Value of the profiling header allowing anyone holding it to profile requests to path until expires (a Unix
+    timestamp).
+    """
+    return f'{expires}.{_get_signature(secret, method, path, expires)}'
+
+
+def is_signed(secret: str, method: str, path: str, header: str):
+    """Whether header is an unexpired signature of method and path (see sign)."""
+    expires, _, signature = header.partition('.')
+    if not expires.isascii() or not expires.isdigit() or int(expires) < time.time():
+        return False
+
+    return hmac.compare_digest(signature.encode(), _get_signature(secret, method, path, int(expires)).encode())
+
+
+def _is_mongo_wait(frame):
+    return frame.f_code.co_name in MONGO_WAIT_FUNCTIONS and f'{os.sep}pymongo{os.sep}' in frame.f_code.co_filename
+
+
+def _is_idle(frame):
+    # Event loop waiting for I/O, while the request is being served elsewhere
+    return frame.f_code.co_name == 'select' and frame.f_code.co_filename.endswith('selectors.py')
+
+
+def _get_stack(frame):
+    """Stack of frame from its outermost call, rooted at the category of the sample (cpu, mongo or wait)."""
+    if _is_idle(frame):
+        return None
+
+    category = 'wait' if frame.f_code.co_name in WAIT_FUNCTIONS else 'cpu'
+    names = []
+    while frame is not None:
+        if _is_mongo_wait(frame):
+            category = 'mongo'
+
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+
+    return (category, *reversed(names))
+
+
+class Profile:
+    """
+    Sampling profile of the threads working on a single request.
+
+    Only the threads running operations for the request are sampled, while they do (see add_thread), every interval
+    seconds until the profile is stopped. The thread starting the profile is not, as the event loop serves other
+    requests meanwhile.
+    """
+
+    def __init__(self, name: str, interval: float):
+        self.name = name
+        self.interval = interval
+        self.samples = Counter()
+        self.ticks = 0
+        self.duration = 0.0
+        self._threads = set()
+        self._stopped = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, name=f'profile-{name}', daemon=True)
+        self._start = None
+
+    def add_thread(self):
+        """Sample the calling thread too, returning whether it was not sampled already."""
+        ident = threading.get_ident()
+        if ident in self._threads:
+            return False
+
+        self._threads.add(ident)
+        return True
+
+    def remove_thread(self):
+        self._threads.discard(threading.get_ident())
+
+    def _sample(self):
+        while not self._stopped.wait(self.interval):
+            frames = sys._current_frames()
+            self.ticks += 1
+            for ident in list(self._threads):
+                stack = _get_stack(frames[ident]) if ident in frames else None
+                if stack is not None:
+                    self.samples[stack] += 1
+
+    def start(self):
+        self._start = time.perf_counter()
+        self._sampler.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._sampler.join()
+        self.duration = time.perf_counter() - self._start
+
+    def time(self, category: str):
+        """Thread seconds spent in category (cpu, mongo or wait), estimated from the share of samples taken in it."""
+        if not self.ticks:
+            return 0.0
+
+        return sum(count for stack, count in self.samples.items() if stack[0] == category) / self.ticks * self.duration
+
+    def folded(self):
+        """Samples in the folded stack format read by flame graph tools."""
+        return ''.join(f'{";".join(stack)} {count}\n' for stack, count in sorted(self.samples.items()))
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f'{self.name}.folded'), 'w') as f:
+            f.write(self.folded())
+
+
+def remove_old_profiles(directory: str, kept: int):
+    """Remove all but the kept latest profiles saved to directory."""
+    names = sorted(name for name in os.listdir(directory) if name.endswith('.folded'))
+    for name in names[:-kept] if kept else names:
+        try:
+            os.remove(os.path.join(directory, name))
+
+        except FileNotFoundError:
+            # Removed by another request meanwhile
+            pass
@@ -0,0 +1,153 @@
+import asyncio
+import threading
+from collections import defaultdict
+
+from .metrics import subscribers_dropped
+
+
+_CLOSED = object()
+
+
+class Subscription:
+    """
+    Messages published to some topics, in the order they were published, consumed by iterating the subscription.
+
+    At most max_pending messages are kept for it: a subscriber falling further behind is dropped, receiving a final
+    dropped message instead of the messages it missed.
+    """
+
+    def __init__(self, topics, max_pending: int):
+        self.topics = frozenset(topics)
+        self.max_pending = max_pending
+        self.closed = False
+        self.loop = asyncio.get_running_loop()
+        # Room for the final message and the end of the subscription, past the pending messages
+        self._queue = asyncio.Queue(max_pending + 2)
+
+    def _put(self, message):
+        if self.closed:
+            return True
+
+        if self._queue.qsize() >= self.max_pending:
+            return False
+
+        self._queue.put_nowait(message)
+        return True
+
+    def _close(self, message=None):
+        if self.closed:
+            return
+
+        self.closed = True
+        while not self._queue.empty():
+            self._queue.get_nowait()
+
+        if message is not None:
+            self._queue.put_nowait(message)
+
+        self._queue.put_nowait(_CLOSED)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        message = await self._queue.get()
+        if message is _CLOSED:
+            raise StopAsyncIteration
+
+        return message
+
+    async def next(self, timeout: float):
+        """Next message, or None when none was published within timeout seconds."""
+        try:
+            return await asyncio.wait_for(self.__anext__(), timeout)
+
+        except asyncio.TimeoutError:
+            return None
+
+
+class Broker:
+    """
+    In-process pub/sub delivering messages to asyncio subscribers.
+
+    Subscriptions are made from the event loop, while messages may be published from any thread: they are handed
+    over to the loop, so publishers never wait for subscribers.
+    """
+
+    def __init__(self, max_pending: int = 100):
+        self.max_pending = max_pending
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, topics) -> Subscription:
+        subscription = Subscription(topics, self.max_pending)
+        with self._lock:
+            for topic in subscription.topics:
+                self._subscriptions[topic].add(subscription)
+
+        return subscription
+
+    def resubscribe(self, subscription: Subscription, topics):
+        """Change the topics subscription receives messages from."""
+        with self._lock:
+            self._remove(subscription)
+            subscription.topics = frozenset(topics)
+            for topic in subscription.topics:
+                self._subscriptions[topic].add(subscription)
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._remove(subscription)
+
+        subscription._close()
+
+    def _remove(self, subscription: Subscription):
+        for topic in subscription.topics:
+            subscribers = self._subscriptions.get(topic)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscriptions[topic]
+
+    def publish(self, topic, message):
+        with self._lock:
+            subscribers = list(self._subscriptions.get(topic, ()))
+
+        by_loop = defaultdict(list)
+        for subscription in subscribers:
+            by_loop[subscription.loop].append(subscription)
+
+        try:
+            running = asyncio.get_running_loop()
+
+        except RuntimeError:
+            running = None
+
+        for loop, subscriptions in by_loop.items():
+            if loop is running:
+                self._deliver(subscriptions, message)
+
+            elif not loop.is_closed():
+                loop.call_soon_threadsafe(self._deliver, subscriptions, message)
+
+    def _deliver(self, subscriptions: list, message):
+        for subscription in subscriptions:
+            if not subscription._put(message):
+                with self._lock:
+                    self._remove(subscription)
+
+                subscription._close(('dropped', {'reason': 'too many pending messages'}))
+                subscribers_dropped.inc()
+
+    def close(self):
+        """End every subscription."""
+        with self._lock:
+            subscriptions = {s for subscribers in self._subscriptions.values() for s in subscribers}
+            self._subscriptions.clear()
+
+        for subscription in subscriptions:
+            subscription._close()
+
+    def __len__(self):
+        with self._lock:
+            return len({s for subscribers in self._subscriptions.values() for s in subscribers})
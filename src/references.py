@@ -0,0 +1,81 @@
+from pymongo import UpdateOne
+
+
+# Fields identifying the documents of each catalog collection, which references to them keep
+REFERENCE_FIELDS = {
+    'institutions': ('type', 'code'),
+    'instruments': ('code',)
+}
+
+# Catalog documents referenced by the documents of each collection, as dotted path to the catalog collection (paths
+# through lists reference a document per item)
+REFERENCES = {
+    'accounts': {'holder': 'institutions', 'assets.instrument': 'instruments'},
+    'transactions': {'total.instrument': 'instruments', 'entries.balance.instrument': 'instruments'},
+    'values': {'instrument': 'instruments'},
+    'instruments': {'exchange': 'institutions'}
+}
+
+
+def to_reference(catalog: str, document: dict):
+    return {field: document[field] for field in REFERENCE_FIELDS[catalog] if field in document}
+
+
+def get_reference_key(catalog: str, reference: dict):
+    return tuple(reference.get(field) for field in REFERENCE_FIELDS[catalog])
+
+
+def _replace(value, names: list, function):
+    if isinstance(value, list):
+        return [_replace(item, names, function) for item in value]
+
+    if not isinstance(value, dict):
+        return value
+
+    if not names:
+        return function(value)
+
+    name, *rest = names
+    if name not in value:
+        return value
+
+    return {**value, name: _replace(value[name], rest, function)}
+
+
+def replace_references(collection: str, document: dict, function):
+    """Copy of document with every catalog document it references replaced by function(catalog, referenced)."""
+    for path, catalog in REFERENCES.get(collection, {}).items():
+        document = _replace(document, path.split('.'), lambda referenced: function(catalog, referenced))
+
+    return document
+
+
+def iter_references(collection: str, document: dict):
+    """(catalog, reference) pairs of the catalog documents referenced by document."""
+    references = []
+    replace_references(collection, document, lambda catalog, reference: references.append((catalog, reference)))
+    return references
+
+
+def store_references(collection: str, document: dict):
+    """Copy of document to store, referencing catalog documents by the fields identifying them instead of embedding."""
+    return replace_references(collection, document, to_reference)
+
+
+def migrate_references(database, batch_size: int = 1000):
+    """Replace the catalog documents embedded in every stored document by references."""
+    for collection, paths in REFERENCES.items():
+        roots = {path.split('.')[0] for path in paths}
+        requests = []
+        for document in database[collection].find({}, {root: True for root in roots}):
+            stored = store_references(collection, document)
+            if stored != document:
+                update = {root: stored[root] for root in roots if root in stored}
+                requests.append(UpdateOne({'_id': document['_id']}, {'$set': update}))
+
+            if len(requests) >= batch_size:
+                database[collection].bulk_write(requests, ordered=False)
+                requests = []
+
+        if requests:
+            database[collection].bulk_write(requests, ordered=False)
@@ -0,0 +1,182 @@
+import functools
+from inspect import isclass
+from typing import Union
+
+import orjson
+from fastapi import status, HTTPException
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from pydantic.fields import FieldInfo
+from typing_extensions import Annotated, get_args, get_origin
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content):
+        return orjson.dumps(content, default=str, option=orjson.OPT_NON_STR_KEYS)
+
+
+def _merge_shapes(shapes):
+    merged = {}
+    for shape in shapes:
+        for name, field_shape in (shape or {}).items():
+            current = merged.get(name)
+            if isinstance(current, dict) and isinstance(field_shape, dict):
+                merged[name] = _merge_shapes([current, field_shape])
+
+            elif current is None:
+                merged[name] = field_shape
+
+    return merged
+
+
+class DiscriminatedShape:
+    """Shape of a discriminated union, each item takes the shape of the member matching its discriminator."""
+
+    def __init__(self, discriminator: str, shapes: dict):
+        self.discriminator = discriminator
+        self.shapes = shapes
+        self.merged = _merge_shapes(self.shapes.values())
+
+    def get(self, data):
+        return self.shapes.get(data.get(self.discriminator), self.merged)
+
+
+def get_shape(type_):
+    """
+    Fields of a response model that have to be returned, as a nested structure.
+
+    Models become a dict of field name to field shape, lists a single item list with the shape of their items, unions a
+    merge of their members (or a DiscriminatedShape if they have a discriminator) and everything else (values returned
+    as they are) None.
+    """
+    origin = get_origin(type_)
+    if origin is Annotated:
+        type_, *metadata = get_args(type_)
+        discriminator = next((m.discriminator for m in metadata if isinstance(m, FieldInfo) and m.discriminator), None)
+        if discriminator:
+            return DiscriminatedShape(discriminator, {
+                value: get_shape(member)
+                for member in get_args(type_)
+                for value in get_args(member.__fields__[discriminator].outer_type_)
+            })
+
+        return get_shape(type_)
+
+    if origin in (list, tuple, set):
+        return [get_shape(get_args(type_)[0])]
+
+    if origin is Union:
+        return _merge_shapes(get_shape(member) for member in get_args(type_))
+
+    if isclass(type_) and issubclass(type_, BaseModel):
+        return {name: get_shape(field.outer_type_) for name, field in type_.__fields__.items()}
+
+    return None
+
+
+def parse_fields(fields: str):
+    """
+    Paths of the fields selected by a comma separated list of dotted paths (eg, code,entries.account.code).
+
+    Paths under another selected path are dropped, as they are already selected.
+    """
+    paths = sorted({path.strip() for path in fields.split(',') if path.strip()})
+    return [path for n, path in enumerate(paths) if not any(path.startswith(f'{p}.') for p in paths[:n])]
+
+
+def get_projection(fields: str = None, references=()):
+    """
+    Mongo projection of the fields selected (see parse_fields), or None for whole documents.
+
+    Fields of the documents referenced at the paths in references project the whole reference instead, so it can be
+    resolved.
+    """
+    if not fields:
+        return None
+
+    paths = [next((r for r in references if path.startswith(f'{r}.')), path) for path in parse_fields(fields)]
+    return {'_id': False, **{path: True for path in parse_fields(','.join(paths))}}
+
+
+def _select(shape, tree: dict, strict: bool = True):
+    if not tree:
+        return shape
+
+    if isinstance(shape, list):
+        return [_select(shape[0], tree, strict)]
+
+    if isinstance(shape, DiscriminatedShape):
+        _select(shape.merged, tree)
+        # Fields may only be part of some members
+        return DiscriminatedShape(
+            shape.discriminator, {value: _select(member, tree, False) for value, member in shape.shapes.items()}
+        )
+
+    if not isinstance(shape, dict):
+        raise KeyError(next(iter(tree)))
+
+    selected = {}
+    for name, subtree in tree.items():
+        if name in shape:
+            selected[name] = _select(shape[name], subtree, strict)
+
+        elif strict:
+            raise KeyError(name)
+
+    return selected
+
+
+def select(shape, fields: str):
+    """Part of shape with only the fields selected (see parse_fields), raising KeyError for fields not in it."""
+    tree = {}
+    for path in parse_fields(fields):
+        node = tree
+        for name in path.split('.'):
+            node = node.setdefault(name, {})
+
+    return _select(shape, tree)
+
+
+def prune(shape, data):
+    """Drop everything from data that is not part of shape (eg, mongo ids) without validating it."""
+    if shape is None or data is None:
+        return data
+
+    if isinstance(shape, list):
+        return [prune(shape[0], item) for item in data]
+
+    if isinstance(data, BaseModel):
+        data = data.dict()
+
+    if isinstance(shape, DiscriminatedShape):
+        shape = shape.get(data)
+
+    return {name: prune(shape[name], value) for name, value in data.items() if name in shape}
+
+
+def trusted(operation, response_model):
+    """
+    Return the result of operation as JSON shaped as response_model, skipping response validation and encoding.
+
+    Only for operations returning documents stored through our own input models, which were validated on write.
+
+    Operations taking a fields argument return only the fields selected by it (see parse_fields), which should be
+    projected from the documents they read.
+    """
+    shape = get_shape(response_model)
+
+    @functools.lru_cache(maxsize=256)
+    def select_fields(fields: str):
+        try:
+            return select(shape, fields)
+
+        except KeyError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f'Unknown field {e.args[0]}')
+
+    @functools.wraps(operation)
+    def wrap_operation(*args, **kwargs):
+        fields = kwargs.get('fields')
+        selected = select_fields(fields) if fields else shape
+        return FastJSONResponse(prune(selected, operation(*args, **kwargs)))
+
+    return wrap_operation
@@ -0,0 +1,128 @@
+import heapq
+import re
+import threading
+
+
+_WORD = re.compile(r'[^\W_]+')
+
+
+def _get_words(text):
+    return _WORD.findall(str(text).lower()) if text else []
+
+
+class PrefixIndex:
+    """
+    In-memory index of documents by the prefixes of the words in some of their fields, for autocompletion.
+
+    Every prefix maps to the documents having a word starting with it, scored by the weight of the field the word is
+    in (doubled when the prefix is the whole word), so searching is a few dictionary lookups. Documents are loaded on
+    first use, and again after the index is marked stale.
+    """
+
+    def __init__(self, load, fields: dict, key: str = 'code'):
+        self.load = load
+        self.fields = fields
+        self.key = key
+        self._documents = {}
+        self._prefixes = {}
+        # Keys of the documents matching a prefix, best scored first, for the prefixes searched alone
+        self._ranked = {}
+        self._stale = True
+        self._lock = threading.RLock()
+
+    def _get_scores(self, document: dict):
+        scores = {}
+        for field, weight in self.fields.items():
+            for word in _get_words(document.get(field)):
+                for length in range(1, len(word) + 1):
+                    prefix = word[:length]
+                    score = weight * 2 if length == len(word) else weight
+                    scores[prefix] = max(scores.get(prefix, 0), score)
+
+        return scores
+
+    def _add(self, document: dict):
+        key = document[self.key]
+        self._remove(key)
+        self._documents[key] = document
+        for prefix, score in self._get_scores(document).items():
+            self._prefixes.setdefault(prefix, {})[key] = score
+            self._ranked.pop(prefix, None)
+
+    def _remove(self, key):
+        document = self._documents.pop(key, None)
+        if document is None:
+            return
+
+        for prefix in self._get_scores(document):
+            self._ranked.pop(prefix, None)
+            keys = self._prefixes[prefix]
+            del keys[key]
+            if not keys:
+                del self._prefixes[prefix]
+
+    def _ensure_loaded(self):
+        if self._stale:
+            documents = list(self.load())
+            self._documents, self._prefixes, self._ranked = {}, {}, {}
+            for document in documents:
+                self._add(document)
+
+            self._stale = False
+
+    def add(self, document: dict):
+        with self._lock:
+            if not self._stale:
+                self._add(document)
+
+    def remove(self, key):
+        with self._lock:
+            if not self._stale:
+                self._remove(key)
+
+    def mark_stale(self):
+        with self._lock:
+            self._stale = True
+
+    def _rank(self, prefix: str):
+        ranked = self._ranked.get(prefix)
+        if ranked is None:
+            scores = self._prefixes.get(prefix)
+            if scores is None:
+                return []
+
+            ranked = self._ranked[prefix] = sorted(scores, key=lambda key: (-scores[key], key))
+
+        return ranked
+
+    def search(self, query: str, limit: int = 10):
+        """Documents with words starting with every word of query, best scored first (by key on ties)."""
+        words = _get_words(query)
+        if not words:
+            return []
+
+        with self._lock:
+            self._ensure_loaded()
+            if len(words) == 1:
+                return [self._documents[key] for key in self._rank(words[0])[:limit]]
+
+            matches = [self._prefixes.get(word, {}) for word in words]
+            matches.sort(key=len)
+            scores = {}
+            for key, score in matches[0].items():
+                for other in matches[1:]:
+                    other_score = other.get(key)
+                    if other_score is None:
+                        break
+
+                    score += other_score
+
+                else:
+                    scores[key] = score
+
+            best = heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], item[0]))
+            return [self._documents[key] for key, _ in best]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._documents)
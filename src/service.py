@@ -1,20 +1,34 @@
-import pymongo
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic.fields import List, Union
+from pydantic.fields import List
 
-from .config import database, CORS_ORIGINS
+from .config import database, change_listener, slow_query_log, CORS_ORIGINS
+from .migrations import check_schema_version
+from .responses import trusted
+from .tracing import track_round_trips
 from .models.auth import User
 from .models.institutions import Institution
-from .models.instruments import Instrument, Security, Value
-from .models.accounts import FinancialAccount, CashAccount
+from .models.instruments import InstrumentOut, Value, Rate
+from .models.accounts import AccountOut
 from .models.transactions import Transaction
+from .models.portfolio import PortfolioValue, PortfolioReturns, Allocation
+from .models.snapshots import Snapshot
+from .models.holdings import Holding
+from .models.sync import Changes
 from .operations.auth import add_user, authenticate, get_current_user
 from .operations.institutions import add_institution, get_institutions, modify_institution, delete_institution
-from .operations.instruments import add_instrument, get_instruments, modify_instrument, delete_instrument, set_value, \
-    get_value
+from .operations.instruments import add_instrument, get_instruments, search_instruments, modify_instrument, \
+    delete_instrument, set_value, get_value
+from .operations.rates import get_rate
 from .operations.accounts import add_account, get_accounts, modify_account, delete_account
 from .operations.transactions import add_transaction, get_transactions, complete_transaction, cancel_transaction
+from .operations.portfolio import get_portfolio_values, get_portfolio_returns, get_portfolio_allocation
+from .operations.snapshots import get_snapshot, get_snapshots, snapshot_queue
+from .operations.holdings import get_holdings
+from .operations.sync import get_changes
+from .operations.metrics import get_metrics
+from .operations.profiles import profile_requests, get_profile
+from .operations.updates import broker, get_updates
 
 
 # Service
@@ -33,88 +47,79 @@ service.add_middleware(
 )
 
 
+# Attribute database round trips to each request
+
+service.middleware('http')(track_round_trips)
+
+
+# Profile requests asking for it
+
+service.middleware('http')(profile_requests)
+
+
 # Start/end event hooks
 
 @service.on_event("startup")
 async def startup_event():
-    database.users.create_index(
-        [
-            ('username', pymongo.ASCENDING)
-         ],
-        unique=True
-    )
-
-    database.institutions.create_index(
-        [
-            ('type', pymongo.ASCENDING),
-            ('code', pymongo.ASCENDING)
-        ],
-        unique=True
-    )
-
-    database.instruments.create_index(
-        [
-            ('type', pymongo.ASCENDING),
-            ('symbol', pymongo.ASCENDING)
-        ]
-    )
-    database.instruments.create_index(
-        [
-            ('code', pymongo.ASCENDING)
-        ],
-        unique=True
-    )
-
-    database.accounts.create_index(
-        [
-            ('owner', pymongo.ASCENDING),
-            ('code', pymongo.ASCENDING)
-        ],
-        unique=True
-    )
-
-    database.transactions.create_index(
-        [
-            ('owner', pymongo.ASCENDING),
-            ('code', pymongo.ASCENDING)
-        ],
-        unique=True
-    )
-
-    database.values.create_index(
-        [
-            ('instrument.code', pymongo.ASCENDING),
-            ('date', pymongo.DESCENDING)
-        ],
-        unique=True
-    )
-
-
-# Hook up resources to operations
+    check_schema_version(database)
+
+    snapshot_queue.start()
+    slow_query_log.start(database.client)
+    change_listener.start(database)
+
+
+@service.on_event("shutdown")
+async def shutdown_event():
+    snapshot_queue.stop()
+    slow_query_log.stop()
+    change_listener.stop()
+    broker.close()
+
+
+# Hook up resources to operations (list operations returning stored documents skip response validation)
 
 service.post('/users', response_model=User)(add_user)
 service.post('/sessions')(authenticate)
 service.get('/sessions/current', response_model=User)(get_current_user)
 
 service.post('/institutions', response_model=Institution)(add_institution)
-service.get('/institutions', response_model=List[Institution])(get_institutions)
+service.get('/institutions', response_model=List[Institution])(trusted(get_institutions, List[Institution]))
 service.put('/institutions/{code}', response_model=Institution)(modify_institution)
 service.delete('/institutions/{code}')(delete_institution)
 
-service.post('/instruments', response_model=Union[Security, Instrument])(add_instrument)
-service.get('/instruments', response_model=List[Union[Security, Instrument]])(get_instruments)
-service.put('/instruments/{code}', response_model=Union[Security, Instrument])(modify_instrument)
+service.post('/instruments', response_model=InstrumentOut)(add_instrument)
+service.get('/instruments', response_model=List[InstrumentOut])(trusted(get_instruments, List[InstrumentOut]))
+service.get('/instruments/search', response_model=List[InstrumentOut])(
+    trusted(search_instruments, List[InstrumentOut])
+)
+service.put('/instruments/{code}', response_model=InstrumentOut)(modify_instrument)
 service.delete('/instruments/{code}')(delete_instrument)
-service.put('/instruments/{code}/values/{date}', response_model=Value)(set_value)
-service.get('/instruments/{code}/values/{date}', response_model=Value)(get_value)
+service.put('/instruments/{code}/values/{date_code}', response_model=Value)(set_value)
+service.get('/instruments/{code}/values/{date_code}', response_model=Value)(get_value)
+service.get('/instruments/{code}/rates/{date_code}', response_model=Rate)(get_rate)
 
-service.post('/accounts', response_model=Union[FinancialAccount, CashAccount])(add_account)
-service.get('/accounts', response_model=List[Union[FinancialAccount, CashAccount]])(get_accounts)
-service.put('/accounts/{code}', response_model=Union[FinancialAccount, CashAccount])(modify_account)
+service.post('/accounts', response_model=AccountOut)(add_account)
+service.get('/accounts', response_model=List[AccountOut])(trusted(get_accounts, List[AccountOut]))
+service.put('/accounts/{code}', response_model=AccountOut)(modify_account)
 service.delete('/accounts/{code}')(delete_account)
 
 service.post('/transactions', response_model=Transaction)(add_transaction)
-service.get('/transactions', response_model=List[Transaction])(get_transactions)
+service.get('/transactions', response_model=List[Transaction])(trusted(get_transactions, List[Transaction]))
 service.put('/transactions/{code}/complete', response_model=Transaction)(complete_transaction)
 service.put('/transactions/{code}/cancel', response_model=Transaction)(cancel_transaction)
 
+service.get('/portfolio/values', response_model=List[PortfolioValue])(get_portfolio_values)
+service.get('/portfolio/returns', response_model=PortfolioReturns)(get_portfolio_returns)
+service.get('/portfolio/allocation', response_model=List[Allocation])(get_portfolio_allocation)
+
+service.get('/snapshots', response_model=List[Snapshot])(trusted(get_snapshots, List[Snapshot]))
+service.get('/snapshots/{date_code}', response_model=Snapshot)(get_snapshot)
+
+service.get('/holdings', response_model=List[Holding])(get_holdings)
+
+service.get('/sync', response_model=Changes)(get_changes)
+
+service.get('/updates')(get_updates)
+
+service.get('/metrics', include_in_schema=False)(get_metrics)
+service.get('/profiles/{profile_id}', include_in_schema=False)(get_profile)
@@ -0,0 +1,128 @@
+import json
+import logging
+
+from pymongo import monitoring
+
+from .tasks import CoalescingQueue
+
+
+logger = logging.getLogger(__name__)
+
+# Commands that can be explained, with the fields describing their query
+EXPLAINABLE = {
+    'find': ('filter', 'sort'),
+    'count': ('query',),
+    'distinct': ('query',),
+    'aggregate': ('pipeline',),
+    'update': ('updates',),
+    'delete': ('deletes',),
+    'findAndModify': ('query', 'sort')
+}
+
+# Command fields that only make sense when the command itself is run
+SESSION_FIELDS = {'lsid', 'txnNumber', 'autocommit', 'startTransaction', 'writeConcern', '$db', '$clusterTime',
+                  '$readPreference'}
+
+
+def _shape(value):
+    """Query with every value replaced by a placeholder, so queries differing only in their values are logged once."""
+    if isinstance(value, dict):
+        return {k: _shape(v) for k, v in value.items()}
+
+    if isinstance(value, list):
+        return [_shape(v) for v in value]
+
+    return 1
+
+
+def _get_stages(plan: dict):
+    stages = [plan.get('stage')]
+    for child in [plan.get('inputStage'), *plan.get('inputStages', ())]:
+        if child:
+            stages.extend(_get_stages(child))
+
+    return stages
+
+
+def _get_section(explain: dict, section: str):
+    data = explain.get(section)
+    if data is None:
+        # Aggregations report the plan of their initial cursor stage
+        for stage in explain.get('stages', ()):
+            data = stage.get('$cursor', {}).get(section)
+            if data:
+                break
+
+    return data or {}
+
+
+def get_plan_stages(explain: dict):
+    """Stages of the winning plan in the output of an explain command, from the root one."""
+    plan = _get_section(explain, 'queryPlanner').get('winningPlan', {})
+    # Plans run by the slot based engine keep the classic plan tree in queryPlan
+    return _get_stages(plan.get('queryPlan', plan))
+
+
+def get_execution_stats(explain: dict):
+    return _get_section(explain, 'executionStats')
+
+
+def explain_command(database, command: dict, verbosity: str = 'queryPlanner'):
+    command = {k: v for k, v in command.items() if k not in SESSION_FIELDS}
+    return database.command('explain', command, verbosity=verbosity)
+
+
+class SlowQueryLog(monitoring.CommandListener):
+    """
+    Logs the winning plan of every command slower than threshold (in seconds), flagging collection scans.
+
+    Plans are explained out of band in a background queue, once per query shape pending, after the log is started
+    with the client to explain them with.
+    """
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        self.client = None
+        self.queue = CoalescingQueue(self._explain, name='slow-queries')
+        self._commands = {}
+
+    def started(self, event):
+        if event.command_name in EXPLAINABLE:
+            self._commands[(event.connection_id, event.request_id)] = event.command
+
+    def succeeded(self, event):
+        command = self._commands.pop((event.connection_id, event.request_id), None)
+        duration = event.duration_micros / 1e6
+        if command is not None and duration >= self.threshold:
+            query = {field: command.get(field) for field in EXPLAINABLE[event.command_name]}
+            key = (
+                event.database_name,
+                event.command_name,
+                command.get(event.command_name),
+                json.dumps(_shape(query), sort_keys=True, default=str)
+            )
+            self.queue.put(key, (command, duration))
+
+    def failed(self, event):
+        self._commands.pop((event.connection_id, event.request_id), None)
+
+    def _explain(self, key: tuple, value: tuple):
+        database_name, command_name, collection, shape = key
+        command, duration = value
+        explain = explain_command(self.client[database_name], command)
+        stages = get_plan_stages(explain)
+        logger.warning(json.dumps({
+            'collection': collection,
+            'command': command_name,
+            'query': {field: command.get(field) for field in EXPLAINABLE[command_name]},
+            'duration_ms': round(duration * 1000, 1),
+            'plan': stages,
+            'collscan': 'COLLSCAN' in stages
+        }, default=str))
+
+    def start(self, client):
+        self.client = client
+        self.queue.start()
+
+    def stop(self, timeout: float = None):
+        self.queue.stop(timeout)
@@ -0,0 +1,76 @@
+import logging
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+class CoalescingQueue:
+    """
+    Background queue that runs handler(key, value) once per queued key.
+
+    Keys queued again while still pending are coalesced into a single run, with their values combined by merge (the
+    latest value is kept by default). Nothing is processed until the queue is started, but keys are still collected.
+    """
+
+    def __init__(self, handler, merge=None, name: str = None):
+        self.handler = handler
+        self.merge = merge or (lambda current, new: new)
+        self.name = name or handler.__name__
+        self._pending = {}
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+
+    def put(self, key, value=None):
+        with self._condition:
+            if key in self._pending:
+                value = self.merge(self._pending[key], value)
+
+            self._pending[key] = value
+            self._condition.notify()
+
+    def _take(self, wait: bool = False):
+        with self._condition:
+            while wait and self._running and not self._pending:
+                self._condition.wait()
+
+            pending, self._pending = self._pending, {}
+            return pending
+
+    def _process(self, pending: dict):
+        for key, value in pending.items():
+            try:
+                self.handler(key, value)
+
+            except Exception:
+                logger.exception('Task %s failed for key %s', self.name, key)
+
+    def _run(self):
+        while self._running:
+            self._process(self._take(wait=True))
+
+    def drain(self):
+        """Process every pending key in the calling thread."""
+        self._process(self._take())
+
+    def start(self):
+        with self._condition:
+            if self._running:
+                return
+
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = None):
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def __len__(self):
+        return len(self._pending)
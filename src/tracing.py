@@ -0,0 +1,129 @@
+import json
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from pymongo import monitoring
+
+
+logger = logging.getLogger(__name__)
+
+
+class RoundTripBudgetExceeded(AssertionError):
+    pass
+
+
+class RequestStats:
+    """Database round trips made while serving a single request."""
+
+    __slots__ = ('commands', 'documents', 'duration', 'names')
+
+    def __init__(self):
+        self.commands = 0
+        self.documents = 0
+        self.duration = 0.0
+        self.names = {}
+
+    def record(self, name: str, duration: float, documents: int):
+        self.commands += 1
+        self.documents += documents
+        self.duration += duration
+        self.names[name] = self.names.get(name, 0) + 1
+
+
+current_request = ContextVar('current_request', default=None)
+
+# Maximum number of round trips per request, when asserting budgets
+_budget = None
+
+
+def _count_documents(reply: dict):
+    cursor = reply.get('cursor')
+    if isinstance(cursor, dict):
+        return len(cursor.get('firstBatch') or cursor.get('nextBatch') or ())
+
+    return 0
+
+
+class CommandTracker(monitoring.CommandListener):
+    """Attributes every command sent to the database to the request being served, if any."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        stats = current_request.get()
+        if stats is not None:
+            stats.record(event.command_name, event.duration_micros / 1e6, _count_documents(event.reply))
+
+    def failed(self, event):
+        stats = current_request.get()
+        if stats is not None:
+            stats.record(event.command_name, event.duration_micros / 1e6, 0)
+
+
+command_tracker = CommandTracker()
+
+
+def check_budget(stats: RequestStats, limit: int = None):
+    limit = _budget if limit is None else limit
+    if limit is not None and stats.commands > limit:
+        raise RoundTripBudgetExceeded(
+            f'{stats.commands} database round trips over a budget of {limit}: {stats.names}'
+        )
+
+
+@contextmanager
+def round_trip_budget(limit: int):
+    """
+    Assertion mode for tests: fail every request served within the block that makes more than `limit` round trips.
+
+    Operations called directly within the block are checked together when it ends.
+    """
+    global _budget
+    previous, _budget = _budget, limit
+    stats = RequestStats()
+    token = current_request.set(stats)
+    try:
+        yield stats
+
+    finally:
+        current_request.reset(token)
+        _budget = previous
+
+    check_budget(stats, limit)
+
+
+def server_timing(stats: RequestStats, total: float):
+    return ', '.join([
+        f'db;dur={stats.duration * 1000:.1f};desc="{stats.commands} commands, {stats.documents} documents"',
+        f'total;dur={total * 1000:.1f}'
+    ])
+
+
+async def track_round_trips(request, call_next):
+    """Middleware adding the database round trips of each request to its Server-Timing header and to the logs."""
+    stats = RequestStats()
+    token = current_request.set(stats)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+
+    finally:
+        current_request.reset(token)
+
+    total = time.perf_counter() - start
+    response.headers['Server-Timing'] = server_timing(stats, total)
+    logger.info(json.dumps({
+        'method': request.method,
+        'path': request.url.path,
+        'status': response.status_code,
+        'duration_ms': round(total * 1000, 1),
+        'db_commands': stats.commands,
+        'db_documents': stats.documents,
+        'db_duration_ms': round(stats.duration * 1000, 1),
+        'db_command_names': stats.names
+    }))
+    check_budget(stats)
+    return response
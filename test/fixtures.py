@@ -3,11 +3,12 @@ from datetime import datetime
 
 import pytest
 
-from src.models.auth import UserIn
+from src.models.auth import User, UserIn
 from src.models.institutions import Institution, InstitutionType
 from src.models.instruments import Instrument, InstrumentIn, InstrumentType, Security, ValueIn, Value
 from src.models.accounts import AccountIn, AccountType, CashAccount, FinancialAccount
 from src.models.transactions import Transaction, TransactionIn, TransactionStatus
+from src.operations.catalog import catalog_cache as _catalog_cache
 
 
 # Users
@@ -37,6 +38,21 @@ def admin_user_in(admin_user_input):
     return UserIn(**admin_user_input)
 
 
+@pytest.fixture
+def euro_user(normal_user_input):
+    return User(username=normal_user_input['username'], base_currency='EUR')
+
+
+# Catalog
+
+@pytest.fixture(autouse=True)
+def catalog_cache():
+    # Catalog documents cached by other tests would hide the database mocks of each test
+    _catalog_cache.clear()
+    yield _catalog_cache
+    _catalog_cache.clear()
+
+
 # Institutions
 
 @pytest.fixture
@@ -283,3 +299,63 @@ def value(value_input, currency):
     data['instrument'] = currency.dict()
     data['date'] = datetime(2020, 4, 20)
     return Value(**data)
+
+
+@pytest.fixture
+def usd_value():
+    return Value(
+        instrument={
+            'type': InstrumentType.currency,
+            'description': 'US Dollar',
+            'symbol': 'USD',
+            'code': 'USD'
+        },
+        date=datetime(2020, 4, 20),
+        values={
+            'JPY': 110
+        }
+    )
+
+
+@pytest.fixture
+def dollar():
+    return Instrument(type=InstrumentType.currency, description='US Dollar', symbol='USD', code='USD')
+
+
+@pytest.fixture
+def security_purchase(security, dollar, account_broker_input, normal_user_input):
+    entry_data = {'account': account_broker_input, 'status': TransactionStatus.completed}
+    return Transaction(
+        owner=normal_user_input['username'],
+        code=datetime(2020, 4, 20, 10).isoformat(),
+        description='Buy Amazon shares',
+        status=TransactionStatus.completed,
+        total={'instrument': dollar.dict(), 'quantity': 1000},
+        entries=[
+            {**entry_data, 'balance': {'instrument': security.dict(), 'quantity': 10}},
+            {**entry_data, 'balance': {'instrument': dollar.dict(), 'quantity': -1000}}
+        ]
+    )
+
+
+@pytest.fixture
+def security_sale(security, dollar, account_broker_input, normal_user_input):
+    entry_data = {'account': account_broker_input, 'status': TransactionStatus.completed}
+    return Transaction(
+        owner=normal_user_input['username'],
+        code=datetime(2020, 5, 1, 10).isoformat(),
+        description='Sell Amazon shares',
+        status=TransactionStatus.completed,
+        total={'instrument': dollar.dict(), 'quantity': 700},
+        entries=[
+            {**entry_data, 'balance': {'instrument': security.dict(), 'quantity': -7}},
+            {**entry_data, 'balance': {'instrument': dollar.dict(), 'quantity': 700}}
+        ]
+    )
+
+
+# Sync
+
+@pytest.fixture
+def sync_version():
+    return {'version': 7, 'updated_at': datetime(2020, 4, 20, 4, 20)}
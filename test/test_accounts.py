@@ -4,34 +4,41 @@ from unittest.mock import patch
 from fastapi import HTTPException
 from pymongo.errors import DuplicateKeyError
 
+from src.events import Event
 from src.models.accounts import AccountType
 from src.models.institutions import InstitutionType
 from src.operations.accounts import add_account, get_accounts, modify_account, delete_account
 from .fixtures import account_bank, account_bank_in, account_bank_input, account_cash, account_cash_in, \
     account_cash_input, normal_user, normal_user_input, bank_input, account_broker, account_broker_in, \
-    account_broker_input, broker, broker_input
+    account_broker_input, broker, broker_input, sync_version, catalog_cache
 
 
+@patch('src.operations.accounts.next_version')
 @patch('src.operations.accounts.database.institutions')
 @patch('src.operations.accounts.database.accounts')
-def test_add_account_cash_duplicate(mock_collection, mock_institutions, account_cash_in, normal_user):
+def test_add_account_cash_duplicate(mock_collection, mock_institutions, mock_version, account_cash_in, normal_user,
+                                    sync_version):
+    mock_version.return_value = sync_version
     mock_collection.insert_one.side_effect = DuplicateKeyError('account already exists')
 
     with pytest.raises(HTTPException) as excinfo:
         add_account(account_cash_in, normal_user)
 
     assert excinfo.value.status_code == 400
-    assert not mock_institutions.find_one.called
+    assert not mock_institutions.find.called
 
 
+@patch('src.operations.accounts.next_version')
 @patch('src.operations.accounts.database.institutions')
 @patch('src.operations.accounts.database.accounts')
-def test_add_account_cash_success(mock_collection, mock_institutions, account_cash_in, normal_user, account_cash):
+def test_add_account_cash_success(mock_collection, mock_institutions, mock_version, account_cash_in, normal_user,
+                                  account_cash, sync_version):
+    mock_version.return_value = sync_version
     res = add_account(account_cash_in, normal_user)
 
     assert res == account_cash.dict()
-    mock_collection.insert_one.assert_called_once_with(account_cash.dict(exclude_none=True))
-    assert not mock_institutions.find_one.called
+    mock_collection.insert_one.assert_called_once_with({**account_cash.dict(exclude_none=True), **sync_version})
+    assert not mock_institutions.find.called
 
 
 @patch('src.operations.accounts.database.institutions')
@@ -44,63 +51,90 @@ def test_add_account_bank_missing_holder(mock_collection, mock_institutions, acc
 
     # Holder validation failed before DB ops
     assert excinfo.value.status_code == 400
-    assert not mock_institutions.find_one.called
+    assert not mock_institutions.find.called
     assert not mock_collection.insert_one.called
 
 
 @patch('src.operations.accounts.database.institutions')
 @patch('src.operations.accounts.database.accounts')
 def test_add_account_bank_holder_not_found(mock_collection, mock_institutions, account_bank_in, normal_user):
-    mock_institutions.find_one.return_value = None
+    mock_institutions.find.return_value = []
 
     with pytest.raises(HTTPException) as excinfo:
         add_account(account_bank_in, normal_user)
 
     assert excinfo.value.status_code == 400
-    mock_institutions.find_one.assert_called_once_with({'type': InstitutionType.bank, 'code': account_bank_in.holder})
+    mock_institutions.find.assert_called_once_with(
+        {'type': {'$in': [InstitutionType.bank]}, 'code': {'$in': [account_bank_in.holder]}}, {'_id': False}
+    )
     assert not mock_collection.insert_one.called
 
 
+@patch('src.operations.accounts.next_version')
 @patch('src.operations.accounts.database.institutions')
 @patch('src.operations.accounts.database.accounts')
-def test_add_account_bank_success(mock_collection, mock_institutions, account_bank_in, normal_user, account_bank,
-                                  bank_input):
-    mock_institutions.find_one.return_value = bank_input
+def test_add_account_bank_success(mock_collection, mock_institutions, mock_version, account_bank_in, normal_user,
+                                  account_bank, bank_input, sync_version):
+    mock_version.return_value = sync_version
+    mock_institutions.find.return_value = [bank_input]
 
     res = add_account(account_bank_in, normal_user)
 
     assert res == account_bank.dict()
-    mock_collection.insert_one.assert_called_once_with(account_bank.dict(exclude_none=True))
-    mock_institutions.find_one.assert_called_once_with({'type': InstitutionType.bank, 'code': account_bank.holder.code})
+    mock_collection.insert_one.assert_called_once_with(
+        {
+            **account_bank.dict(exclude_none=True),
+            'holder': {'type': InstitutionType.bank, 'code': 'BOI'},
+            **sync_version
+        }
+    )
+    mock_institutions.find.assert_called_once_with(
+        {'type': {'$in': [InstitutionType.bank]}, 'code': {'$in': [account_bank.holder.code]}}, {'_id': False}
+    )
+
+
 
+@patch('src.operations.accounts.next_version')
 @patch('src.operations.accounts.database.institutions')
 @patch('src.operations.accounts.database.accounts')
-def test_add_account_broker_success(mock_collection, mock_institutions, account_broker_in, normal_user,
-                                    account_broker, broker_input):
-    mock_institutions.find_one.return_value = broker_input
+def test_add_account_broker_success(mock_collection, mock_institutions, mock_version, account_broker_in, normal_user,
+                                    account_broker, broker_input, sync_version):
+    mock_version.return_value = sync_version
+    mock_institutions.find.return_value = [broker_input]
 
     res = add_account(account_broker_in, normal_user)
 
     assert res == account_broker.dict()
-    mock_collection.insert_one.assert_called_once_with(account_broker.dict(exclude_none=True))
-    mock_institutions.find_one.assert_called_once_with(
-        {'type': InstitutionType.broker, 'code': account_broker.holder.code}
+    mock_collection.insert_one.assert_called_once_with(
+        {
+            **account_broker.dict(exclude_none=True),
+            'holder': {'type': InstitutionType.broker, 'code': 'MS'},
+            **sync_version
+        }
+    )
+    mock_institutions.find.assert_called_once_with(
+        {'type': {'$in': [InstitutionType.broker]}, 'code': {'$in': [account_broker.holder.code]}}, {'_id': False}
     )
 
 
+@patch('src.operations.accounts.database.institutions')
 @patch('src.operations.accounts.database.accounts')
-def test_get_accounts(mock_collection, normal_user, account_cash, account_bank):
+def test_get_accounts(mock_collection, mock_institutions, normal_user, account_cash, account_bank, bank_input):
     mock_collection.find.return_value.sort.return_value = [
         account_cash.dict(exclude_none=True),
-        account_bank.dict(exclude_none=True)
+        {**account_bank.dict(exclude_none=True), 'holder': {'type': InstitutionType.bank, 'code': 'BOI'}}
     ]
+    mock_institutions.find.return_value = [bank_input]
 
     res = get_accounts(normal_user)
 
     assert len(res) == 2
     assert res[0] == account_cash.dict(exclude_none=True)
     assert res[1] == account_bank.dict(exclude_none=True)
-    mock_collection.find.assert_called_once_with({'owner': normal_user.username})
+    mock_collection.find.assert_called_once_with({'owner': normal_user.username}, None)
+    mock_institutions.find.assert_called_once_with(
+        {'type': {'$in': [InstitutionType.bank]}, 'code': {'$in': ['BOI']}}, {'_id': False}
+    )
 
 
 @patch('src.operations.accounts.database.accounts')
@@ -113,7 +147,7 @@ def test_get_accounts_by_type(mock_collection, normal_user, account_cash):
 
     assert len(res) == 1
     assert res[0] == account_cash.dict(exclude_none=True)
-    mock_collection.find.assert_called_once_with({'owner': normal_user.username, 'type': AccountType.cash})
+    mock_collection.find.assert_called_once_with({'owner': normal_user.username, 'type': AccountType.cash}, None)
 
 
 @patch('src.operations.accounts.database.institutions')
@@ -126,15 +160,17 @@ def test_modify_account_bank_missing_holder(mock_collection, mock_institutions,
 
     # Holder validation failed before DB ops
     assert excinfo.value.status_code == 400
-    assert not mock_institutions.find_one.called
+    assert not mock_institutions.find.called
     assert not mock_collection.insert_one.called
 
 
+@patch('src.operations.accounts.next_version')
 @patch('src.operations.accounts.database.institutions')
 @patch('src.operations.accounts.database.accounts')
-def test_modify_account_bank_success(mock_collection, mock_institutions, account_bank_in, normal_user, account_bank,
-                                     bank_input):
-    mock_institutions.find_one.return_value = bank_input
+def test_modify_account_bank_success(mock_collection, mock_institutions, mock_version, account_bank_in, normal_user,
+                                     account_bank, bank_input, sync_version):
+    mock_version.return_value = sync_version
+    mock_institutions.find.return_value = [bank_input]
     account_bank_in.description = 'My old account with a new name'
     account_bank.description = account_bank_in.description
 
@@ -143,16 +179,24 @@ def test_modify_account_bank_success(mock_collection, mock_institutions, account
     assert res == account_bank.dict()
     mock_collection.replace_one.assert_called_once_with(
         {'owner': normal_user.username, 'code': account_bank.code},
-        account_bank.dict(exclude_none=True)
+        {
+            **account_bank.dict(exclude_none=True),
+            'holder': {'type': InstitutionType.bank, 'code': 'BOI'},
+            **sync_version
+        }
+    )
+    mock_institutions.find.assert_called_once_with(
+        {'type': {'$in': [InstitutionType.bank]}, 'code': {'$in': [account_bank.holder.code]}}, {'_id': False}
     )
-    mock_institutions.find_one.assert_called_once_with({'type': InstitutionType.bank, 'code': account_bank.holder.code})
 
 
+@patch('src.operations.accounts.next_version')
 @patch('src.operations.accounts.database.institutions')
 @patch('src.operations.accounts.database.accounts')
-def test_modify_account_bank_not_found(mock_collection, mock_institutions, account_bank_in, normal_user,
-                                       account_bank, bank_input):
-    mock_institutions.find_one.return_value = bank_input
+def test_modify_account_bank_not_found(mock_collection, mock_institutions, mock_version, account_bank_in, normal_user,
+                                       account_bank, bank_input, sync_version):
+    mock_version.return_value = sync_version
+    mock_institutions.find.return_value = [bank_input]
     mock_collection.replace_one.return_value.modified_count = 0
     account_bank_in.description = 'My old account with a new name'
     account_bank.description = account_bank_in.description
@@ -163,8 +207,17 @@ def test_modify_account_bank_not_found(mock_collection, mock_institutions, accou
     assert excinfo.value.status_code == 404
 
 
+@patch('src.operations.accounts.add_deletion')
+@patch('src.operations.accounts.next_version')
+@patch('src.operations.accounts.publish')
 @patch('src.operations.accounts.database.accounts')
-def test_delete_account_bank_success(mock_collection, normal_user, account_bank):
+def test_delete_account_bank_success(mock_collection, mock_publish, mock_version, mock_add_deletion, normal_user,
+                                     account_bank, sync_version):
+    mock_version.return_value = sync_version
     delete_account(account_bank.code, normal_user)
 
     mock_collection.delete_one.assert_called_once_with({'owner': normal_user.username, 'code': account_bank.code})
+    mock_add_deletion.assert_called_once_with(normal_user.username, 'accounts', account_bank.code, sync_version)
+    mock_publish.assert_called_once_with(
+        Event.account_changed, owner=normal_user.username, code=account_bank.code, account=None
+    )
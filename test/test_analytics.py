@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from src.analytics import time_weighted_return, money_weighted_return, internal_rate_of_return
+
+
+def test_time_weighted_return_no_flows():
+    values = np.array([100, 110, 121])
+
+    assert time_weighted_return(values, np.zeros(3)) == pytest.approx(0.21)
+
+
+def test_time_weighted_return_ignores_flows():
+    values = np.array([100, 210, 231])
+    flows = np.array([0, 100, 0])
+
+    assert time_weighted_return(values, flows) == pytest.approx(1.05 * 1.1 - 1)
+
+
+def test_time_weighted_return_empty_periods():
+    values = np.array([0, 0, 100, 120])
+    flows = np.array([0, 0, 100, 0])
+
+    assert time_weighted_return(values, flows) == pytest.approx(0.2)
+
+
+def test_internal_rate_of_return_yearly():
+    times = np.array([0, 1, 2])
+    amounts = np.array([-100, 10, 110])
+
+    assert internal_rate_of_return(times, amounts) == pytest.approx(0.1)
+
+
+def test_internal_rate_of_return_no_solution():
+    assert internal_rate_of_return(np.array([0, 1]), np.array([-100, -10])) is None
+
+
+def test_internal_rate_of_return_bisection_fallback():
+    times = np.array([0, 1])
+    amounts = np.array([-100, 1000])
+
+    # A guess far from the root makes Newton's method overshoot below -100%
+    assert internal_rate_of_return(times, amounts, guess=50) == pytest.approx(9)
+
+
+def test_internal_rate_of_return_large_cash_flows():
+    rng = np.random.default_rng(42)
+    times = np.sort(rng.random(100000)) * 10
+    amounts = -rng.random(100000) * 100
+    amounts[-1] = -amounts.sum() * 2
+
+    rate = internal_rate_of_return(times, amounts)
+
+    assert np.dot(amounts, (1 + rate) ** -times) == pytest.approx(0, abs=1e-4)
+
+
+def test_money_weighted_return():
+    values = np.zeros(366)
+    values[0] = 100
+    values[-1] = 120
+    flows = np.zeros(366)
+
+    assert money_weighted_return(values, flows) == pytest.approx(0.2)
@@ -7,6 +7,7 @@ from jwt import PyJWTError
 from pymongo.errors import DuplicateKeyError
 
 from src.exceptions import AuthenticationError, AuthorizationError
+from src.models.instruments import InstrumentType
 from src.operations.auth import add_user, authenticate, resolve_user, validate_admin_user, get_current_user
 from .fixtures import normal_user, normal_user_input, admin_user_input, admin_user_in
 
@@ -35,6 +36,20 @@ def test_add_user_success(mock_pw_ctx, mock_collection, normal_user):
     assert user == normal_user
 
 
+@patch('src.operations.auth.database.instruments')
+@patch('src.operations.auth.database.users')
+def test_add_user_base_currency_not_found(mock_collection, mock_instruments, normal_user):
+    normal_user.base_currency = 'XYZ'
+    mock_instruments.find_one.return_value = None
+
+    with pytest.raises(HTTPException) as excinfo:
+        add_user(normal_user)
+
+    assert excinfo.value.status_code == 400
+    mock_instruments.find_one.assert_called_once_with({'code': 'XYZ', 'type': InstrumentType.currency})
+    assert not mock_collection.insert_one.called
+
+
 @patch('src.operations.auth.database.users')
 def test_authenticate_user_not_found(mock_collection):
     form_data = Mock(username='pete', password='123')
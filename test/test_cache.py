@@ -0,0 +1,121 @@
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from src.cache import Cache, SingleFlight, single_flight, flights, set_fallback_ttl, clear_caches
+from src.models.instruments import InstrumentType
+
+
+def _concurrently(function, count: int = 8):
+    results = [None] * count
+    threads = [threading.Thread(target=lambda n=n: results.__setitem__(n, function())) for n in range(count)]
+    for thread in threads:
+        thread.start()
+
+    return threads, results
+
+
+def test_single_flight_shares_result():
+    release = threading.Event()
+    calls = []
+
+    def read():
+        calls.append(True)
+        release.wait()
+        return ['result']
+
+    group = SingleFlight()
+    threads, results = _concurrently(lambda: group.do('key', read))
+    while not calls:
+        pass
+
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert all(r is results[0] for r in results)
+    assert len(group) == 0
+
+
+def test_single_flight_shares_error():
+    release = threading.Event()
+    errors = []
+
+    def read():
+        release.wait()
+        raise ValueError('failed')
+
+    group = SingleFlight()
+
+    def call():
+        try:
+            group.do('key', read)
+
+        except ValueError as e:
+            errors.append(e)
+
+    threads, _ = _concurrently(call, 4)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(errors) == 4
+
+
+def test_single_flight_not_kept():
+    group = SingleFlight()
+    read = MagicMock(side_effect=[1, 2])
+
+    assert group.do('key', read) == 1
+    assert group.do('key', read) == 2
+
+
+def test_single_flight_decorator_key():
+    @single_flight(ignore=('_',), code=str.upper)
+    def read(code: str, _=None, t: InstrumentType = None):
+        return code
+
+    with patch.object(flights, 'do', wraps=flights.do) as do_mock:
+        assert read('eur', 'user') == 'eur'
+        read('EUR', 'other user')
+        read('EUR', t=InstrumentType.currency)
+
+    keys = [c[0][0] for c in do_mock.call_args_list]
+    assert keys[0] == keys[1]
+    assert keys[2][-1] == ('t', 'currency')
+
+
+def test_single_flight_decorator_invalid_arguments():
+    @single_flight()
+    def read(code: str):
+        return code
+
+    with pytest.raises(TypeError):
+        read()
+
+
+def test_fallback_ttl_expires_entries():
+    cache = Cache()
+    cache.set('key', 'value')
+    with patch('src.cache.time.monotonic', return_value=time.monotonic() + 60):
+        assert cache.get('key') == 'value'
+
+        set_fallback_ttl(30)
+        try:
+            assert cache.get('key') is None
+
+        finally:
+            set_fallback_ttl(None)
+
+
+def test_clear_caches():
+    caches = [Cache(), Cache()]
+    for cache in caches:
+        cache.set('key', 'value')
+
+    clear_caches()
+
+    assert all(cache.get('key') is None for cache in caches)
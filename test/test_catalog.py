@@ -0,0 +1,79 @@
+from unittest.mock import patch
+
+from src.events import Event, publish
+from src.operations.catalog import get_catalog_documents, get_currency_codes, resolve_references
+from .fixtures import catalog_cache
+
+
+@patch('src.operations.catalog.database.institutions')
+def test_get_catalog_documents_cached(institutions):
+    institution = {'type': 'bank', 'name': 'Bank of Ireland', 'code': 'BOI'}
+    institutions.find.return_value = [institution]
+
+    assert get_catalog_documents('institutions', [('bank', 'BOI'), ('bank', 'NOPE')]) == {('bank', 'BOI'): institution}
+    assert get_catalog_documents('institutions', [('bank', 'BOI'), ('bank', 'NOPE')]) == {('bank', 'BOI'): institution}
+
+    institutions.find.assert_called_once_with(
+        {'type': {'$in': ['bank']}, 'code': {'$in': ['BOI', 'NOPE']}},
+        {'_id': False}
+    )
+
+
+@patch('src.operations.catalog.database.institutions')
+@patch('src.operations.catalog.database.instruments')
+def test_resolve_references(instruments, institutions):
+    exchange = {'type': 'exchange', 'name': 'Nasdaq', 'code': 'NDQ'}
+    instruments.find.return_value = [
+        {'type': 'security', 'code': 'NDQ:AMZN', 'exchange': {'type': 'exchange', 'code': 'NDQ'}}
+    ]
+    institutions.find.return_value = [exchange]
+    accounts = [
+        {'code': 'MSIP', 'assets': [{'instrument': {'code': 'NDQ:AMZN'}, 'quantity': 2}]},
+        {'code': 'OLD', 'assets': [{'instrument': {'code': 'DELETED'}, 'quantity': 1}]}
+    ]
+
+    resolved = resolve_references('accounts', accounts)
+
+    assert resolved[0]['assets'][0]['instrument'] == {'type': 'security', 'code': 'NDQ:AMZN', 'exchange': exchange}
+    assert resolved[1]['assets'][0]['instrument'] == {'code': 'DELETED'}
+    instruments.find.assert_called_once_with({'code': {'$in': ['DELETED', 'NDQ:AMZN']}}, {'_id': False})
+
+
+@patch('src.operations.catalog.database.instruments')
+def test_catalog_invalidated_by_instrument_changed(instruments):
+    instruments.find.return_value = [{'type': 'currency', 'code': 'EUR'}]
+    instruments.distinct.return_value = ['EUR']
+    get_catalog_documents('instruments', [('EUR',)])
+    get_currency_codes()
+
+    publish(Event.instrument_changed, code='EUR')
+    get_catalog_documents('instruments', [('EUR',)])
+    get_currency_codes()
+
+    assert instruments.find.call_count == 2
+    assert instruments.distinct.call_count == 2
+
+
+@patch('src.operations.catalog.database.instruments')
+def test_catalog_invalidated_by_institution_changed(instruments):
+    instruments.find.return_value = []
+    get_catalog_documents('instruments', [('NDQ:AMZN',)])
+
+    publish(Event.institution_changed, code='NDQ')
+    get_catalog_documents('instruments', [('NDQ:AMZN',)])
+
+    assert instruments.find.call_count == 2
+
+
+@patch('src.operations.catalog.database.instruments')
+def test_catalog_invalidated_by_instrument_renamed(instruments):
+    instruments.find.return_value = [{'type': 'currency', 'code': 'EUR'}]
+    get_catalog_documents('instruments', [('EUR',)])
+
+    # Renamed by another worker, which only publishes the new document
+    publish(Event.data_changed, collection='instruments', operation='update', key={'_id': 1},
+            document={'type': 'currency', 'code': 'EURO'})
+    instruments.find.return_value = []
+
+    assert get_catalog_documents('instruments', [('EUR',)]) == {}
+    assert instruments.find.call_count == 2
@@ -0,0 +1,170 @@
+import os
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+from pymongo.errors import OperationFailure, ServerSelectionTimeoutError
+
+from src.cache import Cache, set_fallback_ttl
+from src.changes import ChangeListener, CHANGE_STREAM_HISTORY_LOST, CHANGE_STREAM_UNSUPPORTED
+from src.events import Event
+
+
+class _Stream:
+    """Change stream returning the given changes, then stopping the listener."""
+
+    def __init__(self, listener, changes, resume_after=None):
+        self.listener = listener
+        self.changes = list(changes)
+        self.resume_token = resume_after
+        self.alive = True
+
+    def try_next(self):
+        if not self.changes:
+            self.listener._stopping.set()
+            return None
+
+        change = self.changes.pop(0)
+        self.resume_token = change['_id']
+        return change
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        pass
+
+
+def _listener(**kwargs):
+    listener = ChangeListener('test', ('values', 'accounts'), fallback_ttl=30, retry_delay=0, **kwargs)
+    listener.database = MagicMock()
+    listener.database.meta.find_one.return_value = None
+    return listener
+
+
+@pytest.fixture(autouse=True)
+def reset_fallback_ttl():
+    yield
+    set_fallback_ttl(None)
+
+
+@patch('src.changes.publish')
+def test_changes_published(publish):
+    listener = _listener()
+    change = {
+        '_id': {'_data': '1'},
+        'operationType': 'update',
+        'ns': {'db': 'portfolio', 'coll': 'accounts'},
+        'documentKey': {'_id': 1},
+        'fullDocument': {'_id': 1, 'owner': 'user'}
+    }
+    listener.database.watch.side_effect = lambda *args, **kwargs: _Stream(listener, [change])
+    listener._run()
+
+    publish.assert_called_once_with(
+        Event.data_changed,
+        collection='accounts',
+        operation='update',
+        key={'_id': 1},
+        document={'_id': 1, 'owner': 'user'}
+    )
+    listener.database.meta.update_one.assert_called_once_with(
+        {'_id': 'change_stream:test'},
+        {'$set': {'token': {'_data': '1'}}},
+        upsert=True
+    )
+
+
+def test_resumes_after_saved_token():
+    listener = _listener()
+    listener.database.meta.find_one.return_value = {'_id': 'change_stream:test', 'token': {'_data': '1'}}
+    listener.database.watch.side_effect = lambda pipeline, resume_after, **_: _Stream(listener, [], resume_after)
+    listener._run()
+
+    assert listener.database.watch.call_args.kwargs['resume_after'] == {'_data': '1'}
+    listener.database.meta.update_one.assert_not_called()
+
+
+def test_fallback_ttl_while_dropped():
+    listener = _listener()
+    ttls = []
+
+    def watch(*args, **kwargs):
+        ttls.append(Cache.fallback_ttl)
+        if len(ttls) == 1:
+            raise ServerSelectionTimeoutError('down')
+
+        return _Stream(listener, [], kwargs['resume_after'])
+
+    listener.database.watch.side_effect = watch
+    listener._run()
+
+    assert ttls[1:] == [30]
+    assert Cache.fallback_ttl is None
+
+
+def test_caches_cleared_when_history_lost():
+    listener = _listener()
+    listener._token = {'_data': '1'}
+    cache = Cache()
+    cache.set('key', 'value')
+    errors = [OperationFailure('history lost', code=CHANGE_STREAM_HISTORY_LOST)]
+
+    def watch(*args, **kwargs):
+        if errors:
+            raise errors.pop()
+
+        return _Stream(listener, [], kwargs['resume_after'])
+
+    listener.database.watch.side_effect = watch
+    listener._run()
+
+    assert cache.get('key') is None
+    assert listener.database.watch.call_args.kwargs['resume_after'] is None
+
+
+def test_standalone_server_tried_once(caplog):
+    listener = _listener()
+    listener.database.watch.side_effect = OperationFailure('not supported', code=CHANGE_STREAM_UNSUPPORTED)
+
+    # Returns instead of retrying forever
+    listener._run()
+
+    listener.database.watch.assert_called_once()
+    assert Cache.fallback_ttl == 30
+    assert caplog.text.count('not supported by the server') == 1
+
+
+def test_changes_invalidate_valuations():
+    from src.operations.portfolio import data_versions
+    from src.events import publish
+
+    version = data_versions.get(('balances', 'user'))
+    publish(Event.data_changed, collection='transactions', operation='insert', key={'_id': 1},
+            document={'_id': 1, 'owner': 'user'})
+
+    assert data_versions.get(('balances', 'user')) == version + 1
+
+
+@pytest.mark.skipif('MONGO_REPLICA_SET_URI' not in os.environ, reason='needs a MongoDB replica set')
+def test_changes_by_other_clients_seen():
+    from pymongo import MongoClient
+
+    database = MongoClient(os.environ['MONGO_REPLICA_SET_URI']).portfolio_changes_test
+    writer = MongoClient(os.environ['MONGO_REPLICA_SET_URI']).portfolio_changes_test
+    seen = threading.Event()
+    listener = ChangeListener('test', ('accounts',), fallback_ttl=30)
+    with patch('src.changes.publish', side_effect=lambda event, **data: seen.set()) as publish:
+        listener.start(database)
+        try:
+            for _ in range(50):
+                writer.accounts.insert_one({'owner': 'user', 'code': 'CURRENT'})
+                if seen.wait(0.2):
+                    break
+
+            assert publish.call_args.kwargs['collection'] == 'accounts'
+            assert Cache.fallback_ttl is None
+
+        finally:
+            listener.stop()
+            database.client.drop_database(database.name)
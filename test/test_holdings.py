@@ -0,0 +1,193 @@
+from unittest.mock import patch
+
+import pytest
+from pymongo import UpdateOne
+
+from src.exceptions import ValidationError
+from src.operations.holdings import get_holdings, _update_lots
+from src.operations.rates import RateMatrix
+from .fixtures import account_broker_input, atm_extraction, atm_extraction_input, account_bank_input, \
+    account_cash_input, currency, currency_input, dollar, exchange_input, normal_user, normal_user_input, security, \
+    security_input, security_purchase, security_sale
+
+
+@pytest.fixture
+def holding_filter(normal_user, account_broker_input, security):
+    return {'owner': normal_user.username, 'account': account_broker_input['code'], 'instrument': security.code}
+
+
+@pytest.fixture
+def lots():
+    return [
+        {'_id': 1, 'quantity': 5, 'remaining': 5, 'cost': 400},
+        {'_id': 2, 'quantity': 10, 'remaining': 10, 'cost': 1000},
+    ]
+
+
+@patch('src.operations.holdings.database')
+def test_update_lots_currency_entries(mock_database, atm_extraction, normal_user):
+    _update_lots(normal_user.username, atm_extraction, atm_extraction.entries, reverted=False)
+
+    assert not mock_database.mock_calls
+
+
+@pytest.mark.parametrize('total_sign', [1, -1])
+@patch('src.operations.holdings.database')
+def test_update_lots_acquisition(mock_database, security_purchase, normal_user, holding_filter, total_sign):
+    mock_database.holdings.find_one.return_value = None
+    security_purchase.total.quantity *= total_sign
+
+    _update_lots(normal_user.username, security_purchase, security_purchase.entries, reverted=False)
+
+    mock_database.lots.insert_one.assert_called_once_with({
+        **holding_filter,
+        'transaction': security_purchase.code,
+        'entry': 0,
+        'quantity': 10,
+        'remaining': 10,
+        'cost': 1000
+    })
+    mock_database.holdings.update_one.assert_called_once_with(
+        holding_filter,
+        {'$inc': {'quantity': 10, 'cost': 1000}, '$setOnInsert': {'currency': 'USD', 'realized': 0}},
+        upsert=True
+    )
+
+
+@patch('src.operations.holdings.get_rate_matrix')
+@patch('src.operations.holdings.database')
+def test_update_lots_acquisition_converted(mock_database, mock_rates, security_purchase, normal_user,
+                                           holding_filter):
+    mock_database.holdings.find_one.return_value = {**holding_filter, 'currency': 'EUR', 'quantity': 1, 'cost': 1}
+    mock_rates.return_value.rate.return_value = 0.8
+
+    _update_lots(normal_user.username, security_purchase, security_purchase.entries, reverted=False)
+
+    mock_rates.return_value.rate.assert_called_once_with('USD', 'EUR')
+    assert mock_database.lots.insert_one.call_args[0][0]['cost'] == 800
+
+
+@patch('src.operations.holdings.get_rate_matrix')
+@patch('src.operations.holdings.database')
+def test_update_lots_acquisition_no_rates(mock_database, mock_rates, security_purchase, normal_user, holding_filter):
+    mock_database.holdings.find_one.return_value = {**holding_filter, 'currency': 'EUR', 'quantity': 1, 'cost': 1}
+    mock_rates.return_value = RateMatrix([])
+
+    with pytest.raises(ValidationError):
+        _update_lots(normal_user.username, security_purchase, security_purchase.entries, reverted=False)
+
+    assert not mock_database.lots.insert_one.called
+    assert not mock_database.holdings.update_one.called
+
+
+@pytest.mark.parametrize('total_sign', [1, -1])
+@patch('src.operations.holdings.database')
+def test_update_lots_disposal_fifo(mock_database, security_sale, normal_user, holding_filter, lots, total_sign):
+    mock_database.holdings.find_one.return_value = {**holding_filter, 'currency': 'USD', 'quantity': 15, 'cost': 1400}
+    security_sale.total.quantity *= total_sign
+    mock_database.lots.find.return_value.sort.return_value = lots
+
+    _update_lots(normal_user.username, security_sale, security_sale.entries, reverted=False)
+
+    mock_database.lots.find.assert_called_once_with({**holding_filter, 'remaining': {'$gt': 0}})
+    mock_database.lots.bulk_write.assert_called_once_with([
+        UpdateOne({'_id': 1}, {'$inc': {'remaining': -5}}),
+        UpdateOne({'_id': 2}, {'$inc': {'remaining': -2}}),
+    ])
+    mock_database.disposals.insert_one.assert_called_once_with({
+        'owner': normal_user.username,
+        'transaction': security_sale.code,
+        'entry': 0,
+        'consumed': [{'lot': 1, 'quantity': 5}, {'lot': 2, 'quantity': 2}],
+        'quantity': 7,
+        'cost': 600,
+        'proceeds': 700
+    })
+    mock_database.holdings.update_one.assert_called_once_with(
+        holding_filter,
+        {'$inc': {'quantity': -7, 'cost': -600, 'realized': 100}, '$setOnInsert': {'currency': 'USD'}},
+        upsert=True
+    )
+
+
+@patch('src.operations.holdings.COST_BASIS_METHOD', 'average')
+@patch('src.operations.holdings.database')
+def test_update_lots_disposal_average(mock_database, security_sale, normal_user, holding_filter, lots):
+    mock_database.holdings.find_one.return_value = {**holding_filter, 'currency': 'USD', 'quantity': 15, 'cost': 1500}
+    mock_database.lots.find.return_value.sort.return_value = lots
+
+    _update_lots(normal_user.username, security_sale, security_sale.entries, reverted=False)
+
+    assert mock_database.disposals.insert_one.call_args[0][0]['cost'] == 700
+    mock_database.holdings.update_one.assert_called_once_with(
+        holding_filter,
+        {'$inc': {'quantity': -7, 'cost': -700, 'realized': 0}, '$setOnInsert': {'currency': 'USD'}},
+        upsert=True
+    )
+
+
+@patch('src.operations.holdings.database')
+def test_update_lots_revert_acquisition(mock_database, security_purchase, normal_user, holding_filter):
+    mock_database.lots.find.return_value = [{'quantity': 10, 'remaining': 10}]
+    mock_database.lots.find_one_and_delete.return_value = {'quantity': 10, 'cost': 1000}
+
+    _update_lots(normal_user.username, security_purchase, security_purchase.entries, reverted=True)
+
+    mock_database.lots.find.assert_called_once_with(
+        {'owner': normal_user.username, 'transaction': security_purchase.code, 'entry': {'$in': [0]}},
+        {'quantity': True, 'remaining': True}
+    )
+    mock_database.lots.find_one_and_delete.assert_called_once_with(
+        {'owner': normal_user.username, 'transaction': security_purchase.code, 'entry': 0}
+    )
+    mock_database.holdings.update_one.assert_called_once_with(
+        holding_filter, {'$inc': {'quantity': -10, 'cost': -1000}}
+    )
+
+
+@patch('src.operations.holdings.database')
+def test_update_lots_revert_consumed_acquisition(mock_database, security_purchase, normal_user):
+    mock_database.lots.find.return_value = [{'quantity': 10, 'remaining': 3}]
+
+    with pytest.raises(ValidationError):
+        _update_lots(normal_user.username, security_purchase, security_purchase.entries, reverted=True)
+
+    # The lot stays for the disposals that consumed it
+    assert not mock_database.lots.find_one_and_delete.called
+    assert not mock_database.holdings.update_one.called
+
+
+@patch('src.operations.holdings.database')
+def test_update_lots_revert_disposal(mock_database, security_sale, normal_user, holding_filter):
+    mock_database.disposals.find_one_and_delete.return_value = {
+        'consumed': [{'lot': 1, 'quantity': 5}, {'lot': 2, 'quantity': 2}],
+        'quantity': 7,
+        'cost': 600,
+        'proceeds': 700
+    }
+
+    _update_lots(normal_user.username, security_sale, security_sale.entries, reverted=True)
+
+    mock_database.lots.bulk_write.assert_called_once_with([
+        UpdateOne({'_id': 1}, {'$inc': {'remaining': 5}}),
+        UpdateOne({'_id': 2}, {'$inc': {'remaining': 2}}),
+    ])
+    mock_database.holdings.update_one.assert_called_once_with(
+        holding_filter, {'$inc': {'quantity': 7, 'cost': 600, 'realized': -100}}
+    )
+
+
+@patch('src.operations.holdings._get_latest_prices')
+@patch('src.operations.holdings.database.holdings')
+def test_get_holdings(mock_collection, mock_prices, normal_user, holding_filter):
+    mock_collection.find.return_value.sort.return_value = [
+        {**holding_filter, 'currency': 'USD', 'quantity': 8, 'cost': 800, 'realized': 100},
+        {**holding_filter, 'instrument': 'NDQ:MSFT', 'currency': 'USD', 'quantity': 1, 'cost': 100, 'realized': 0},
+    ]
+    mock_prices.return_value = {'NDQ:AMZN': 110, 'NDQ:MSFT': None}
+
+    res = get_holdings(normal_user)
+
+    mock_collection.find.assert_called_once_with({'owner': normal_user.username})
+    assert (res[0]['price'], res[0]['value'], res[0]['unrealized']) == (110, 880, 80)
+    assert 'unrealized' not in res[1]
@@ -3,6 +3,7 @@ from fastapi import HTTPException
 from pymongo.errors import DuplicateKeyError
 from unittest.mock import patch
 
+from src.events import Event
 from src.models.institutions import InstitutionType
 from src.operations.institutions import add_institution, get_institutions, modify_institution, delete_institution
 from .fixtures import bank, bank_input, broker, broker_input, normal_user, normal_user_input
@@ -37,7 +38,7 @@ def test_get_institutions(collection_mock, bank, broker):
     assert len(res) == 2
     assert res[0] == bank
     assert res[1] == broker
-    collection_mock.find.assert_called_once_with({})
+    collection_mock.find.assert_called_once_with({}, None)
 
 
 @patch('src.operations.institutions.database.institutions')
@@ -50,16 +51,19 @@ def test_get_institutions_by_type(collection_mock, bank, normal_user):
 
     assert len(res) == 1
     assert res[0] == bank
-    collection_mock.find.assert_called_once_with({'type': InstitutionType.bank})
+    collection_mock.find.assert_called_once_with({'type': InstitutionType.bank}, None)
 
 
+@patch('src.operations.institutions.publish')
 @patch('src.operations.institutions.database.institutions')
-def test_modify_institution(collection_mock, bank):
+def test_modify_institution(collection_mock, mock_publish, bank):
     bank.name = 'Boys Over Internet'
     res = modify_institution(bank.code, bank)
 
     assert res == bank
     collection_mock.replace_one.assert_called_once_with({'code': bank.code}, bank.dict(exclude_none=True))
+    # Documents referencing the institution resolve it again
+    mock_publish.assert_called_once_with(Event.institution_changed, code=bank.code)
 
 
 @patch('src.operations.institutions.database.institutions')
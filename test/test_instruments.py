@@ -7,10 +7,11 @@ from unittest.mock import patch
 
 from src.models.institutions import InstitutionType
 from src.models.instruments import InstrumentType
+from src.events import Event, publish
 from src.operations.instruments import add_instrument, get_instruments, modify_instrument, delete_instrument, \
-    set_value, get_value
+    set_value, get_value, search_instruments, instrument_index
 from .fixtures import bank, bank_input, currency, currency_in, currency_input, exchange, exchange_input, security, \
-    security_in, security_input, normal_user, normal_user_input, value, value_in, value_input
+    security_in, security_input, normal_user, normal_user_input, value, value_in, value_input, catalog_cache
 
 
 @patch('src.operations.instruments.database.institutions')
@@ -21,7 +22,7 @@ def test_add_currency_failure(collection_mock, institutions_mock, currency_in):
         add_instrument(currency_in)
 
     assert excinfo.value.status_code == 400
-    assert not institutions_mock.find_one.called
+    assert not institutions_mock.find.called
 
 
 @patch('src.operations.instruments.database.institutions')
@@ -29,7 +30,7 @@ def test_add_currency_failure(collection_mock, institutions_mock, currency_in):
 def test_add_currency_success(collection_mock, institutions_mock, currency_in, currency):
     res = add_instrument(currency_in)
 
-    assert not institutions_mock.find_one.called
+    assert not institutions_mock.find.called
     collection_mock.insert_one.assert_called_once_with(currency.dict(exclude_unset=True))
     assert res == currency.dict(exclude_none=True)
 
@@ -44,47 +45,58 @@ def test_add_security_exchange_missing(collection_mock, institutions_mock, secur
 
     assert excinfo.value.status_code == 400
     assert not collection_mock.insert_one.called
-    assert not institutions_mock.find_one.called
+    assert not institutions_mock.find.called
 
 
 @patch('src.operations.instruments.database.institutions')
 @patch('src.operations.instruments.database.instruments')
 def test_add_security_exchange_not_found(collection_mock, institutions_mock, security_in):
-    institutions_mock.find_one.return_value = None
+    institutions_mock.find.return_value = []
 
     with pytest.raises(HTTPException) as excinfo:
         add_instrument(security_in)
 
     assert excinfo.value.status_code == 400
-    institutions_mock.find_one.assert_called_once_with({'code': security_in.exchange, 'type': InstitutionType.exchange})
+    institutions_mock.find.assert_called_once_with(
+        {'type': {'$in': [InstitutionType.exchange]}, 'code': {'$in': [security_in.exchange]}}, {'_id': False}
+    )
     assert not collection_mock.insert_one.called
 
 
 @patch('src.operations.instruments.database.institutions')
 @patch('src.operations.instruments.database.instruments')
 def test_add_security_success(collection_mock, institutions_mock, exchange, security, security_in):
-    institutions_mock.find_one.return_value = exchange.dict(exclude_none=True)
+    institutions_mock.find.return_value = [exchange.dict(exclude_none=True)]
 
     res = add_instrument(security_in)
 
     assert res == security.dict(exclude_none=True)
-    institutions_mock.find_one.assert_called_once_with({'code': exchange.code, 'type': exchange.type})
-    collection_mock.insert_one.assert_called_once_with(security.dict(exclude_none=True))
+    institutions_mock.find.assert_called_once_with(
+        {'type': {'$in': [InstitutionType.exchange]}, 'code': {'$in': [exchange.code]}}, {'_id': False}
+    )
+    collection_mock.insert_one.assert_called_once_with(
+        {**security.dict(exclude_none=True), 'exchange': {'type': exchange.type, 'code': exchange.code}}
+    )
 
 
+@patch('src.operations.instruments.database.institutions')
 @patch('src.operations.instruments.database.instruments')
-def test_get_instruments(collection_mock, currency, security):
+def test_get_instruments(collection_mock, institutions_mock, currency, security, exchange_input):
     collection_mock.find.return_value.sort.return_value = [
         currency.dict(exclude_none=True),
-        security.dict(exclude_none=True),
+        {**security.dict(exclude_none=True), 'exchange': {'type': InstitutionType.exchange, 'code': 'NDQ'}},
     ]
+    institutions_mock.find.return_value = [exchange_input]
 
     res = get_instruments()
 
     assert len(res) == 2
     assert res[0] == currency.dict(exclude_none=True)
     assert res[1] == security.dict(exclude_none=True)
-    collection_mock.find.assert_called_once_with({})
+    collection_mock.find.assert_called_once_with({}, None)
+    institutions_mock.find.assert_called_once_with(
+        {'type': {'$in': [InstitutionType.exchange]}, 'code': {'$in': ['NDQ']}}, {'_id': False}
+    )
 
 
 @patch('src.operations.instruments.database.instruments')
@@ -97,7 +109,7 @@ def test_get_instruments_by_type(collection_mock, currency, security, normal_use
 
     assert len(res) == 1
     assert res[0] == currency.dict(exclude_none=True)
-    collection_mock.find.assert_called_once_with({'type': InstrumentType.currency})
+    collection_mock.find.assert_called_once_with({'type': InstrumentType.currency}, None)
 
 
 @patch('src.operations.instruments.database.institutions')
@@ -108,7 +120,7 @@ def test_modify_currency_success(collection_mock, institutions_mock, currency_in
     res = modify_instrument(currency_in.symbol, currency_in)
 
     assert res == currency
-    assert not institutions_mock.find_one.called
+    assert not institutions_mock.find.called
     collection_mock.replace_one.assert_called_once_with(
         {'code': currency.symbol},
         currency.dict(exclude_none=True)
@@ -138,24 +150,24 @@ def test_modify_security_failure(collection_mock, institutions_mock, security_in
     # No DB ops done due to validation error
     assert excinfo.value.status_code == 400
     assert not collection_mock.insert_one.called
-    assert not institutions_mock.find_one.called
+    assert not institutions_mock.find.called
 
 
 @patch('src.operations.instruments.database.institutions')
 @patch('src.operations.instruments.database.instruments')
 def test_modify_security_success(collection_mock, institutions_mock, security_in, security):
-    institutions_mock.find_one.return_value = security.exchange.dict(exclude_none=True)
+    institutions_mock.find.return_value = [security.exchange.dict(exclude_none=True)]
     security_in.description = 'Amazon Inc'
     security.description = security_in.description
     res = modify_instrument(f'{security_in.exchange}:{security_in.symbol}', security_in)
 
     assert res == security
-    institutions_mock.find_one.assert_called_once_with(
-        {'code': security.exchange.code, 'type': security.exchange.type}
+    institutions_mock.find.assert_called_once_with(
+        {'type': {'$in': [InstitutionType.exchange]}, 'code': {'$in': [security.exchange.code]}}, {'_id': False}
     )
     collection_mock.replace_one.assert_called_once_with(
         {'code': security.code},
-        security.dict(exclude_none=True)
+        {**security.dict(exclude_none=True), 'exchange': {'type': InstitutionType.exchange, 'code': 'NDQ'}}
     )
 
 
@@ -185,36 +197,36 @@ def test_set_value_invalid_date(collection_mock, instruments_mock, currency, val
 
     assert excinfo.value.status_code == 400
     assert not collection_mock.update_one.called
-    assert not instruments_mock.find_one.called
+    assert not instruments_mock.find.called
 
 
 @patch('src.operations.instruments.database.instruments')
 @patch('src.operations.instruments.database.values')
 def test_set_value_instrument_not_found(collection_mock, instruments_mock, currency, value_in, value):
-    instruments_mock.find_one.return_value = None
+    instruments_mock.find.return_value = []
 
     with pytest.raises(HTTPException) as excinfo:
         set_value(currency.code, value.date.isoformat()[:10], value_in)
 
     assert excinfo.value.status_code == 404
-    instruments_mock.find_one.assert_called_once_with({'code': currency.code})
+    instruments_mock.find.assert_called_once_with({'code': {'$in': [currency.code]}}, {'_id': False})
     assert not collection_mock.update_one.called
 
 
 @patch('src.operations.instruments.database.instruments')
 @patch('src.operations.instruments.database.values')
 def test_set_value_success(collection_mock, instruments_mock, currency, value_in, value):
-    instruments_mock.find_one.return_value = currency.dict()
+    instruments_mock.find.return_value = [currency.dict()]
 
     res = set_value(currency.code, value.date.isoformat()[:10], value_in)
 
     assert res == value.dict()
-    instruments_mock.find_one.assert_called_once_with({'code': currency.code})
+    instruments_mock.find.assert_called_once_with({'code': {'$in': [currency.code]}}, {'_id': False})
     collection_mock.update_one.assert_called_once_with(
         {'instrument.code': currency.code, 'date': value.date},
         {'$set':
             {
-                'instrument': value.instrument.dict(),
+                'instrument': {'code': currency.code},
                 'date': value.date,
                 **{f'values.{k}': v for k, v in value.values.items()}
             }
@@ -243,11 +255,72 @@ def test_get_value_not_found(collection_mock, currency):
     collection_mock.find_one.assert_called_once_with({'instrument.code': currency.code, 'date': datetime(2000, 1, 20)})
 
 
+@patch('src.operations.instruments.database.instruments')
 @patch('src.operations.instruments.database.values')
-def test_get_value_success(collection_mock, value):
-    collection_mock.find_one.return_value = value.dict()
+def test_get_value_success(collection_mock, instruments_mock, value):
+    collection_mock.find_one.return_value = {**value.dict(), 'instrument': {'code': value.instrument.code}}
+    instruments_mock.find.return_value = [value.instrument.dict()]
 
     res = get_value(value.instrument.code, value.date.isoformat()[:10])
 
     assert res == value
     collection_mock.find_one.assert_called_once_with({'instrument.code': value.instrument.code, 'date': value.date})
+
+
+@patch('src.operations.instruments.database.institutions')
+@patch('src.operations.instruments.database.instruments')
+def test_search_instruments(collection_mock, institutions_mock, currency, security, normal_user):
+    collection_mock.find.return_value = [
+        currency.dict(),
+        {**security.dict(), 'exchange': {'type': InstitutionType.exchange, 'code': 'NDQ'}}
+    ]
+    institutions_mock.find.return_value = [security.exchange.dict()]
+    instrument_index.mark_stale()
+
+    res = search_instruments(security.symbol[:2].lower(), 10, normal_user)
+
+    assert res == [security.dict()]
+    collection_mock.find.assert_called_once_with({}, {'_id': False})
+
+
+@patch('src.operations.instruments.database.instruments')
+def test_search_instruments_updated(collection_mock, currency, security, normal_user):
+    collection_mock.find.return_value = [currency.dict()]
+    instrument_index.mark_stale()
+    search_instruments(currency.symbol, 10, normal_user)
+
+    publish(Event.instrument_changed, code=security.code, instrument={**security.dict(), '_id': 'id'})
+    publish(Event.instrument_changed, code=currency.code, instrument=None)
+
+    assert search_instruments(security.symbol, 10, normal_user) == [security.dict()]
+    assert search_instruments(currency.symbol, 10, normal_user) == []
+    collection_mock.find.assert_called_once()
+
+
+@pytest.mark.parametrize('event, kwargs', [
+    (Event.institution_changed, {'code': 'NDQ'}),
+    (Event.data_changed, {'collection': 'institutions', 'operation': 'update', 'key': {'_id': 1}, 'document': None})
+])
+@patch('src.operations.instruments.database.institutions')
+@patch('src.operations.instruments.database.instruments')
+def test_search_instruments_exchange_changed(collection_mock, institutions_mock, security, normal_user, event, kwargs):
+    collection_mock.find.return_value = [
+        {**security.dict(), 'exchange': {'type': InstitutionType.exchange, 'code': 'NDQ'}}
+    ]
+    institutions_mock.find.return_value = [security.exchange.dict()]
+    instrument_index.mark_stale()
+    search_instruments(security.symbol, 10, normal_user)
+
+    exchange = {**security.exchange.dict(), 'name': 'Renamed'}
+    institutions_mock.find.return_value = [exchange]
+    publish(event, **kwargs)
+
+    assert search_instruments(security.symbol, 10, normal_user) == [{**security.dict(), 'exchange': exchange}]
+    assert collection_mock.find.call_count == 2
+
+
+def test_search_instruments_limit(normal_user):
+    with pytest.raises(HTTPException) as excinfo:
+        search_instruments('usd', 0, normal_user)
+
+    assert excinfo.value.status_code == 400
@@ -0,0 +1,34 @@
+import threading
+from unittest.mock import MagicMock
+
+from src.lazy import Lazy
+
+
+def test_lazy_created_on_first_use():
+    factory = MagicMock(return_value={'users': 'collection'})
+    lazy = Lazy(factory)
+
+    factory.assert_not_called()
+    assert not lazy.loaded
+    assert lazy['users'] == 'collection'
+    assert lazy.get('users') == 'collection'
+    factory.assert_called_once_with()
+    assert lazy.loaded
+
+
+def test_lazy_created_once_concurrently():
+    created = []
+
+    def factory():
+        created.append(True)
+        return MagicMock()
+
+    lazy = Lazy(factory)
+    threads = [threading.Thread(target=lambda: lazy.users) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    assert len(created) == 1
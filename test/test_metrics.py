@@ -0,0 +1,108 @@
+import threading
+from unittest.mock import patch
+
+import pytest
+from fastapi import HTTPException
+
+from src.exceptions import handled, AuthenticationError, NotFoundError
+from src.metrics import Metric, render, operation_latency, operations_in_flight, operation_errors
+from src.operations.metrics import get_metrics
+from .fixtures import admin_user_in, admin_user_input, normal_user, normal_user_input
+
+
+def test_handled_records_success():
+    @handled
+    def metrics_success():
+        assert operations_in_flight.values()[('metrics_success',)] == 1
+        return 'ok'
+
+    assert metrics_success() == 'ok'
+
+    counts = operation_latency.values()[('metrics_success', 200)]
+    assert sum(counts[:-1]) == 1
+    assert operations_in_flight.values()[('metrics_success',)] == 0
+    assert ('metrics_success', 200) not in operation_errors.values()
+
+
+def test_handled_records_mapped_status():
+    @handled
+    def metrics_failure():
+        raise NotFoundError('missing')
+
+    with pytest.raises(HTTPException):
+        metrics_failure()
+
+    assert operation_errors.values()[('metrics_failure', 404)] == 1
+    assert sum(operation_latency.values()[('metrics_failure', 404)][:-1]) == 1
+    assert operations_in_flight.values()[('metrics_failure',)] == 0
+
+
+def test_metrics_merge_threads():
+    @handled
+    def metrics_threaded():
+        pass
+
+    threads = [threading.Thread(target=lambda: [metrics_threaded() for _ in range(100)]) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    assert sum(operation_latency.values()[('metrics_threaded', 200)][:-1]) == 400
+
+
+def test_render():
+    @handled
+    def metrics_rendered():
+        pass
+
+    metrics_rendered()
+    text = render()
+
+    assert '# TYPE operation_duration_seconds histogram' in text
+    assert 'operation_duration_seconds_bucket{operation="metrics_rendered",status="200",le="+Inf"} 1' in text
+    assert 'operation_duration_seconds_count{operation="metrics_rendered",status="200"} 1' in text
+    assert 'operations_in_flight{operation="metrics_rendered"} 0' in text
+
+
+def test_metric_abstract():
+    with pytest.raises(TypeError):
+        Metric('abstract_metric', 'Metrics without samples cannot be created.')
+
+
+@patch('src.operations.metrics.METRICS_TOKEN', 'scraper-token')
+def test_get_metrics():
+    response = get_metrics('Bearer scraper-token')
+
+    assert response.media_type == 'text/plain; version=0.0.4'
+    assert b'# TYPE operation_errors_total counter' in response.body
+
+
+@patch('src.operations.metrics.resolve_user')
+@patch('src.operations.metrics.METRICS_TOKEN', None)
+def test_get_metrics_admin(mock_resolve, admin_user_in):
+    mock_resolve.return_value = admin_user_in
+
+    response = get_metrics('Bearer admin-token')
+
+    mock_resolve.assert_called_once_with('admin-token')
+    assert b'# TYPE operation_errors_total counter' in response.body
+
+
+@pytest.mark.parametrize('authorization', ['', 'Bearer wrong-token', 'Bearer user-token', 'Bearer t\u00f6ken'])
+@patch('src.operations.metrics.resolve_user')
+@patch('src.operations.metrics.METRICS_TOKEN', 'scraper-token')
+def test_get_metrics_unauthorized(mock_resolve, authorization, normal_user):
+    def resolve(token):
+        if token != 'user-token':
+            raise AuthenticationError('Invalid authentication credentials.')
+
+        return normal_user
+
+    mock_resolve.side_effect = resolve
+
+    with pytest.raises(HTTPException) as excinfo:
+        get_metrics(authorization)
+
+    assert excinfo.value.status_code == 401
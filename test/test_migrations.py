@@ -0,0 +1,98 @@
+from datetime import datetime
+from unittest.mock import patch, MagicMock
+
+from pymongo import UpdateOne
+
+from src.migrations import migrate, check_schema_version, get_schema_version, reference_catalog_documents, \
+    remove_process_resume_tokens, date_completed_entries, SCHEMA_VERSION, _checked_versions
+from src.models.transactions import TransactionStatus
+
+
+def _database(version: int = None):
+    database = MagicMock()
+    database.meta.find_one.return_value = {'version': version} if version is not None else None
+    return database
+
+
+def test_get_schema_version_missing():
+    assert get_schema_version(_database()) == 0
+
+
+def test_migrate_applies_pending():
+    database = _database(SCHEMA_VERSION - 1)
+    migration = MagicMock()
+
+    with patch('src.migrations.MIGRATIONS', [('First', MagicMock())] * (SCHEMA_VERSION - 1) + [('Last', migration)]):
+        applied = migrate(database)
+
+    assert applied == [SCHEMA_VERSION]
+    migration.assert_called_once_with(database)
+    database.meta.update_one.assert_called_once()
+    assert database.meta.update_one.call_args[0][1]['$set']['version'] == SCHEMA_VERSION
+
+
+def test_migrate_up_to_date():
+    database = _database(SCHEMA_VERSION)
+
+    assert migrate(database) == []
+    database.meta.update_one.assert_not_called()
+
+
+def test_check_schema_version_cached():
+    database = _database(SCHEMA_VERSION)
+
+    assert check_schema_version(database)
+    assert check_schema_version(database)
+    database.meta.find_one.assert_called_once()
+    _checked_versions.clear()
+
+
+def test_check_schema_version_behind(caplog):
+    database = _database(0)
+
+    assert not check_schema_version(database)
+    assert 'python -m src.migrations' in caplog.text
+    _checked_versions.clear()
+
+
+def test_reference_catalog_documents():
+    database = MagicMock()
+    database.values.index_information.return_value = {'_id_': {}, 'date_-1_instrument.type_1': {}}
+
+    with patch('src.migrations.migrate_references') as migrate_references:
+        reference_catalog_documents(database)
+
+    migrate_references.assert_called_once_with(database)
+    database.values.drop_index.assert_called_once_with('date_-1_instrument.type_1')
+
+
+def test_remove_process_resume_tokens():
+    database = MagicMock()
+
+    remove_process_resume_tokens(database)
+
+    database.meta.delete_many.assert_called_once_with({'_id': {'$regex': '^change_stream:'}})
+
+
+def test_date_completed_entries():
+    database = MagicMock()
+    database.transactions.find.return_value = [
+        {
+            '_id': 1,
+            'code': '2020-04-20T10:00:00',
+            'entries': [
+                {'status': TransactionStatus.completed},
+                {'status': TransactionStatus.pending},
+                {'status': TransactionStatus.completed, 'completed_at': datetime(2020, 4, 21)}
+            ]
+        }
+    ]
+
+    with patch('src.migrations.create_indexes') as create_indexes:
+        date_completed_entries(database)
+
+    # Only completed entries without a completion time are dated by the transaction code
+    database.transactions.bulk_write.assert_called_once_with(
+        [UpdateOne({'_id': 1}, {'$set': {'entries.0.completed_at': datetime(2020, 4, 20, 10)}})], ordered=False
+    )
+    create_indexes.assert_called_once_with(database)
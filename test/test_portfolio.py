@@ -0,0 +1,377 @@
+from datetime import datetime
+from unittest.mock import patch, MagicMock
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+from src.events import Event, publish
+from src.models.instruments import InstrumentType
+from src.models.portfolio import AllocationCategory
+from src.models.transactions import TransactionStatus
+from src.operations.portfolio import _forward_fill, _get_holding_deltas, BalanceChange, get_portfolio_values, \
+    get_portfolio_returns, returns_cache, _get_latest_prices, get_portfolio_allocation, allocation_cache
+from src.operations.rates import RateMatrix
+from .fixtures import atm_extraction, atm_extraction_input, account_bank_input, account_cash_input, \
+    account_broker_input, currency, currency_input, euro_user, normal_user, normal_user_input, value, value_input
+
+
+CURRENCIES = ['EUR', 'USD']
+
+INSTRUMENTS = {
+    'EUR': {'type': InstrumentType.currency, 'code': 'EUR'},
+    'USD': {'type': InstrumentType.currency, 'code': 'USD'},
+    'NDQ:AMZN': {'type': InstrumentType.security, 'code': 'NDQ:AMZN', 'exchange': {'type': 'exchange', 'code': 'NDQ'}}
+}
+
+
+@pytest.fixture
+def instrument_catalog():
+    with patch('src.operations.portfolio.get_currency_codes', return_value=CURRENCIES), \
+            patch('src.operations.portfolio.get_instrument_types',
+                  side_effect=lambda codes: {code: INSTRUMENTS[code]['type'] for code in codes}), \
+            patch('src.operations.portfolio.get_catalog_documents',
+                  side_effect=lambda _, keys: {key: INSTRUMENTS[key[0]] for key in keys}):
+        yield
+
+
+def _transaction(code, *entries, completed_at: datetime = None):
+    return {
+        'code': code,
+        'entries': [
+            {
+                'status': status,
+                'account': {'code': account},
+                'balance': {'instrument': {'code': instrument}, 'quantity': quantity},
+                **({'completed_at': completed_at or datetime.fromisoformat(code)}
+                   if status == TransactionStatus.completed else {})
+            }
+            for account, instrument, quantity, status in entries
+        ]
+    }
+
+
+def _value(code, date, **values):
+    return {'instrument': {'code': code}, 'date': date, 'values': values}
+
+
+def _mock_values(mock_values, currency_values, instrument_values):
+    """Serve values by instrument code and date, as the values collection would."""
+    values = sorted(currency_values + instrument_values, key=lambda v: v['date'])
+
+    def find(filters, projection):
+        codes, dates = filters['instrument.code']['$in'], filters['date']
+        cursor = MagicMock()
+        cursor.sort.return_value = [
+            v for v in values
+            if v['instrument']['code'] in codes and dates['$gte'] <= v['date'] <= dates['$lte']
+        ]
+        return cursor
+
+    def aggregate(pipeline):
+        codes, dates = pipeline[0]['$match']['instrument.code']['$in'], pipeline[0]['$match']['date']
+        latest = {v['instrument']['code']: v for v in values if v['instrument']['code'] in codes and
+                  v['date'] < dates['$lt']}
+        return [{'_id': code, 'date': v['date'], 'values': v['values']} for code, v in latest.items()]
+
+    mock_values.find.side_effect = find
+    mock_values.aggregate.side_effect = aggregate
+
+
+@pytest.fixture
+def portfolio_transactions():
+    return [
+        _transaction(
+            '2020-04-18T10:00:00',
+            ('BOICA', 'USD', 1000, TransactionStatus.completed)
+        ),
+        _transaction(
+            '2020-04-19T10:00:00',
+            ('MSIP01', 'NDQ:AMZN', 2, TransactionStatus.completed),
+            ('BOICA', 'USD', -200, TransactionStatus.completed),
+            ('BOICA', 'USD', -5000, TransactionStatus.pending)
+        ),
+    ]
+
+
+@pytest.fixture
+def portfolio_values():
+    return (
+        [
+            _value('EUR', datetime(2020, 4, 18), USD=1.25),
+            _value('EUR', datetime(2020, 4, 20), USD=1.0),
+        ],
+        [
+            _value('NDQ:AMZN', datetime(2020, 4, 19), USD=100),
+            _value('NDQ:AMZN', datetime(2020, 4, 21), USD=110),
+        ]
+    )
+
+
+def test_forward_fill():
+    matrix = np.array([[np.nan, 1], [2, np.nan], [np.nan, np.nan], [3, 4]])
+
+    res = _forward_fill(matrix)
+
+    assert np.isnan(res[0, 0])
+    assert res[1:, 0].tolist() == [2, 2, 3]
+    assert res[:, 1].tolist() == [1, 1, 1, 4]
+
+
+def test_get_holding_deltas():
+    changes = [
+        BalanceChange(datetime(2020, 4, 10), 'BOICA', 'EUR', 10),
+        BalanceChange(datetime(2020, 4, 20), 'BOICA', 'EUR', 5),
+        BalanceChange(datetime(2020, 4, 21), 'WALLET', 'EUR', 1),
+        BalanceChange(datetime(2020, 4, 21), 'BOICA', 'EUR', -2),
+    ]
+
+    columns, deltas = _get_holding_deltas(changes, datetime(2020, 4, 20), 3)
+
+    assert columns == [('BOICA', 'EUR'), ('WALLET', 'EUR')]
+    assert deltas.tolist() == [[15, 0], [-2, 1], [0, 0]]
+    assert deltas.cumsum(axis=0).tolist() == [[15, 0], [13, 1], [13, 1]]
+
+
+@patch('src.operations.portfolio.database.values')
+@patch('src.operations.portfolio.database.transactions')
+def test_get_portfolio_values(mock_transactions, mock_values, euro_user, portfolio_transactions, portfolio_values,
+                              instrument_catalog):
+    mock_transactions.find.return_value = portfolio_transactions
+    _mock_values(mock_values, *portfolio_values)
+
+    res = get_portfolio_values('2020-04-18', '2020-04-21', user=euro_user)
+
+    assert [r['date'] for r in res] == [datetime(2020, 4, d) for d in range(18, 22)]
+    assert [r['value'] for r in res] == pytest.approx([800, 800, 1000, 1020])
+    mock_transactions.find.assert_called_once()
+    assert mock_transactions.find.call_args[0][0] == {
+        'owner': euro_user.username,
+        'entries': {
+            '$elemMatch': {'status': TransactionStatus.completed, 'completed_at': {'$lt': datetime(2020, 4, 22)}}
+        }
+    }
+
+
+@patch('src.operations.portfolio.database.values')
+@patch('src.operations.portfolio.database.transactions')
+def test_get_portfolio_values_history_before_start(mock_transactions, mock_values, euro_user,
+                                                   portfolio_transactions, portfolio_values, instrument_catalog):
+    mock_transactions.find.return_value = portfolio_transactions
+    _mock_values(mock_values, *portfolio_values)
+
+    res = get_portfolio_values('2020-04-20', '2020-04-21', 'USD', euro_user)
+
+    assert [r['value'] for r in res] == pytest.approx([1000, 1020])
+    # Values are read from start on, after the latest one of each instrument before it
+    for filters, _ in (c[0] for c in mock_values.find.call_args_list):
+        assert filters['date'] == {'$gte': datetime(2020, 4, 20), '$lte': datetime(2020, 4, 21)}
+    for pipeline, in (c[0] for c in mock_values.aggregate.call_args_list):
+        assert pipeline[0]['$match']['date'] == {'$lt': datetime(2020, 4, 20)}
+
+
+@patch('src.operations.portfolio.database.values')
+@patch('src.operations.portfolio.database.transactions')
+def test_get_portfolio_values_completion_date(mock_transactions, mock_values, euro_user, portfolio_values,
+                                              instrument_catalog):
+    # Created on the 18th, but only completed on the 20th
+    mock_transactions.find.return_value = [
+        _transaction(
+            '2020-04-18T10:00:00',
+            ('BOICA', 'USD', 1000, TransactionStatus.completed),
+            completed_at=datetime(2020, 4, 20, 9)
+        )
+    ]
+    _mock_values(mock_values, *portfolio_values)
+
+    res = get_portfolio_values('2020-04-18', '2020-04-21', 'USD', euro_user)
+
+    assert [r['value'] for r in res] == pytest.approx([0, 0, 1000, 1000])
+
+
+@patch('src.operations.portfolio.database.values')
+@patch('src.operations.portfolio.database.transactions')
+def test_get_portfolio_values_missing_currency(mock_transactions, mock_values, normal_user):
+    with pytest.raises(HTTPException) as excinfo:
+        get_portfolio_values('2020-04-18', '2020-04-21', user=normal_user)
+
+    assert excinfo.value.status_code == 400
+    assert not mock_transactions.find.called
+
+
+@patch('src.operations.portfolio.database.transactions')
+def test_get_portfolio_values_invalid_period(mock_transactions, euro_user):
+    with pytest.raises(HTTPException) as excinfo:
+        get_portfolio_values('2020-04-21', '2020-04-18', user=euro_user)
+
+    assert excinfo.value.status_code == 400
+    assert not mock_transactions.find.called
+
+
+@patch('src.operations.portfolio.database.values')
+@patch('src.operations.portfolio.database.transactions')
+def test_get_portfolio_returns(mock_transactions, mock_values, euro_user, portfolio_transactions, portfolio_values,
+                               instrument_catalog):
+    returns_cache.clear()
+    mock_transactions.find.return_value = portfolio_transactions
+    _mock_values(mock_values, *portfolio_values)
+
+    res = get_portfolio_returns('2020-04-19', '2020-04-21', user=euro_user)
+
+    assert res['currency'] == 'EUR'
+    assert res['account'] is None
+    assert res['time_weighted'] == pytest.approx(0.275)
+    assert res['money_weighted'] == pytest.approx(1.275 ** (365 / 3) - 1)
+
+
+@patch('src.operations.portfolio.database.values')
+@patch('src.operations.portfolio.database.transactions')
+def test_get_portfolio_returns_account(mock_transactions, mock_values, euro_user, portfolio_transactions,
+                                       portfolio_values, instrument_catalog):
+    returns_cache.clear()
+    mock_transactions.find.return_value = portfolio_transactions
+    _mock_values(mock_values, *portfolio_values)
+
+    res = get_portfolio_returns('2020-04-19', '2020-04-21', 'MSIP01', user=euro_user)
+
+    # The account receives a 160 EUR flow on the first day and its holdings grow from there
+    assert res['account'] == 'MSIP01'
+    assert res['time_weighted'] == pytest.approx(220 / 160 - 1)
+
+
+@patch('src.operations.portfolio.database.values')
+@patch('src.operations.portfolio.database.transactions')
+def test_get_portfolio_returns_cached(mock_transactions, mock_values, euro_user, portfolio_transactions,
+                                      portfolio_values, atm_extraction, instrument_catalog):
+    returns_cache.clear()
+    mock_transactions.find.return_value = portfolio_transactions
+    _mock_values(mock_values, *portfolio_values)
+
+    first = get_portfolio_returns('2020-04-19', '2020-04-21', user=euro_user)
+    second = get_portfolio_returns('2020-04-19', '2020-04-21', user=euro_user)
+    assert first is second
+    assert mock_transactions.find.call_count == 1
+
+    atm_extraction.entries[0].completed_at = datetime(2020, 4, 20)
+    publish(Event.balance_changed, owner=euro_user.username, transaction=atm_extraction,
+            entries=atm_extraction.entries[:1], reverted=False, accounts=[])
+    get_portfolio_returns('2020-04-19', '2020-04-21', user=euro_user)
+    assert mock_transactions.find.call_count == 2
+
+
+@patch('src.operations.portfolio.get_rate_matrix')
+@patch('src.operations.portfolio.database.values')
+def test_get_latest_prices(mock_values, mock_rates, value, instrument_catalog):
+    mock_values.find_one.return_value = {'date': value.date}
+    mock_values.aggregate.return_value = [
+        {'_id': 'NDQ:AMZN', 'values': {'USD': 110}},
+        {'_id': 'NDQ:MSFT', 'values': {'EUR': 50}},
+    ]
+    mock_rates.return_value = RateMatrix([value.dict()])
+
+    res = _get_latest_prices(
+        {
+            'NDQ:AMZN': InstrumentType.security,
+            'NDQ:MSFT': InstrumentType.security,
+            'NDQ:GOOG': InstrumentType.security,
+            'USD': InstrumentType.currency,
+            'JPY': InstrumentType.currency,
+        },
+        'EUR'
+    )
+
+    assert res == {'NDQ:AMZN': pytest.approx(100), 'NDQ:MSFT': 50, 'NDQ:GOOG': None, 'USD': pytest.approx(1 / 1.1),
+                   'JPY': None}
+    mock_rates.assert_called_once_with(value.date)
+    assert mock_values.aggregate.call_args[0][0][0] == {
+        '$match': {'instrument.code': {'$in': ['NDQ:AMZN', 'NDQ:MSFT', 'NDQ:GOOG']}}
+    }
+
+
+@pytest.fixture
+def allocation_assets():
+    return [
+        {'_id': {'instrument': 'EUR'}, 'quantity': 100},
+        {'_id': {'holder': 'BOI', 'instrument': 'USD'}, 'quantity': 200},
+        {'_id': {'holder': 'MS', 'instrument': 'NDQ:AMZN'}, 'quantity': 2},
+    ]
+
+
+@pytest.fixture
+def allocation_quotes():
+    return {'EUR': ('EUR', 1), 'USD': ('USD', 0.5), 'NDQ:AMZN': ('USD', 100)}
+
+
+@patch('src.operations.portfolio._get_latest_quotes')
+@patch('src.operations.portfolio.database.accounts')
+def test_get_portfolio_allocation(mock_accounts, mock_quotes, euro_user, allocation_assets, allocation_quotes,
+                                  instrument_catalog):
+    allocation_cache.clear()
+    mock_accounts.aggregate.return_value = allocation_assets
+    mock_quotes.return_value = allocation_quotes
+
+    res = get_portfolio_allocation(AllocationCategory.type, user=euro_user)
+
+    assert res == [
+        {'group': 'currency', 'value': 200, 'weight': 0.5},
+        {'group': 'security', 'value': 200, 'weight': 0.5},
+    ]
+    pipeline = mock_accounts.aggregate.call_args[0][0]
+    assert pipeline[0] == {'$match': {'owner': euro_user.username}}
+    assert pipeline[1] == {'$unwind': '$assets'}
+    assert pipeline[2]['$group']['_id'] == {'holder': '$holder.code', 'instrument': '$assets.instrument.code'}
+    mock_quotes.assert_called_once_with(
+        {'EUR': 'currency', 'USD': 'currency', 'NDQ:AMZN': 'security'},
+        'EUR'
+    )
+
+
+@patch('src.operations.portfolio._get_latest_quotes')
+@patch('src.operations.portfolio.database.accounts')
+def test_get_portfolio_allocation_by_currency(mock_accounts, mock_quotes, euro_user, allocation_assets,
+                                              allocation_quotes, instrument_catalog):
+    allocation_cache.clear()
+    mock_accounts.aggregate.return_value = allocation_assets
+    mock_quotes.return_value = allocation_quotes
+
+    res = get_portfolio_allocation(AllocationCategory.currency, user=euro_user)
+
+    assert res == [
+        {'group': 'USD', 'value': 300, 'weight': 0.75},
+        {'group': 'EUR', 'value': 100, 'weight': 0.25},
+    ]
+
+
+@patch('src.operations.portfolio._get_latest_quotes')
+@patch('src.operations.portfolio.database.accounts')
+def test_get_portfolio_allocation_by_exchange(mock_accounts, mock_quotes, euro_user, allocation_assets,
+                                              allocation_quotes, instrument_catalog):
+    allocation_cache.clear()
+    mock_accounts.aggregate.return_value = allocation_assets
+    mock_quotes.return_value = allocation_quotes
+
+    res = get_portfolio_allocation(AllocationCategory.exchange, user=euro_user)
+
+    # Exchanges are read from the instruments referenced, currencies have none
+    assert {a['group']: a['value'] for a in res} == {'NDQ': 200, None: 200}
+
+
+@patch('src.operations.portfolio._get_latest_quotes')
+@patch('src.operations.portfolio.database.accounts')
+def test_get_portfolio_allocation_cached(mock_accounts, mock_quotes, euro_user, allocation_assets,
+                                         allocation_quotes, currency, value, instrument_catalog):
+    allocation_cache.clear()
+    mock_accounts.aggregate.return_value = allocation_assets
+    mock_quotes.return_value = allocation_quotes
+
+    get_portfolio_allocation(AllocationCategory.type, user=euro_user)
+    get_portfolio_allocation(AllocationCategory.type, user=euro_user)
+    assert mock_accounts.aggregate.call_count == 1
+
+    publish(Event.account_changed, owner=euro_user.username, code='WALLET', account=None)
+    get_portfolio_allocation(AllocationCategory.type, user=euro_user)
+    assert mock_accounts.aggregate.call_count == 2
+
+    publish(Event.value_changed, instrument=currency.dict(), date=value.date, values=value.values)
+    get_portfolio_allocation(AllocationCategory.type, user=euro_user)
+    assert mock_accounts.aggregate.call_count == 3
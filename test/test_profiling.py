@@ -0,0 +1,158 @@
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from unittest.mock import patch, MagicMock
+
+import pytest
+from fastapi import HTTPException
+
+from src.config import SECRET_KEY
+from src.exceptions import handled
+from src.profiling import Profile, current_profile, remove_old_profiles, sign
+from src.operations.profiles import profile_requests, get_profile
+
+
+@handled
+def _busy_operation():
+    start = time.perf_counter()
+    while time.perf_counter() - start < 0.05:
+        sum(range(1000))
+
+
+def test_profile_samples_operation_threads():
+    profile = Profile('test', 0.001)
+    token = current_profile.set(profile)
+    profile.start()
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(_busy_operation,))
+    thread.start()
+    thread.join()
+    profile.stop()
+    current_profile.reset(token)
+
+    stacks = profile.folded().splitlines()
+    assert any(s.startswith('cpu;') and '_busy_operation' in s for s in stacks)
+    # The starting thread, serving other requests meanwhile, is not sampled
+    assert all('_busy_operation' in s for s in stacks)
+    assert profile.time('cpu') > 0
+
+
+def test_profile_removes_operation_threads():
+    profile = Profile('test', 0.001)
+    token = current_profile.set(profile)
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(_busy_operation,))
+    thread.start()
+    thread.join()
+    current_profile.reset(token)
+
+    assert profile._threads == set()
+
+
+def _request(headers: dict):
+    request = MagicMock(method='GET', headers=headers)
+    request.url.path = '/accounts'
+    return request
+
+
+async def _call_next(_):
+    return MagicMock(headers={})
+
+
+@patch('src.operations.profiles.Profile')
+def test_profile_requests_not_triggered(profile_mock):
+    response = asyncio.run(profile_requests(_request({}), _call_next))
+
+    profile_mock.assert_not_called()
+    assert response.headers == {}
+
+
+@patch('src.operations.profiles.resolve_user')
+def test_profile_requests_signed(resolve_mock, tmp_path):
+    with patch('src.operations.profiles.PROFILES_DIRECTORY', str(tmp_path)):
+        request = _request({'X-Profile': sign(SECRET_KEY, 'GET', '/accounts', int(time.time()) + 60)})
+        response = asyncio.run(profile_requests(request, _call_next))
+
+    name = response.headers['X-Profile'].split(';')[0]
+    assert name.endswith('-GET-accounts')
+    assert os.path.isfile(tmp_path / f'{name}.folded')
+    resolve_mock.assert_not_called()
+
+
+@pytest.mark.parametrize('header', [
+    sign(SECRET_KEY, 'GET', '/accounts', int(time.time()) - 1),
+    sign(SECRET_KEY, 'GET', '/transactions', int(time.time()) + 60),
+    sign(SECRET_KEY, 'POST', '/accounts', int(time.time()) + 60),
+    sign('other', 'GET', '/accounts', int(time.time()) + 60),
+    f'{int(time.time()) + 3600}.{sign(SECRET_KEY, "GET", "/accounts", int(time.time()) + 60).split(".")[1]}',
+    'ñ' * 64,
+    f'{int(time.time()) + 60}.' + 'ñ' * 64,
+    '1'
+])
+@patch('src.operations.profiles.Profile')
+def test_profile_requests_not_signed(profile_mock, header):
+    response = asyncio.run(profile_requests(_request({'X-Profile': header}), _call_next))
+
+    profile_mock.assert_not_called()
+    assert response.headers == {}
+
+
+def test_profile_requests_remove_old_profiles(tmp_path):
+    for name in ('20200101T000000000000-GET-accounts', '20200102T000000000000-GET-accounts'):
+        (tmp_path / f'{name}.folded').write_text('cpu;main 1\n')
+
+    with patch('src.operations.profiles.PROFILES_DIRECTORY', str(tmp_path)), \
+            patch('src.operations.profiles.PROFILES_KEPT', 2):
+        request = _request({'X-Profile': sign(SECRET_KEY, 'GET', '/accounts', int(time.time()) + 60)})
+        response = asyncio.run(profile_requests(request, _call_next))
+
+    name = response.headers['X-Profile'].split(';')[0]
+    assert sorted(os.listdir(tmp_path)) == ['20200102T000000000000-GET-accounts.folded', f'{name}.folded']
+
+
+def test_remove_old_profiles(tmp_path):
+    (tmp_path / 'a.folded').write_text('')
+    (tmp_path / 'other').write_text('')
+
+    remove_old_profiles(str(tmp_path), 0)
+
+    assert os.listdir(tmp_path) == ['other']
+
+
+@patch('src.operations.profiles.resolve_user')
+def test_profile_requests_admin(resolve_mock, tmp_path):
+    resolve_mock.return_value = MagicMock(is_admin=True)
+
+    with patch('src.operations.profiles.PROFILES_DIRECTORY', str(tmp_path)):
+        request = _request({'X-Profile': '1', 'Authorization': 'Bearer token'})
+        response = asyncio.run(profile_requests(request, _call_next))
+
+    resolve_mock.assert_called_once_with('token')
+    assert 'X-Profile' in response.headers
+
+
+@patch('src.operations.profiles.resolve_user')
+def test_profile_requests_not_admin(resolve_mock):
+    resolve_mock.return_value = MagicMock(is_admin=False)
+
+    request = _request({'X-Profile': '1', 'Authorization': 'Bearer token'})
+    response = asyncio.run(profile_requests(request, _call_next))
+
+    assert 'X-Profile' not in response.headers
+
+
+def test_get_profile(tmp_path):
+    (tmp_path / 'test.folded').write_text('cpu;main 1\n')
+
+    with patch('src.operations.profiles.PROFILES_DIRECTORY', str(tmp_path)):
+        response = get_profile('test', None)
+
+    assert response.body == b'cpu;main 1\n'
+
+
+def test_get_profile_not_found(tmp_path):
+    with patch('src.operations.profiles.PROFILES_DIRECTORY', str(tmp_path)):
+        with pytest.raises(HTTPException) as e:
+            get_profile('../test', None)
+
+    assert e.value.status_code == 404
@@ -0,0 +1,75 @@
+import asyncio
+import threading
+
+from src.pubsub import Broker
+from src.metrics import subscribers_dropped
+
+
+def test_messages_delivered_to_topic_subscribers():
+    async def run():
+        broker = Broker()
+        first, second = broker.subscribe(['a']), broker.subscribe(['a', 'b'])
+        broker.publish('a', 1)
+        broker.publish('b', 2)
+        broker.publish('c', 3)
+
+        return [await first.next(0.1), await first.next(0)], [await second.next(0.1), await second.next(0.1)]
+
+    assert asyncio.run(run()) == ([1, None], [1, 2])
+
+
+def test_messages_published_from_other_threads():
+    async def run():
+        broker = Broker()
+        subscription = broker.subscribe(['a'])
+        thread = threading.Thread(target=broker.publish, args=('a', 1))
+        thread.start()
+        thread.join()
+
+        return await subscription.next(1)
+
+    assert asyncio.run(run()) == 1
+
+
+def test_slow_subscribers_dropped():
+    async def run():
+        broker = Broker(max_pending=2)
+        slow, fast = broker.subscribe(['a']), broker.subscribe(['a'])
+        for n in range(3):
+            broker.publish('a', n)
+            assert await fast.next(0.1) == n
+
+        return [message async for message in slow], len(broker)
+
+    dropped = subscribers_dropped.values().get((), 0)
+    messages, subscribers = asyncio.run(run())
+
+    assert messages == [('dropped', {'reason': 'too many pending messages'})]
+    assert subscribers == 1
+    assert subscribers_dropped.values()[()] == dropped + 1
+
+
+def test_resubscribe():
+    async def run():
+        broker = Broker()
+        subscription = broker.subscribe(['a'])
+        broker.resubscribe(subscription, ['b'])
+        broker.publish('a', 1)
+        broker.publish('b', 2)
+
+        return await subscription.next(0.1)
+
+    assert asyncio.run(run()) == 2
+
+
+def test_close_ends_subscriptions():
+    async def run():
+        broker = Broker()
+        subscription = broker.subscribe(['a'])
+        broker.publish('a', 1)
+        broker.close()
+        broker.publish('a', 2)
+
+        return [message async for message in subscription], len(broker)
+
+    assert asyncio.run(run()) == ([], 0)
@@ -0,0 +1,214 @@
+"""
+Query plan regression suite: every query issued by the operations must use an index and examine a bounded number of
+documents, against a database seeded with realistic volumes.
+
+Needs a MongoDB server (mongomock cannot explain queries), so it only runs when MONGO_TEST_URI is set, e.g.
+MONGO_TEST_URI=mongodb://localhost:27017 python -m pytest test/test_query_plans.py
+"""
+import os
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+from fastapi.security import OAuth2PasswordRequestForm
+from pymongo import MongoClient, monitoring
+
+from benchmarks.data import seed_database, using_database, PASSWORD
+from src.models.accounts import AccountIn, AccountType
+from src.models.auth import User, UserIn
+from src.models.institutions import Institution, InstitutionType
+from src.models.instruments import InstrumentIn, InstrumentType, ValueIn
+from src.models.portfolio import AllocationCategory
+from src.models.transactions import TransactionIn, TransactionStatus
+from src.slow_queries import EXPLAINABLE, explain_command, get_plan_stages, get_execution_stats
+from src.operations.accounts import add_account, get_accounts, modify_account, delete_account
+from src.operations.auth import add_user, authenticate, resolve_user
+from src.operations.holdings import get_holdings
+from src.operations.institutions import add_institution, get_institutions, modify_institution, delete_institution
+from src.operations.instruments import add_instrument, get_instruments, modify_instrument, delete_instrument, \
+    get_value, set_value
+from src.operations.portfolio import get_portfolio_values, get_portfolio_returns, get_portfolio_allocation
+from src.operations.rates import get_rate
+from src.operations.snapshots import get_snapshot, get_snapshots, _refresh_snapshots
+from src.operations.sync import get_changes
+from src.operations.transactions import add_transaction, get_transactions, complete_transaction, cancel_transaction
+
+
+MONGO_TEST_URI = os.environ.get('MONGO_TEST_URI')
+
+pytestmark = pytest.mark.skipif(not MONGO_TEST_URI, reason='MONGO_TEST_URI is not set')
+
+# Volumes seeded before explaining the queries
+VOLUMES = {'users': 20, 'securities': 100, 'days': 365, 'transactions': 500, 'seed': 0}
+
+# Documents a query may examine: this many per document returned, plus a fixed allowance for point lookups and writes
+MAX_EXAMINED_PER_RETURNED = 4
+MAX_EXAMINED_EXTRA = 10
+
+
+class CommandRecorder(monitoring.CommandListener):
+    def __init__(self):
+        self.commands = []
+
+    def started(self, event):
+        if event.command_name in EXPLAINABLE:
+            self.commands.append((event.command_name, event.command))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+@pytest.fixture(scope='module')
+def plans_database():
+    recorder = CommandRecorder()
+    client = MongoClient(MONGO_TEST_URI, event_listeners=[recorder])
+    database = client.portfolio_query_plans
+    seed_database(database, **VOLUMES)
+
+    # Issue the queries of every operation module against the seeded database
+    with using_database(database):
+        yield database, recorder
+
+    client.drop_database(database.name)
+
+
+def _run(operation, *args):
+    try:
+        operation(*args)
+
+    except HTTPException:
+        # Failed operations still issue their queries
+        pass
+
+
+def _transaction_lifecycle(user):
+    transaction = add_transaction(TransactionIn(**{
+        'description': 'Query plans',
+        'total': {'instrument': 'USD', 'quantity': 100},
+        'entries': [
+            {'account': 'BROKERAGE', 'balance': {'instrument': 'NDQ:S0000', 'quantity': 1}},
+            {'account': 'CURRENT', 'balance': {'instrument': 'USD', 'quantity': -100}}
+        ]
+    }), user)
+    _run(complete_transaction, transaction['code'], user)
+    _run(cancel_transaction, transaction['code'], user)
+
+
+def _authentication(user):
+    _run(add_user, UserIn(username=user.username, password=PASSWORD))
+    token = authenticate(OAuth2PasswordRequestForm(username=user.username, password=PASSWORD, scope=''))
+    resolve_user(token['access_token'])
+
+
+def _account_lifecycle(user):
+    account = {'type': AccountType.bank, 'code': 'PLANS', 'description': 'Query plans', 'holder': 'BOI'}
+    _run(add_account, AccountIn(**account), user)
+    _run(modify_account, 'PLANS', AccountIn(**{**account, 'description': 'Query plans modified'}), user)
+    _run(delete_account, 'PLANS', user)
+
+
+def _institution_lifecycle(user):
+    institution = {'type': InstitutionType.bank, 'code': 'PLANS', 'name': 'Query plans'}
+    _run(add_institution, Institution(**institution), user)
+    _run(modify_institution, 'PLANS', Institution(**{**institution, 'name': 'Query plans modified'}), user)
+    _run(delete_institution, 'PLANS')
+
+
+def _instrument_lifecycle(user):
+    instrument = {'type': InstrumentType.security, 'description': 'Query plans', 'symbol': 'PLANS', 'exchange': 'NDQ'}
+    _run(add_instrument, InstrumentIn(**instrument), user)
+    _run(modify_instrument, 'NDQ:PLANS', InstrumentIn(**{**instrument, 'description': 'Query plans modified'}), user)
+    _run(delete_instrument, 'NDQ:PLANS', user)
+
+
+def _sync(user):
+    token = get_changes(None, user)['token']
+    _run(get_changes, token, user)
+
+
+OPERATIONS = {
+    'authentication': _authentication,
+    'institution_lifecycle': _institution_lifecycle,
+    'instrument_lifecycle': _instrument_lifecycle,
+    'account_lifecycle': _account_lifecycle,
+    'sync': _sync,
+    'get_institutions': lambda user: _run(get_institutions, user, InstitutionType.bank),
+    'get_instruments': lambda user: _run(get_instruments, user, InstrumentType.security),
+    'get_value': lambda user: _run(get_value, 'USD', '2020-06-30', user),
+    'set_value': lambda user: _run(set_value, 'USD', '2020-06-30', ValueIn(values={'EUR': 0.9}), user),
+    'get_rate': lambda user: _run(get_rate, 'USD', '2020-06-30', 'GBP', user),
+    'get_rate_without_values': lambda user: _run(get_rate, 'USD', '2020-06-27', 'GBP', user),
+    'get_accounts': lambda user: _run(get_accounts, user, AccountType.investment),
+    'get_transactions': lambda user: _run(get_transactions, user),
+    'get_transactions_by_status': lambda user: _run(get_transactions, user, TransactionStatus.pending),
+    'get_transactions_by_dates': lambda user: _run(get_transactions, user, None, '2020-03-01', '2020-03-31'),
+    'get_transactions_by_account': lambda user: _run(get_transactions, user, None, None, None, 'BROKERAGE'),
+    'get_transactions_by_instrument': lambda user: _run(get_transactions, user, None, None, None, None, 'USD'),
+    'get_transactions_by_status_and_dates': lambda user: _run(
+        get_transactions, user, TransactionStatus.completed, '2020-03-01', '2020-03-31'
+    ),
+    'get_transactions_by_account_and_dates': lambda user: _run(
+        get_transactions, user, None, '2020-03-01', '2020-03-31', 'CURRENT'
+    ),
+    'get_transactions_by_instrument_and_dates': lambda user: _run(
+        get_transactions, user, None, '2020-03-01', '2020-03-31', None, 'USD'
+    ),
+    'get_transactions_by_status_and_account': lambda user: _run(
+        get_transactions, user, TransactionStatus.pending, None, None, 'BROKERAGE'
+    ),
+    'get_transactions_by_status_and_instrument': lambda user: _run(
+        get_transactions, user, TransactionStatus.pending, None, None, None, 'USD'
+    ),
+    'get_transactions_by_account_and_instrument': lambda user: _run(
+        get_transactions, user, None, None, None, 'BROKERAGE', 'NDQ:S0000'
+    ),
+    'get_transactions_by_all_filters': lambda user: _run(
+        get_transactions, user, TransactionStatus.completed, '2020-03-01', '2020-03-31', 'CURRENT', 'USD'
+    ),
+    'transaction_lifecycle': _transaction_lifecycle,
+    'get_portfolio_values': lambda user: _run(get_portfolio_values, '2020-06-01', '2020-06-30', None, user),
+    'get_portfolio_returns': lambda user: _run(get_portfolio_returns, '2020-01-01', '2020-12-31', None, None, user),
+    'get_portfolio_allocation': lambda user: _run(get_portfolio_allocation, AllocationCategory.institution, None, user),
+    'get_holdings': lambda user: _run(get_holdings, user),
+    'get_snapshot': lambda user: _run(get_snapshot, '2020-06-30', user),
+    'get_snapshots': lambda user: _run(get_snapshots, '2020-06-01', '2020-06-30', user),
+    'refresh_owner_snapshots': lambda user: _refresh_snapshots(('owner', user.username), datetime(2020, 12, 1)),
+    'refresh_instrument_snapshots': lambda user: _refresh_snapshots(('instrument', 'NDQ:S0000'), datetime(2020, 12, 1)),
+    'refresh_rate_snapshots': lambda user: _refresh_snapshots(('rates', None), datetime(2020, 12, 1))
+}
+
+
+def _has_predicates(command_name: str, command: dict):
+    query = command.get('filter') or command.get('query')
+    if command_name == 'aggregate':
+        query = next((s['$match'] for s in command.get('pipeline', ()) if '$match' in s), None)
+
+    elif command_name in ('update', 'delete'):
+        statements = command.get(f'{command_name}s', ())
+        query = statements[0].get('q') if statements else None
+
+    return bool(query)
+
+
+@pytest.mark.parametrize('operation', OPERATIONS.values(), ids=OPERATIONS.keys())
+def test_query_plans(plans_database, operation):
+    database, recorder = plans_database
+    recorder.commands.clear()
+    operation(User(username='user0000', base_currency='EUR'))
+
+    commands = list(recorder.commands)
+    for command_name, command in commands:
+        explain = explain_command(database, command, verbosity='executionStats')
+        stages = get_plan_stages(explain)
+        stats = get_execution_stats(explain)
+        description = f'{command_name} on {command.get(command_name)}: {dict(command)}, plan {stages}'
+
+        if _has_predicates(command_name, command):
+            assert 'COLLSCAN' not in stages, f'Collection scan for {description}'
+
+        examined = stats.get('totalDocsExamined', 0)
+        allowed = MAX_EXAMINED_PER_RETURNED * stats.get('nReturned', 0) + MAX_EXAMINED_EXTRA
+        assert examined <= allowed, f'{examined} documents examined (at most {allowed}) for {description}'
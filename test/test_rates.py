@@ -0,0 +1,166 @@
+from datetime import datetime
+from unittest.mock import patch
+
+import mongomock
+import pytest
+from fastapi import HTTPException
+
+from src.events import Event, publish
+from src.exceptions import NotFoundError
+from src.operations.rates import RateMatrix, get_rate, get_rate_matrix, rate_matrices
+from .fixtures import catalog_cache, currency, currency_input, security, security_input, exchange_input, \
+    usd_value, value, value_input
+
+
+def test_rate_matrix_direct(value, usd_value):
+    matrix = RateMatrix([value.dict(), usd_value.dict()])
+
+    assert matrix.rate('EUR', 'USD') == 1.1
+    assert matrix.rate('USD', 'EUR') == pytest.approx(1 / 1.1)
+    assert matrix.rate('EUR', 'EUR') == 1
+    assert matrix.currencies == {'EUR', 'USD', 'ARS', 'JPY'}
+
+
+def test_rate_matrix_triangulated(value, usd_value):
+    matrix = RateMatrix([value.dict(), usd_value.dict()])
+
+    rate, path = matrix.resolve('JPY', 'ARS')
+
+    assert rate == pytest.approx(70 / (1.1 * 110))
+    assert path == ['JPY', 'USD', 'EUR', 'ARS']
+
+
+def test_rate_matrix_explicit_quote_precedence(value):
+    usd_data = {'instrument': {'code': 'USD'}, 'values': {'EUR': 0.8}}
+    matrix = RateMatrix([value.dict(), usd_data])
+
+    assert matrix.rate('USD', 'EUR') == 0.8
+    assert matrix.rate('EUR', 'USD') == 1.1
+
+
+def test_rate_matrix_no_path(value):
+    matrix = RateMatrix([value.dict()])
+
+    with pytest.raises(NotFoundError):
+        matrix.rate('EUR', 'JPY')
+
+
+def _latest_values(*values):
+    return [{'_id': v.instrument.code, 'date': v.date, 'values': v.values} for v in values]
+
+
+@patch('src.operations.rates.get_currency_codes')
+@patch('src.operations.rates.database.values')
+def test_get_rate_matrix_cached(collection_mock, currencies_mock, value, usd_value):
+    rate_matrices.clear()
+    currencies_mock.return_value = ['EUR', 'USD']
+    collection_mock.aggregate.return_value = _latest_values(value, usd_value)
+
+    first = get_rate_matrix(value.date)
+    second = get_rate_matrix(value.date)
+
+    assert first is second
+    collection_mock.aggregate.assert_called_once_with([
+        {'$match': {'instrument.code': {'$in': ['EUR', 'USD']}, 'date': {'$lte': value.date}}},
+        {'$sort': {'instrument.code': 1, 'date': -1}},
+        {'$group': {'_id': '$instrument.code', 'date': {'$first': '$date'}, 'values': {'$first': '$values'}}}
+    ])
+
+
+@patch('src.operations.rates.get_currency_codes')
+@patch('src.operations.rates.database.values')
+def test_get_rate_matrix_invalidated(collection_mock, currencies_mock, value, currency, security):
+    rate_matrices.clear()
+    currencies_mock.return_value = ['EUR', 'USD']
+    collection_mock.aggregate.return_value = _latest_values(value)
+
+    get_rate_matrix(value.date)
+    publish(Event.value_changed, instrument=security.dict(), date=value.date, values={'USD': 100})
+    get_rate_matrix(value.date)
+    publish(Event.value_changed, instrument=currency.dict(), date=value.date, values=value.values)
+    get_rate_matrix(value.date)
+
+    assert collection_mock.aggregate.call_count == 2
+    # Decided from the events, without reading the currencies
+    assert currencies_mock.call_count == 2
+
+
+@patch('src.operations.rates.get_currency_codes')
+@patch('src.operations.rates.database.values')
+def test_get_rate_matrix_invalidated_by_reference(collection_mock, currencies_mock, value, security, catalog_cache):
+    rate_matrices.clear()
+    currencies_mock.return_value = ['EUR', 'USD']
+    collection_mock.aggregate.return_value = _latest_values(value)
+    catalog_cache.set(('instruments', (security.code,)), security.dict())
+
+    get_rate_matrix(value.date)
+    # Changes by other workers carry the stored value, which only references its instrument
+    publish(Event.data_changed, collection='values', operation='update',
+            document={'instrument': {'code': security.code}, 'date': value.date})
+    get_rate_matrix(value.date)
+    publish(Event.data_changed, collection='values', operation='update',
+            document={'instrument': {'code': 'EUR'}, 'date': value.date})
+    get_rate_matrix(value.date)
+
+    assert collection_mock.aggregate.call_count == 2
+
+
+@patch('src.operations.rates.get_currency_codes')
+@patch('src.operations.rates.database.values')
+def test_get_rate_success(collection_mock, currencies_mock, value, usd_value):
+    rate_matrices.clear()
+    currencies_mock.return_value = ['EUR', 'USD']
+    collection_mock.aggregate.return_value = _latest_values(value, usd_value)
+
+    res = get_rate('JPY', '2020-04-20', 'EUR')
+
+    assert res['date'] == value.date
+    assert res['rate'] == pytest.approx(1 / (1.1 * 110))
+    assert res['path'] == ['JPY', 'USD', 'EUR']
+
+
+@patch('src.operations.rates.get_currency_codes')
+@patch('src.operations.rates.database.values')
+def test_get_rate_not_found(collection_mock, currencies_mock, value):
+    rate_matrices.clear()
+    currencies_mock.return_value = ['EUR', 'USD']
+    collection_mock.aggregate.return_value = _latest_values(value)
+
+    with pytest.raises(HTTPException) as excinfo:
+        get_rate('JPY', '2020-04-20', 'EUR')
+
+    assert excinfo.value.status_code == 404
+
+
+@patch('src.operations.rates.get_currency_codes')
+def test_get_rate_matrix_quoted_on_different_days(currencies_mock):
+    rate_matrices.clear()
+    currencies_mock.return_value = ['GBP', 'USD']
+    database = mongomock.MongoClient().portfolio
+    database.values.insert_many([
+        {'instrument': {'code': 'USD'}, 'date': datetime(2020, 1, 1), 'values': {'EUR': 0.9}},
+        {'instrument': {'code': 'GBP'}, 'date': datetime(2020, 1, 1), 'values': {'EUR': 1.15}},
+        {'instrument': {'code': 'USD'}, 'date': datetime(2020, 1, 2), 'values': {'EUR': 0.8}}
+    ])
+
+    with patch('src.operations.rates.database', database):
+        matrices = [get_rate_matrix(datetime(2020, 1, day)) for day in (1, 2, 3)]
+
+    # Each currency is carried forward from its own latest value
+    assert [matrix.rate('GBP', 'EUR') for matrix in matrices] == [1.15, 1.15, 1.15]
+    assert [matrix.rate('USD', 'EUR') for matrix in matrices] == [0.9, 0.8, 0.8]
+    assert [matrix.date for matrix in matrices] == [datetime(2020, 1, 1), datetime(2020, 1, 2), datetime(2020, 1, 2)]
+
+
+@patch('src.operations.rates.get_currency_codes')
+@patch('src.operations.rates.database.values')
+def test_get_rate_matrix_no_previous_date(collection_mock, currencies_mock):
+    rate_matrices.clear()
+    currencies_mock.return_value = ['EUR', 'USD']
+    collection_mock.aggregate.return_value = []
+
+    matrix = get_rate_matrix(datetime(2020, 4, 19))
+
+    assert matrix.date is None
+    with pytest.raises(NotFoundError):
+        matrix.rate('EUR', 'USD')
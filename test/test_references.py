@@ -0,0 +1,64 @@
+from unittest.mock import MagicMock
+
+from src.references import iter_references, migrate_references, store_references
+from .fixtures import atm_extraction, atm_extraction_input, account_bank, account_bank_input, account_cash_input, \
+    account_broker_input, bank_input, currency, currency_input, normal_user_input, security, security_input, \
+    exchange_input
+
+
+def test_store_references_transaction(atm_extraction):
+    document = atm_extraction.dict()
+
+    stored = store_references('transactions', document)
+
+    assert stored['total'] == {'instrument': {'code': 'EUR'}, 'quantity': atm_extraction.total.quantity}
+    assert [e['balance']['instrument'] for e in stored['entries']] == [{'code': 'EUR'}] * len(document['entries'])
+    assert [e['account'] for e in stored['entries']] == [e['account'] for e in document['entries']]
+    # The document stored is a copy
+    assert document == atm_extraction.dict()
+
+
+def test_store_references_institutions(account_bank, security):
+    assert store_references('accounts', account_bank.dict())['holder'] == {'type': 'bank', 'code': 'BOI'}
+    assert store_references('instruments', security.dict())['exchange'] == {'type': 'exchange', 'code': 'NDQ'}
+
+
+def test_store_references_missing(account_bank):
+    document = {'code': 'WALLET', 'assets': []}
+
+    assert store_references('accounts', document) == document
+    assert store_references('users', {'username': 'potato'}) == {'username': 'potato'}
+
+
+def test_iter_references(account_bank, security):
+    document = {**account_bank.dict(), 'assets': [{'instrument': security.dict(), 'quantity': 1}]}
+
+    assert iter_references('accounts', document) == [
+        ('institutions', account_bank.holder.dict()),
+        ('instruments', security.dict())
+    ]
+
+
+def test_migrate_references(account_bank, security, currency):
+    collections = {name: MagicMock() for name in ('accounts', 'instruments', 'transactions', 'values')}
+    database = MagicMock()
+    database.__getitem__.side_effect = collections.__getitem__
+    collections['accounts'].find.return_value = [{'_id': 1, **account_bank.dict()}]
+    collections['instruments'].find.return_value = [
+        {'_id': 2, **security.dict()},
+        # Already referencing its exchange (or without one)
+        {'_id': 3, **currency.dict()}
+    ]
+    collections['transactions'].find.return_value = []
+    collections['values'].find.return_value = []
+
+    migrate_references(database)
+
+    collections['accounts'].find.assert_called_once_with({}, {'holder': True, 'assets': True})
+    requests = collections['accounts'].bulk_write.call_args[0][0]
+    assert [r._doc for r in requests] == [{'$set': {'holder': {'type': 'bank', 'code': 'BOI'}, 'assets': []}}]
+    requests = collections['instruments'].bulk_write.call_args[0][0]
+    assert [(r._filter, r._doc) for r in requests] == [
+        ({'_id': 2}, {'$set': {'exchange': {'type': 'exchange', 'code': 'NDQ'}}})
+    ]
+    assert not collections['transactions'].bulk_write.called
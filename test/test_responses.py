@@ -0,0 +1,121 @@
+import json
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+from pydantic.fields import List, Union
+
+from src.models.accounts import AccountOut, FinancialAccount, CashAccount
+from src.models.instruments import Instrument, InstrumentOut, Security
+from src.models.transactions import Transaction
+from src.responses import get_shape, prune, trusted, parse_fields, get_projection, select
+from .fixtures import account_bank, account_bank_input, account_cash, account_cash_input, atm_extraction, \
+    atm_extraction_input, account_broker_input, bank_input, currency, currency_input, exchange_input, \
+    normal_user_input, security, security_input
+
+
+def test_get_shape_union():
+    shape = get_shape(List[Union[Security, Instrument]])
+
+    assert shape == [{
+        'type': None,
+        'description': None,
+        'symbol': None,
+        'code': None,
+        'exchange': {'type': None, 'name': None, 'code': None}
+    }]
+
+
+def test_get_shape_discriminated_union(currency, security):
+    shape = get_shape(List[InstrumentOut])
+
+    assert shape[0].get(currency.dict()) == {'type': None, 'description': None, 'symbol': None, 'code': None}
+    assert shape[0].get(security.dict())['exchange'] == {'type': None, 'name': None, 'code': None}
+
+
+def test_prune_discriminated_union(account_bank, account_cash):
+    cash_data = {**account_cash.dict(exclude_none=True), 'holder': {'code': 'leftover'}}
+
+    res = prune(get_shape(List[AccountOut]), [account_bank.dict(exclude_none=True), cash_data])
+
+    assert res == [account_bank.dict(exclude_none=True), account_cash.dict(exclude_none=True)]
+
+
+def test_prune_drops_unknown_fields(account_bank, account_cash):
+    documents = [
+        {**account_bank.dict(exclude_none=True), '_id': ObjectId()},
+        {**account_cash.dict(exclude_none=True), '_id': ObjectId()}
+    ]
+    documents[0]['holder']['_id'] = ObjectId()
+
+    res = prune(get_shape(List[Union[FinancialAccount, CashAccount]]), documents)
+
+    assert res == [account_bank.dict(exclude_none=True), account_cash.dict(exclude_none=True)]
+
+
+def test_trusted_response(atm_extraction):
+    document = {**atm_extraction.dict(exclude_none=True), '_id': ObjectId()}
+    document['entries'][0]['balance']['instrument']['_id'] = ObjectId()
+
+    response = trusted(lambda: [document], List[Transaction])()
+
+    assert response.media_type == 'application/json'
+    # Fields missing from the document are left out instead of set to null
+    assert json.loads(response.body) == [json.loads(atm_extraction.json(exclude_none=True))]
+
+
+def test_parse_fields():
+    assert parse_fields(' code, entries.account.code,entries,entriesx,,') == ['code', 'entries', 'entriesx']
+
+
+def test_get_projection():
+    assert get_projection(None) is None
+    assert get_projection('code,entries.account.code') == {'_id': False, 'code': True, 'entries.account.code': True}
+
+
+def test_get_projection_references():
+    references = ('total.instrument', 'entries.balance.instrument')
+
+    assert get_projection('entries.balance.instrument.symbol,entries.balance.instrument.type,total', references) == {
+        '_id': False, 'entries.balance.instrument': True, 'total': True
+    }
+    assert get_projection('entries.balance', references) == {'_id': False, 'entries.balance': True}
+
+
+def test_select_discriminated_union(account_bank, account_cash):
+    shape = select(get_shape(List[AccountOut]), 'code,holder.code')
+
+    res = prune(shape, [account_bank.dict(exclude_none=True), account_cash.dict(exclude_none=True)])
+
+    assert res == [
+        {'code': account_bank.code, 'holder': {'code': account_bank.holder.code}},
+        {'code': account_cash.code}
+    ]
+
+
+def test_select_unknown_field():
+    with pytest.raises(KeyError):
+        select(get_shape(List[Transaction]), 'entries.account.holder')
+
+    with pytest.raises(KeyError):
+        select(get_shape(List[Transaction]), 'code.length')
+
+
+def test_trusted_response_fields(atm_extraction):
+    document = {**atm_extraction.dict(exclude_none=True), '_id': ObjectId()}
+
+    response = trusted(lambda fields: [document], List[Transaction])(fields='code,entries.balance.quantity')
+
+    assert json.loads(response.body) == [{
+        'code': atm_extraction.code,
+        'entries': [{'balance': {'quantity': entry.balance.quantity}} for entry in atm_extraction.entries]
+    }]
+
+
+def test_trusted_response_unknown_field():
+    operation = trusted(lambda fields: [], List[Transaction])
+
+    with pytest.raises(HTTPException) as excinfo:
+        operation(fields='secret')
+
+    assert excinfo.value.status_code == 400
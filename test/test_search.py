@@ -0,0 +1,65 @@
+from unittest.mock import MagicMock
+
+from src.search import PrefixIndex
+
+
+CATALOG = [
+    {'code': 'USD', 'symbol': 'USD', 'description': 'US Dollar'},
+    {'code': 'NDQ:AMZN', 'symbol': 'AMZN', 'description': 'Amazon.com Inc'},
+    {'code': 'NDQ:AAPL', 'symbol': 'AAPL', 'description': 'Apple Inc'},
+    {'code': 'NYSE:AA', 'symbol': 'AA', 'description': 'Alcoa Corp'},
+]
+
+
+def _index():
+    load = MagicMock(side_effect=lambda: [dict(d) for d in CATALOG])
+    return PrefixIndex(load, {'symbol': 3, 'code': 2, 'description': 1}), load
+
+
+def test_search_ranks_by_field_and_whole_words():
+    index, _ = _index()
+
+    assert [d['code'] for d in index.search('aa')] == ['NYSE:AA', 'NDQ:AAPL']
+    assert [d['code'] for d in index.search('a')] == ['NDQ:AAPL', 'NDQ:AMZN', 'NYSE:AA']
+
+
+def test_search_matches_every_word():
+    index, _ = _index()
+
+    assert [d['code'] for d in index.search('apple in')] == ['NDQ:AAPL']
+    assert [d['code'] for d in index.search('inc', limit=1)] == ['NDQ:AAPL']
+    assert index.search('apple dollar') == []
+    assert index.search(' ') == []
+
+
+def test_search_loads_once():
+    index, load = _index()
+    index.search('usd')
+    index.search('amazon')
+
+    load.assert_called_once()
+    assert len(index) == len(CATALOG)
+
+
+def test_updates():
+    index, load = _index()
+    index.search('usd')
+    index.add({'code': 'EUR', 'symbol': 'EUR', 'description': 'Euro'})
+    index.add({'code': 'USD', 'symbol': 'USD', 'description': 'United States Dollar'})
+    index.remove('NDQ:AMZN')
+
+    assert [d['code'] for d in index.search('eu')] == ['EUR']
+    assert [d['code'] for d in index.search('united')] == ['USD']
+    assert index.search('dollar us')[0]['description'] == 'United States Dollar'
+    assert index.search('amazon') == []
+    load.assert_called_once()
+
+
+def test_mark_stale_reloads():
+    index, load = _index()
+    index.search('usd')
+    index.mark_stale()
+    index.add({'code': 'EUR', 'symbol': 'EUR', 'description': 'Euro'})
+
+    assert index.search('eur') == []
+    assert load.call_count == 2
@@ -0,0 +1,84 @@
+import json
+from unittest.mock import MagicMock
+
+from src.slow_queries import SlowQueryLog
+
+
+def _events(name='find', command=None, duration=200000, request_id=1):
+    command = command or {'find': 'transactions', 'filter': {'owner': 'user', 'status': 'pending'}, 'lsid': {}}
+    started = MagicMock(command_name=name, command=command, connection_id=('host', 1), request_id=request_id)
+    succeeded = MagicMock(
+        command_name=name,
+        database_name='portfolio',
+        duration_micros=duration,
+        connection_id=('host', 1),
+        request_id=request_id
+    )
+    return started, succeeded
+
+
+def test_fast_commands_not_logged():
+    log = SlowQueryLog(0.1)
+    started, succeeded = _events(duration=1000)
+    log.started(started)
+    log.succeeded(succeeded)
+
+    assert len(log.queue) == 0
+
+
+def test_slow_commands_coalesced_by_shape():
+    log = SlowQueryLog(0.1)
+    for request_id, owner in enumerate(['user', 'other']):
+        command = {'find': 'transactions', 'filter': {'owner': owner}}
+        started, succeeded = _events(command=command, request_id=request_id)
+        log.started(started)
+        log.succeeded(succeeded)
+
+    assert len(log.queue) == 1
+
+
+def test_unexplainable_commands_ignored():
+    log = SlowQueryLog(0.1)
+    started, succeeded = _events(name='insert', command={'insert': 'transactions'})
+    log.started(started)
+    log.succeeded(succeeded)
+
+    assert len(log.queue) == 0
+
+
+def test_collscan_flagged(caplog):
+    log = SlowQueryLog(0.1)
+    log.client = MagicMock()
+    log.client['portfolio'].command.return_value = {
+        'queryPlanner': {'winningPlan': {'stage': 'SORT', 'inputStage': {'stage': 'COLLSCAN'}}}
+    }
+    started, succeeded = _events()
+    log.started(started)
+    log.succeeded(succeeded)
+    log.queue.drain()
+
+    log.client['portfolio'].command.assert_called_once_with(
+        'explain',
+        {'find': 'transactions', 'filter': {'owner': 'user', 'status': 'pending'}},
+        verbosity='queryPlanner'
+    )
+    record = json.loads(caplog.records[-1].message)
+    assert record['collection'] == 'transactions'
+    assert record['plan'] == ['SORT', 'COLLSCAN']
+    assert record['collscan'] is True
+
+
+def test_aggregate_plan(caplog):
+    log = SlowQueryLog(0.1)
+    log.client = MagicMock()
+    log.client['portfolio'].command.return_value = {
+        'stages': [{'$cursor': {'queryPlanner': {'winningPlan': {'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN'}}}}}]
+    }
+    started, succeeded = _events(name='aggregate', command={'aggregate': 'values', 'pipeline': [{'$match': {}}]})
+    log.started(started)
+    log.succeeded(succeeded)
+    log.queue.drain()
+
+    record = json.loads(caplog.records[-1].message)
+    assert record['plan'] == ['FETCH', 'IXSCAN']
+    assert record['collscan'] is False
@@ -0,0 +1,254 @@
+from datetime import datetime
+from unittest.mock import patch, call
+
+import numpy as np
+import pymongo
+import pytest
+from fastapi import HTTPException
+
+from src.events import Event, publish
+from src.models.instruments import InstrumentType
+from src.models.transactions import TransactionStatus
+from src.operations.portfolio import Valuation
+from src.operations.snapshots import get_snapshot, get_snapshots, snapshot_queue, _build_snapshots, \
+    _refresh_owner_snapshots
+from .fixtures import atm_extraction, atm_extraction_input, account_bank_input, account_cash_input, \
+    account_broker_input, currency, currency_input, euro_user, normal_user, normal_user_input, security, \
+    security_input, exchange_input
+
+
+@pytest.fixture
+def valuation():
+    return Valuation(
+        dates=[datetime(2020, 4, 20)],
+        columns=[('BOICA', 'EUR'), ('BOICA', 'USD'), ('MSIP01', 'NDQ:AMZN'), ('WALLET', 'EUR')],
+        deltas=np.array([[100, 10, 2, 0]]),
+        holdings=np.array([[100, 10, 2, 0]]),
+        prices=np.array([[1, 0.8, np.nan, 1]])
+    )
+
+
+@pytest.fixture
+def snapshot(euro_user):
+    return {
+        'owner': euro_user.username,
+        'date': datetime(2020, 4, 20),
+        'currency': 'EUR',
+        'value': 108,
+        'accounts': [
+            {
+                'code': 'BOICA',
+                'value': 108,
+                'assets': [
+                    {'instrument': 'EUR', 'quantity': 100, 'value': 100},
+                    {'instrument': 'USD', 'quantity': 10, 'value': 8}
+                ]
+            },
+            {
+                'code': 'MSIP01',
+                'value': 0,
+                'assets': [
+                    {'instrument': 'NDQ:AMZN', 'quantity': 2, 'value': None}
+                ]
+            }
+        ]
+    }
+
+
+@patch('src.operations.snapshots._get_valuation')
+def test_build_snapshots(mock_valuation, euro_user, valuation, snapshot):
+    mock_valuation.return_value = valuation._replace(
+        dates=[datetime(2020, 4, 19), datetime(2020, 4, 20)],
+        holdings=np.vstack([np.zeros(4), valuation.holdings]),
+        prices=np.vstack([valuation.prices, valuation.prices])
+    )
+
+    res = _build_snapshots(euro_user, [datetime(2020, 4, 19), datetime(2020, 4, 20)])
+
+    assert res == [
+        {'owner': euro_user.username, 'date': datetime(2020, 4, 19), 'currency': 'EUR', 'value': 0, 'accounts': []},
+        snapshot
+    ]
+    mock_valuation.assert_called_once_with(euro_user, datetime(2020, 4, 19), datetime(2020, 4, 20), 'EUR', None)
+
+
+@patch('src.operations.snapshots._build_snapshots')
+@patch('src.operations.snapshots.database.snapshots')
+def test_get_snapshot_materialized(mock_collection, mock_build, euro_user, snapshot):
+    mock_collection.find_one.return_value = snapshot
+
+    res = get_snapshot('2020-04-20', euro_user)
+
+    assert res == snapshot
+    mock_collection.find_one.assert_called_once_with({'owner': euro_user.username, 'date': datetime(2020, 4, 20)})
+    assert not mock_build.called
+
+
+@patch('src.operations.snapshots._build_snapshots')
+@patch('src.operations.snapshots.database.snapshots')
+def test_get_snapshot_missing(mock_collection, mock_build, euro_user, snapshot):
+    mock_collection.find_one.return_value = None
+    mock_build.return_value = [snapshot]
+
+    res = get_snapshot('2020-04-20', euro_user)
+
+    assert res == snapshot
+    mock_build.assert_called_once_with(euro_user, [datetime(2020, 4, 20)])
+    # Reads do not write
+    assert not mock_collection.replace_one.called
+    assert not mock_collection.bulk_write.called
+
+
+@patch('src.operations.snapshots.database.snapshots')
+def test_get_snapshot_future(mock_collection, euro_user):
+    with pytest.raises(HTTPException) as excinfo:
+        get_snapshot('3020-04-20', euro_user)
+
+    assert excinfo.value.status_code == 400
+    assert not mock_collection.find_one.called
+
+
+@patch('src.operations.snapshots.database.snapshots')
+def test_get_snapshots(mock_collection, euro_user, snapshot):
+    mock_collection.find.return_value.sort.return_value = [snapshot]
+
+    res = get_snapshots('2020-04-01', '2020-04-30', euro_user)
+
+    assert res == [snapshot]
+    mock_collection.find.assert_called_once_with(
+        {'owner': euro_user.username, 'date': {'$gte': datetime(2020, 4, 1), '$lte': datetime(2020, 4, 30)}},
+        None
+    )
+
+
+@patch('src.operations.snapshots._get_today')
+@patch('src.operations.snapshots._build_snapshots')
+@patch('src.operations.snapshots.database')
+def test_refresh_owner_snapshots(mock_database, mock_build, mock_today, euro_user):
+    mock_today.return_value = datetime(2020, 4, 25)
+    mock_database.users.find_one.return_value = euro_user.dict()
+    mock_database.snapshots.distinct.return_value = [datetime(2020, 4, 22), datetime(2020, 4, 21)]
+    mock_database.snapshots.find_one.return_value = None
+    mock_build.return_value = [{'date': datetime(2020, 4, 21)}, {'date': datetime(2020, 4, 22)}]
+
+    _refresh_owner_snapshots(euro_user.username, datetime(2020, 4, 20))
+
+    mock_database.snapshots.distinct.assert_called_once_with(
+        'date', {'owner': euro_user.username, 'date': {'$gte': datetime(2020, 4, 20)}}
+    )
+    mock_database.snapshots.find_one.assert_called_once_with(
+        {'owner': euro_user.username, 'date': {'$lt': datetime(2020, 4, 20)}},
+        {'date': True, 'accounts': True},
+        sort=[('date', pymongo.DESCENDING)]
+    )
+    # Every date is built from a single valuation
+    mock_build.assert_called_once_with(
+        euro_user, [datetime(2020, 4, 21), datetime(2020, 4, 22), datetime(2020, 4, 25)], None
+    )
+    requests = mock_database.snapshots.bulk_write.call_args[0][0]
+    assert [(r._filter, r._doc, r._upsert) for r in requests] == [
+        ({'owner': euro_user.username, 'date': datetime(2020, 4, 21)}, {'date': datetime(2020, 4, 21)}, True),
+        ({'owner': euro_user.username, 'date': datetime(2020, 4, 22)}, {'date': datetime(2020, 4, 22)}, True)
+    ]
+
+
+@patch('src.operations.portfolio._get_prices')
+@patch('src.operations.portfolio.get_instrument_types')
+@patch('src.operations.portfolio.database.transactions')
+@patch('src.operations.snapshots._get_today')
+@patch('src.operations.snapshots.database')
+def test_refresh_owner_snapshots_from_previous(mock_database, mock_today, mock_transactions, mock_types, mock_prices,
+                                               euro_user, snapshot):
+    mock_today.return_value = datetime(2020, 4, 22)
+    mock_database.users.find_one.return_value = euro_user.dict()
+    mock_database.snapshots.distinct.return_value = []
+    mock_database.snapshots.find_one.return_value = snapshot
+    mock_transactions.find.return_value = [
+        {
+            'entries': [
+                {
+                    'status': TransactionStatus.completed,
+                    'completed_at': datetime(2020, 4, 21, 10),
+                    'account': {'code': 'BOICA'},
+                    'balance': {'instrument': {'code': 'EUR'}, 'quantity': -40}
+                }
+            ]
+        }
+    ]
+    mock_types.side_effect = lambda codes: {code: InstrumentType.currency for code in codes}
+    mock_prices.side_effect = lambda instruments, *_: (sorted(instruments), np.ones((3, len(instruments))))
+
+    _refresh_owner_snapshots(euro_user.username, datetime(2020, 4, 22))
+
+    # Transactions up to the previous snapshot are not read again, its holdings are carried on
+    assert mock_transactions.find.call_args[0][0]['entries']['$elemMatch']['completed_at'] == {
+        '$gte': datetime(2020, 4, 21), '$lt': datetime(2020, 4, 23)
+    }
+    requests = mock_database.snapshots.bulk_write.call_args[0][0]
+    assert [r._doc['date'] for r in requests] == [datetime(2020, 4, 22)]
+    assert requests[0]._doc['accounts'] == [
+        {
+            'code': 'BOICA',
+            'value': 70,
+            'assets': [
+                {'instrument': 'EUR', 'quantity': 60, 'value': 60},
+                {'instrument': 'USD', 'quantity': 10, 'value': 10}
+            ]
+        },
+        {'code': 'MSIP01', 'value': 2, 'assets': [{'instrument': 'NDQ:AMZN', 'quantity': 2, 'value': 2}]}
+    ]
+
+
+@patch('src.operations.snapshots._build_snapshots')
+@patch('src.operations.snapshots.database')
+def test_refresh_owner_snapshots_no_currency(mock_database, mock_build, normal_user):
+    mock_database.users.find_one.return_value = normal_user.dict()
+
+    _refresh_owner_snapshots(normal_user.username, datetime(2020, 4, 20))
+
+    assert not mock_build.called
+
+
+@patch('src.operations.snapshots._refresh_owner_snapshots')
+@patch('src.operations.snapshots.database')
+def test_snapshot_queue_coalesces_balance_changes(mock_database, mock_refresh, atm_extraction, normal_user):
+    snapshot_queue.drain()
+    mock_refresh.reset_mock()
+    later_transaction = atm_extraction.copy(update={'code': '2020-04-22T10:00:00'}, deep=True)
+    later_transaction.entries[0].completed_at = datetime(2020, 4, 22, 10)
+    # Created on 2020-04-20, but the holdings only change once completed
+    atm_extraction.entries[0].completed_at = datetime(2020, 4, 21, 18)
+
+    publish(Event.balance_changed, owner=normal_user.username, transaction=later_transaction,
+            entries=later_transaction.entries[:1], reverted=False, accounts=[])
+    publish(Event.balance_changed, owner=normal_user.username, transaction=atm_extraction,
+            entries=atm_extraction.entries[:1], reverted=False, accounts=[])
+    assert len(snapshot_queue) == 1
+    snapshot_queue.drain()
+
+    mock_refresh.assert_called_once_with(normal_user.username, datetime(2020, 4, 21))
+    assert len(snapshot_queue) == 0
+
+
+@patch('src.operations.snapshots._refresh_owner_snapshots')
+@patch('src.operations.snapshots.database')
+def test_snapshot_queue_value_changes(mock_database, mock_refresh, security, currency):
+    snapshot_queue.drain()
+    mock_database.reset_mock()
+    mock_refresh.reset_mock()
+    mock_database.snapshots.distinct.side_effect = [['potato'], ['potato', 'tomato']]
+
+    publish(Event.value_changed, instrument=security.dict(), date=datetime(2020, 4, 20), values={})
+    publish(Event.value_changed, instrument=currency.dict(), date=datetime(2020, 4, 21), values={})
+    snapshot_queue.drain()
+
+    # Owners of snapshots with the instrument, including those who sold it since
+    assert mock_database.snapshots.distinct.mock_calls == [
+        call('owner', {'accounts.assets.instrument': security.code, 'date': {'$gte': datetime(2020, 4, 20)}}),
+        call('owner', {'date': {'$gte': datetime(2020, 4, 21)}})
+    ]
+    assert mock_refresh.mock_calls == [
+        call('potato', datetime(2020, 4, 20)),
+        call('potato', datetime(2020, 4, 21)),
+        call('tomato', datetime(2020, 4, 21))
+    ]
@@ -0,0 +1,161 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch, call, MagicMock
+
+import mongomock
+import pytest
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+
+from src.models.transactions import TransactionStatus
+from src.operations.sync import get_changes, next_version, add_deletion, _decode_token, _encode_token
+from src.operations.transactions import complete_transaction
+from src.references import store_references
+from .fixtures import normal_user, normal_user_input, account_cash, account_cash_input, atm_extraction, \
+    atm_extraction_input, currency, currency_input, account_bank_input, account_broker_input, sync_version, \
+    catalog_cache
+
+
+@patch('src.operations.sync.database')
+def test_next_version(mock_database):
+    mock_database.meta.find_one_and_update.return_value = {'_id': 'sync:potato', 'version': 3}
+
+    version = next_version('potato')
+
+    assert version['version'] == 3
+    assert isinstance(version['updated_at'], datetime)
+    # A single round trip
+    assert mock_database.mock_calls == [call.meta.find_one_and_update(
+        {'_id': 'sync:potato'}, {'$inc': {'version': 1}}, upsert=True, return_document=ReturnDocument.AFTER
+    )]
+
+
+@patch('src.operations.sync.database')
+def test_add_deletion(mock_database, sync_version):
+    add_deletion('potato', 'accounts', 'CASH', sync_version)
+
+    mock_database.deletions.insert_one.assert_called_once_with({
+        'owner': 'potato',
+        'collection': 'accounts',
+        'code': 'CASH',
+        'version': sync_version['version'],
+        'deleted_at': sync_version['updated_at']
+    })
+
+
+def _database(accounts=(), transactions=(), deletions=(), version=5):
+    database = MagicMock()
+    database.meta.find_one.return_value = {'version': version}
+    collections = {'accounts': list(accounts), 'transactions': list(transactions), 'deletions': list(deletions)}
+    database.__getitem__.side_effect = lambda name: getattr(database, name)
+    for name, documents in collections.items():
+        getattr(database, name).find.return_value = documents
+
+    return database
+
+
+def test_get_changes_full(normal_user, account_cash, atm_extraction):
+    database = _database([account_cash.dict()], [atm_extraction.dict()])
+
+    with patch('src.operations.sync.database', database), \
+            patch('src.operations.sync.resolve_references', side_effect=lambda _, documents: documents) as resolve:
+        changes = get_changes(user=normal_user)
+
+    assert changes['reset']
+    assert changes['accounts'] == [account_cash.dict()]
+    assert changes['transactions'] == [atm_extraction.dict()]
+    assert changes['deleted'] == []
+    database.accounts.find.assert_called_once_with({'owner': normal_user.username})
+    # The catalog documents referenced are resolved for each collection at once
+    assert resolve.mock_calls == [
+        call('accounts', [account_cash.dict()]),
+        call('transactions', [atm_extraction.dict()])
+    ]
+    assert not database.deletions.find.called
+
+
+def test_get_changes_since(normal_user, account_cash):
+    database = _database(
+        [account_cash.dict()],
+        deletions=[{'collection': 'accounts', 'code': 'BANK'}, {'collection': 'accounts', 'code': account_cash.code}]
+    )
+
+    issued_at = datetime(2020, 4, 20, 10, tzinfo=timezone.utc)
+
+    with patch('src.operations.sync.database', database), \
+            patch('src.operations.sync.datetime', wraps=datetime) as mock_datetime:
+        mock_datetime.now.return_value = issued_at + timedelta(hours=1)
+        changes = get_changes(_encode_token(3, issued_at), normal_user)
+
+    # Including the changes of versions allocated up to SYNC_WRITES_TIMEOUT before the token, which may have landed
+    # after it
+    recent = datetime(2020, 4, 20, 9, 59)
+    filters = {'owner': normal_user.username, '$or': [{'version': {'$gt': 3}}, {'updated_at': {'$gte': recent}}]}
+    assert not changes['reset']
+    assert changes['accounts'] == [account_cash.dict()]
+    # Deleted and created again
+    assert changes['deleted'] == [{'collection': 'accounts', 'code': 'BANK'}]
+    database.accounts.find.assert_called_once_with(filters)
+    database.transactions.find.assert_called_once_with(filters)
+    database.deletions.find.assert_called_once_with(
+        {'owner': normal_user.username, '$or': [{'version': {'$gt': 3}}, {'deleted_at': {'$gte': recent}}]},
+        {'collection': True, 'code': True}
+    )
+
+
+def test_get_changes_token(normal_user):
+    database = _database(version=5)
+
+    with patch('src.operations.sync.database', database):
+        token = get_changes(user=normal_user)['token']
+        get_changes(token, normal_user)
+
+    assert database.accounts.find.call_args.args[0]['$or'][0] == {'version': {'$gt': 5}}
+
+
+def test_get_changes_expired_token(normal_user):
+    database = _database()
+
+    with patch('src.operations.sync.database', database):
+        changes = get_changes(_encode_token(3, datetime.utcnow() - timedelta(days=365)), normal_user)
+
+    assert changes['reset']
+    database.accounts.find.assert_called_once_with({'owner': normal_user.username})
+
+
+def test_token_issued_at_utc():
+    issued_at = datetime(2020, 4, 20, 10, tzinfo=timezone.utc)
+
+    assert _decode_token(_encode_token(7, issued_at)) == (7, issued_at)
+
+
+def test_get_changes_during_completion(normal_user, atm_extraction, currency):
+    database = mongomock.MongoClient().portfolio
+    database.instruments.insert_one(currency.dict())
+    for entry in atm_extraction.entries:
+        entry.status = TransactionStatus.pending
+    atm_extraction.status = TransactionStatus.pending
+    database.transactions.insert_one(store_references('transactions', atm_extraction.dict()))
+    tokens = []
+
+    def sync_once(*_):
+        # Synced after the completion got its version, before its writes
+        if not tokens:
+            tokens.append(get_changes(user=normal_user)['token'])
+
+    with patch('src.operations.sync.database', database), \
+            patch('src.operations.transactions.database', database), \
+            patch('src.operations.catalog.database', database), \
+            patch('src.operations.transactions._update_lots'), \
+            patch('src.operations.transactions.publish'), \
+            patch('src.operations.transactions._update_account_balance', side_effect=sync_once):
+        complete_transaction(atm_extraction.code, normal_user)
+        changes = get_changes(tokens[0], normal_user)
+
+    assert [t['status'] for t in changes['transactions']] == [TransactionStatus.completed]
+
+
+def test_get_changes_invalid_token(normal_user):
+    with pytest.raises(HTTPException) as excinfo:
+        get_changes('not a token', normal_user)
+
+    assert excinfo.value.status_code == 400
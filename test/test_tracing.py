@@ -0,0 +1,80 @@
+import asyncio
+from unittest.mock import MagicMock
+
+import pytest
+
+from src.tracing import command_tracker, current_request, RequestStats, RoundTripBudgetExceeded, round_trip_budget, \
+    track_round_trips
+
+
+def _succeeded(name='find', documents=2, duration=1500):
+    return MagicMock(
+        command_name=name,
+        duration_micros=duration,
+        reply={'cursor': {'firstBatch': [{}] * documents}}
+    )
+
+
+def test_command_tracker_records_current_request():
+    stats = RequestStats()
+    token = current_request.set(stats)
+    try:
+        command_tracker.succeeded(_succeeded())
+        command_tracker.succeeded(_succeeded(name='update', documents=0))
+        command_tracker.failed(MagicMock(command_name='insert', duration_micros=500))
+
+    finally:
+        current_request.reset(token)
+
+    assert stats.commands == 3
+    assert stats.documents == 2
+    assert stats.duration == pytest.approx(0.0035)
+    assert stats.names == {'find': 1, 'update': 1, 'insert': 1}
+
+
+def test_command_tracker_outside_request():
+    command_tracker.succeeded(_succeeded())
+
+    assert current_request.get() is None
+
+
+def test_round_trip_budget():
+    with round_trip_budget(2) as stats:
+        command_tracker.succeeded(_succeeded())
+        command_tracker.succeeded(_succeeded())
+
+    assert stats.commands == 2
+
+
+def test_round_trip_budget_exceeded():
+    with pytest.raises(RoundTripBudgetExceeded):
+        with round_trip_budget(1):
+            command_tracker.succeeded(_succeeded())
+            command_tracker.succeeded(_succeeded())
+
+
+def test_track_round_trips():
+    request = MagicMock(method='GET')
+    request.url.path = '/accounts'
+    response = MagicMock(status_code=200, headers={})
+
+    async def call_next(_):
+        command_tracker.succeeded(_succeeded(duration=2000))
+        return response
+
+    assert asyncio.run(track_round_trips(request, call_next)) is response
+    assert response.headers['Server-Timing'].startswith('db;dur=2.0;desc="1 commands, 2 documents", total;dur=')
+
+
+def test_track_round_trips_budget():
+    async def call_next(_):
+        command_tracker.succeeded(_succeeded())
+        command_tracker.succeeded(_succeeded())
+        return MagicMock(status_code=200, headers={})
+
+    request = MagicMock(method='GET')
+    request.url.path = '/accounts'
+
+    with round_trip_budget(1):
+        with pytest.raises(RoundTripBudgetExceeded):
+            asyncio.run(track_round_trips(request, call_next))
@@ -3,12 +3,17 @@ from unittest.mock import patch, call
 
 import pytest
 from fastapi import HTTPException
+from pymongo import ReturnDocument
 
+from src.events import Event
 from src.models.transactions import TransactionStatus
-from src.operations.transactions import add_transaction, complete_transaction, cancel_transaction, get_transactions
+from src.operations.rates import RateMatrix
+from src.operations.transactions import add_transaction, complete_transaction, cancel_transaction, get_transactions, \
+    BALANCES_PROJECTION
 from .fixtures import atm_extraction_in, atm_extraction_input, normal_user, normal_user_input, account_bank, \
     account_bank_input, bank_input, broker_input, account_cash, account_cash_input, account_broker, \
-    account_broker_input, currency, currency_input, atm_extraction, account_broker_input
+    account_broker_input, currency, currency_input, atm_extraction, account_broker_input, sync_version, catalog_cache, \
+    dollar, exchange_input, security, security_input, security_purchase
 
 
 @patch('src.operations.transactions.database.instruments')
@@ -17,7 +22,7 @@ from .fixtures import atm_extraction_in, atm_extraction_input, normal_user, norm
 def test_add_transaction_account_not_found(mock_collection, mock_accounts, mock_instruments, atm_extraction_in,
                                            normal_user, currency):
     mock_accounts.find_one.return_value = None
-    mock_instruments.find_one.return_value = currency.dict(exclude_none=True)
+    mock_instruments.find.return_value = [currency.dict(exclude_none=True)]
 
     with pytest.raises(HTTPException) as excinfo:
         add_transaction(atm_extraction_in, normal_user)
@@ -32,7 +37,7 @@ def test_add_transaction_account_not_found(mock_collection, mock_accounts, mock_
 def test_add_transaction_instrument_not_found(mock_collection, mock_accounts, mock_instruments, atm_extraction_in,
                                               normal_user, account_bank, account_cash):
     mock_accounts.find_one.side_effect = [account_bank.dict(exclude_none=True), account_cash.dict(exclude_none=True)]
-    mock_instruments.find_one.return_value = None
+    mock_instruments.find.return_value = []
 
     with pytest.raises(HTTPException) as excinfo:
         add_transaction(atm_extraction_in, normal_user)
@@ -41,26 +46,40 @@ def test_add_transaction_instrument_not_found(mock_collection, mock_accounts, mo
     assert not mock_collection.insert_one.called
 
 
+@patch('src.operations.transactions.next_version')
 @patch('src.operations.transactions.datetime')
 @patch('src.operations.transactions.database.instruments')
 @patch('src.operations.transactions.database.accounts')
 @patch('src.operations.transactions.database.transactions')
-def test_add_transaction_success(mock_collection, mock_accounts, mock_instruments, mock_dt, atm_extraction_in,
-                                 normal_user, account_bank, account_cash, account_broker, currency, atm_extraction):
+def test_add_transaction_success(mock_collection, mock_accounts, mock_instruments, mock_dt, mock_version,
+                                 atm_extraction_in, normal_user, account_bank, account_cash, account_broker, currency,
+                                 atm_extraction, sync_version):
+    mock_version.return_value = sync_version
     mock_dt.utcnow.return_value = datetime(2020, 4, 20, 4, 20)
     mock_accounts.find_one.side_effect = [
         account_bank.dict(exclude_none=True),
         account_cash.dict(exclude_none=True),
         account_broker.dict(exclude_none=True)
     ]
-    mock_instruments.find_one.return_value = currency.dict(exclude_none=True)
+    mock_instruments.find.return_value = [currency.dict(exclude_none=True)]
 
     res = add_transaction(atm_extraction_in, normal_user)
 
     stored_transaction_data = atm_extraction.dict(exclude_none=True)
     stored_transaction_data['code'] = '2020-04-20T04:20:00'
     assert res == stored_transaction_data
-    mock_collection.insert_one.assert_called_once_with(stored_transaction_data)
+    # Instruments are stored as references
+    mock_collection.insert_one.assert_called_once_with({
+        **stored_transaction_data,
+        'total': {**stored_transaction_data['total'], 'instrument': {'code': currency.code}},
+        'entries': [
+            {**entry, 'balance': {**entry['balance'], 'instrument': {'code': currency.code}}}
+            for entry in stored_transaction_data['entries']
+        ],
+        **sync_version
+    })
+    # Every entry is of the same instrument, read once
+    mock_instruments.find.assert_called_once_with({'code': {'$in': [currency.code]}}, {'_id': False})
 
 
 @patch('src.operations.transactions.database.transactions')
@@ -73,11 +92,13 @@ def test_complete_transaction_not_found(mock_collection, atm_extraction, normal_
     assert excinfo.value.status_code == 404
 
 
+@patch('src.operations.transactions.database.instruments')
 @patch('src.operations.transactions.database.transactions')
-def test_complete_transaction_completed(mock_collection, atm_extraction, normal_user):
+def test_complete_transaction_completed(mock_collection, mock_instruments, atm_extraction, normal_user, currency):
     transaction_data = atm_extraction.dict(exclude_none=True)
     transaction_data['status'] = TransactionStatus.completed
     mock_collection.find_one.return_value = transaction_data
+    mock_instruments.find.return_value = [currency.dict()]
 
     with pytest.raises(HTTPException) as excinfo:
         complete_transaction(atm_extraction.code, normal_user)
@@ -85,9 +106,15 @@ def test_complete_transaction_completed(mock_collection, atm_extraction, normal_
     assert excinfo.value.status_code == 400
 
 
+@patch('src.operations.transactions.database.instruments')
+@patch('src.operations.transactions.next_version')
+@patch('src.operations.transactions.publish')
 @patch('src.operations.transactions.database.accounts')
 @patch('src.operations.transactions.database.transactions')
-def test_complete_transaction_partial(mock_collection, mock_accounts, atm_extraction, normal_user):
+def test_complete_transaction_partial(mock_collection, mock_accounts, mock_publish, mock_version, mock_instruments,
+                                      atm_extraction, normal_user, currency, sync_version):
+    mock_version.return_value = sync_version
+    mock_instruments.find.return_value = [currency.dict()]
     # Set all entries as already completed
     for entry in atm_extraction.entries:
         entry.status = TransactionStatus.completed
@@ -100,21 +127,34 @@ def test_complete_transaction_partial(mock_collection, mock_accounts, atm_extrac
 
     # Assert only transaction status was changed
     assert res == atm_extraction
-    assert not mock_accounts.update_one.called
+    assert not mock_accounts.find_one_and_update.called
+    assert not mock_publish.called
     assert mock_collection.update_one.mock_calls == [
         call(
             {'owner': normal_user.username, 'code': atm_extraction.code},
-            {'$set': {'status': TransactionStatus.completed}}
+            {'$set': {'status': TransactionStatus.completed, **sync_version}}
         )
     ]
 
 
+@patch('src.operations.transactions._update_lots')
+@patch('src.operations.transactions.database.instruments')
+@patch('src.operations.transactions.next_version')
+@patch('src.operations.transactions.publish')
 @patch('src.operations.transactions.database.accounts')
 @patch('src.operations.transactions.database.transactions')
-def test_complete_transaction_full(mock_collection, mock_accounts, atm_extraction, account_bank, account_cash,
-                                   account_broker, normal_user, currency):
+@patch('src.operations.transactions.datetime')
+def test_complete_transaction_full(mock_datetime, mock_collection, mock_accounts, mock_publish, mock_version,
+                                   mock_instruments, mock_lots, atm_extraction, account_bank, account_cash,
+                                   account_broker, normal_user, currency, sync_version):
+    completed_at = datetime(2020, 4, 21, 9, 30)
+    mock_datetime.utcnow.return_value = completed_at
+    mock_version.return_value = sync_version
     mock_collection.find_one.return_value = atm_extraction.dict(exclude_none=True)
+    mock_instruments.find.return_value = [currency.dict()]
     mock_accounts.find_one.side_effect = [account_bank.dict(exclude_none=True), None, None]
+    updated_accounts = [{'code': a.code, 'assets': []} for a in (account_bank, account_cash, account_broker)]
+    mock_accounts.find_one_and_update.side_effect = updated_accounts
 
     res = complete_transaction(atm_extraction.code, normal_user)
 
@@ -122,56 +162,137 @@ def test_complete_transaction_full(mock_collection, mock_accounts, atm_extractio
     atm_extraction.status = TransactionStatus.completed
     for entry in atm_extraction.entries:
         entry.status = TransactionStatus.completed
+        entry.completed_at = completed_at
 
     # Assert correct return value and update calls (accounts = 1/entry, transactions = 1/entry + 1)
     assert res == atm_extraction
-    assert mock_accounts.update_one.mock_calls == [
+    assert mock_accounts.find_one_and_update.mock_calls == [
         call(
             {'owner': normal_user.username, 'code': account_bank.code},
-            {'$inc': {'assets.$[asset].quantity': atm_extraction.entries[0].balance.quantity}},
-            array_filters=[{'asset.instrument.code': currency.code}]
+            {'$inc': {'assets.$[asset].quantity': atm_extraction.entries[0].balance.quantity}, '$set': sync_version},
+            BALANCES_PROJECTION,
+            array_filters=[{'asset.instrument.code': currency.code}],
+            return_document=ReturnDocument.AFTER
         ),
         call(
             {'owner': normal_user.username, 'code': account_cash.code},
-            {'$push': {'assets': atm_extraction.entries[1].balance.dict()}},
-            array_filters=None
+            {
+                '$push': {'assets': {
+                    'instrument': {'code': currency.code},
+                    'quantity': atm_extraction.entries[1].balance.quantity
+                }},
+                '$set': sync_version
+            },
+            BALANCES_PROJECTION,
+            array_filters=None,
+            return_document=ReturnDocument.AFTER
         ),
         call(
             {'owner': normal_user.username, 'code': account_broker.code},
-            {'$push': {'assets': atm_extraction.entries[2].balance.dict()}},
-            array_filters=None
+            {
+                '$push': {'assets': {
+                    'instrument': {'code': currency.code},
+                    'quantity': atm_extraction.entries[2].balance.quantity
+                }},
+                '$set': sync_version
+            },
+            BALANCES_PROJECTION,
+            array_filters=None,
+            return_document=ReturnDocument.AFTER
         )
 
     ]
     assert mock_collection.update_one.mock_calls == [
         call(
             {'owner': normal_user.username, 'code': atm_extraction.code},
-            {'$set': {'entries.0.status': TransactionStatus.completed}}
+            {
+                '$set': {
+                    'entries.0.status': TransactionStatus.completed,
+                    'entries.0.completed_at': completed_at,
+                    **sync_version
+                }
+            }
         ),
         call(
             {'owner': normal_user.username, 'code': atm_extraction.code},
-            {'$set': {'entries.1.status': TransactionStatus.completed}}
+            {
+                '$set': {
+                    'entries.1.status': TransactionStatus.completed,
+                    'entries.1.completed_at': completed_at,
+                    **sync_version
+                }
+            }
         ),
         call(
             {'owner': normal_user.username, 'code': atm_extraction.code},
-            {'$set': {'entries.2.status': TransactionStatus.completed}}
+            {
+                '$set': {
+                    'entries.2.status': TransactionStatus.completed,
+                    'entries.2.completed_at': completed_at,
+                    **sync_version
+                }
+            }
         ),
         call(
             {'owner': normal_user.username, 'code': atm_extraction.code},
-            {'$set': {'status': TransactionStatus.completed}}
+            {'$set': {'status': TransactionStatus.completed, **sync_version}}
         )
     ]
+    assert mock_lots.mock_calls == [
+        call(normal_user.username, res, [entry], reverted=False) for entry in res.entries
+    ]
+    # With the balances updated, for the changes to be pushed without reading them again
+    mock_publish.assert_called_once_with(
+        Event.balance_changed, owner=normal_user.username, transaction=atm_extraction,
+        entries=atm_extraction.entries, reverted=False, accounts=updated_accounts
+    )
+
+
+@patch('src.operations.holdings.get_rate_matrix')
+@patch('src.operations.holdings.database')
+@patch('src.operations.transactions._get_transaction_for_processing')
+@patch('src.operations.transactions.next_version')
+@patch('src.operations.transactions.publish')
+@patch('src.operations.transactions.database.accounts')
+@patch('src.operations.transactions.database.transactions')
+def test_complete_transaction_no_rates(mock_collection, mock_accounts, mock_publish, mock_version, mock_transaction,
+                                       mock_holdings_database, mock_rates, security_purchase, normal_user,
+                                       sync_version):
+    mock_version.return_value = sync_version
+    for entry in security_purchase.entries:
+        entry.status = TransactionStatus.pending
+    mock_transaction.return_value = security_purchase
+    # Cost is tracked in EUR, but there are no rates to convert the USD total
+    mock_holdings_database.holdings.find_one.return_value = {'currency': 'EUR', 'quantity': 1, 'cost': 1}
+    mock_rates.return_value = RateMatrix([])
+
+    with pytest.raises(HTTPException) as excinfo:
+        complete_transaction(security_purchase.code, normal_user)
+
+    # Nothing is applied, so completing it can be retried
+    assert excinfo.value.status_code == 400
+    assert not mock_holdings_database.lots.insert_one.called
+    assert not mock_accounts.find_one_and_update.called
+    assert not mock_collection.update_one.called
+    assert not mock_publish.called
 
 
+@patch('src.operations.transactions.database.instruments')
 @patch('src.operations.transactions.database.transactions')
-def test_get_transactions(mock_collection, atm_extraction, normal_user):
-    mock_collection.find.return_value.sort.return_value = [atm_extraction.dict(exclude_none=True)]
+def test_get_transactions(mock_collection, mock_instruments, atm_extraction, normal_user, currency):
+    transaction_data = atm_extraction.dict(exclude_none=True)
+    transaction_data['total']['instrument'] = {'code': currency.code}
+    for entry in transaction_data['entries']:
+        entry['balance']['instrument'] = {'code': currency.code}
+    mock_collection.find.return_value.sort.return_value = [transaction_data]
+    mock_instruments.find.return_value = [currency.dict()]
 
     res = get_transactions(normal_user)
 
     assert len(res) == 1
-    assert res[0] == atm_extraction
-    mock_collection.find.assert_called_once_with({'owner': normal_user.username})
+    assert res[0] == atm_extraction.dict(exclude_none=True)
+    mock_collection.find.assert_called_once_with({'owner': normal_user.username}, None)
+    mock_instruments.find.assert_called_once_with({'code': {'$in': [currency.code]}}, {'_id': False})
 
 
 @patch('src.operations.transactions.database.transactions')
@@ -181,18 +302,56 @@ def test_get_transactions_by_status(mock_collection, normal_user):
     res = get_transactions(normal_user, TransactionStatus.cancelled)
 
     assert len(res) == 0
-    mock_collection.find.assert_called_once_with({'owner': normal_user.username, 'status': TransactionStatus.cancelled})
+    mock_collection.find.assert_called_once_with(
+        {'owner': normal_user.username, 'status': TransactionStatus.cancelled}, None
+    )
+
+
+@patch('src.operations.transactions.database.transactions')
+def test_get_transactions_filtered(mock_collection, normal_user):
+    mock_collection.find.return_value.sort.return_value = []
+
+    res = get_transactions(normal_user, TransactionStatus.completed, '2020-04-01', '2020-04-30', 'BOICA', 'EUR',
+                           'code,entries.balance')
+
+    assert len(res) == 0
+    mock_collection.find.assert_called_once_with(
+        {
+            'owner': normal_user.username,
+            'status': TransactionStatus.completed,
+            'entries.account.code': 'BOICA',
+            'entries.balance.instrument.code': 'EUR',
+            'code': {'$gte': '2020-04-01T00:00:00', '$lt': '2020-05-01T00:00:00'}
+        },
+        {'_id': False, 'code': True, 'entries.balance': True}
+    )
+
 
+@patch('src.operations.transactions.database.transactions')
+def test_get_transactions_invalid_date(mock_collection, normal_user):
+    with pytest.raises(HTTPException) as excinfo:
+        get_transactions(normal_user, start='April')
 
+    assert excinfo.value.status_code == 400
+    assert not mock_collection.find.called
+
+
+@patch('src.operations.transactions._update_lots')
+@patch('src.operations.transactions.database.instruments')
+@patch('src.operations.transactions.next_version')
+@patch('src.operations.transactions.publish')
 @patch('src.operations.transactions.database.accounts')
 @patch('src.operations.transactions.database.transactions')
-def test_cancel_transaction_partial(mock_collection, mock_accounts, atm_extraction, account_bank, normal_user,
-                                    currency):
+def test_cancel_transaction_partial(mock_collection, mock_accounts, mock_publish, mock_version, mock_instruments,
+                                    mock_lots, atm_extraction, account_bank, normal_user, currency, sync_version):
+    mock_version.return_value = sync_version
+    mock_instruments.find.return_value = [currency.dict()]
     # Set entries to different status to cover all cases
     atm_extraction.entries[0].status = TransactionStatus.completed
     atm_extraction.entries[1].status = TransactionStatus.pending
     atm_extraction.entries[2].status = TransactionStatus.cancelled
     mock_collection.find_one.return_value = atm_extraction.dict(exclude_none=True)
+    mock_accounts.find_one_and_update.return_value = {'code': account_bank.code, 'assets': []}
 
     res = cancel_transaction(atm_extraction.code, normal_user)
 
@@ -203,24 +362,57 @@ def test_cancel_transaction_partial(mock_collection, mock_accounts, atm_extracti
 
     # Assert only "complete" entry was reverted, but status was set for 2
     assert res == atm_extraction
-    assert mock_accounts.update_one.mock_calls == [
+    assert mock_accounts.find_one_and_update.mock_calls == [
         call(
             {'owner': normal_user.username, 'code': account_bank.code},
-            {'$inc': {'assets.$[asset].quantity': -atm_extraction.entries[0].balance.quantity}},
-            array_filters=[{'asset.instrument.code': currency.code}]
+            {'$inc': {'assets.$[asset].quantity': -atm_extraction.entries[0].balance.quantity}, '$set': sync_version},
+            BALANCES_PROJECTION,
+            array_filters=[{'asset.instrument.code': currency.code}],
+            return_document=ReturnDocument.AFTER
         )
     ]
     assert mock_collection.update_one.mock_calls == [
         call(
             {'owner': normal_user.username, 'code': atm_extraction.code},
-            {'$set': {'entries.0.status': TransactionStatus.cancelled}}
+            {'$set': {'entries.0.status': TransactionStatus.cancelled, **sync_version}}
         ),
         call(
             {'owner': normal_user.username, 'code': atm_extraction.code},
-            {'$set': {'entries.1.status': TransactionStatus.cancelled}}
+            {'$set': {'entries.1.status': TransactionStatus.cancelled, **sync_version}}
         ),
         call(
             {'owner': normal_user.username, 'code': atm_extraction.code},
-            {'$set': {'status': TransactionStatus.cancelled}}
+            {'$set': {'status': TransactionStatus.cancelled, **sync_version}}
         )
     ]
+    mock_lots.assert_called_once_with(normal_user.username, res, [res.entries[0]], reverted=True)
+    mock_publish.assert_called_once_with(
+        Event.balance_changed, owner=normal_user.username, transaction=atm_extraction,
+        entries=[atm_extraction.entries[0]], reverted=True, accounts=[{'code': account_bank.code, 'assets': []}]
+    )
+
+
+@patch('src.operations.holdings.database')
+@patch('src.operations.transactions._get_transaction_for_processing')
+@patch('src.operations.transactions.next_version')
+@patch('src.operations.transactions.publish')
+@patch('src.operations.transactions.database.accounts')
+@patch('src.operations.transactions.database.transactions')
+def test_cancel_transaction_consumed_lots(mock_collection, mock_accounts, mock_publish, mock_version, mock_transaction,
+                                          mock_holdings_database, security_purchase, normal_user, sync_version):
+    mock_version.return_value = sync_version
+    for entry in security_purchase.entries:
+        entry.status = TransactionStatus.completed
+    mock_transaction.return_value = security_purchase
+    # A later sale consumed part of the lot acquired by the purchase
+    mock_holdings_database.lots.find.return_value = [{'quantity': 10, 'remaining': 4}]
+
+    with pytest.raises(HTTPException) as excinfo:
+        cancel_transaction(security_purchase.code, normal_user)
+
+    # Nothing is reverted, neither the lot nor the balances of any entry
+    assert excinfo.value.status_code == 400
+    assert not mock_holdings_database.lots.find_one_and_delete.called
+    assert not mock_accounts.find_one_and_update.called
+    assert not mock_collection.update_one.called
+    assert not mock_publish.called
@@ -0,0 +1,126 @@
+import asyncio
+import json
+from datetime import datetime
+from unittest.mock import patch
+
+from src.config import change_listener
+from src.events import Event, publish
+from src.models.transactions import TransactionStatus
+from src.operations.updates import broker, get_updates
+from .fixtures import atm_extraction, atm_extraction_input, currency, currency_input, account_bank_input, \
+    account_cash_input, account_broker_input, normal_user, normal_user_input
+
+
+async def _read_events(response, count: int):
+    events = []
+    async for chunk in response.body_iterator:
+        event, data = chunk.strip().split('\n')
+        events.append((event[len('event: '):], json.loads(data[len('data: '):])))
+        if len(events) == count:
+            break
+
+    await response.body_iterator.aclose()
+    return events
+
+
+@patch('src.operations.updates.database.accounts')
+def test_updates_stream_changes(mock_accounts, normal_user, atm_extraction):
+    mock_accounts.distinct.return_value = ['USD']
+    account = {
+        'owner': normal_user.username, 'code': 'WALLET', 'assets': [{'instrument': {'code': 'USD'}, 'quantity': 5}]
+    }
+
+    async def run():
+        response = await get_updates(normal_user)
+        mock_accounts.distinct.assert_called_once_with('assets.instrument.code', {'owner': normal_user.username})
+
+        # Changes made through any worker, as published by the change stream
+        for collection, document in [
+            ('values', {'instrument': {'code': 'ARS'}, 'date': datetime(2020, 4, 20), 'values': {'USD': 0.01}}),
+            ('values', {'instrument': {'code': 'USD'}, 'date': datetime(2020, 4, 20), 'values': {'EUR': 0.9}}),
+            ('transactions', {'owner': 'other', 'code': atm_extraction.code, 'status': 'cancelled'}),
+            ('transactions', {'owner': normal_user.username, 'code': atm_extraction.code, 'status': 'cancelled'}),
+            ('accounts', None),
+            ('accounts', account)
+        ]:
+            publish(Event.data_changed, collection=collection, operation='update', key={'_id': 1}, document=document)
+
+        events = await _read_events(response, 3)
+        return events, len(broker)
+
+    with patch.object(change_listener, 'watching', True):
+        events, subscribers = asyncio.run(run())
+
+    assert events == [
+        ('value', {'instrument': 'USD', 'date': '2020-04-20T00:00:00', 'values': {'EUR': 0.9}}),
+        ('transaction', {'code': atm_extraction.code, 'status': 'cancelled'}),
+        ('account', {'code': 'WALLET', 'assets': [{'instrument': 'USD', 'quantity': 5}]})
+    ]
+    assert subscribers == 0
+
+
+@patch('src.operations.updates.database.accounts')
+def test_updates_own_events_not_pushed_while_watching(mock_accounts, normal_user, atm_extraction):
+    mock_accounts.distinct.return_value = ['USD']
+
+    async def run():
+        response = await get_updates(normal_user)
+        # Pushed from the change stream instead
+        publish(Event.value_changed, instrument={'code': 'USD'}, date=datetime(2020, 4, 20), values={'EUR': 0.9})
+        atm_extraction.status = TransactionStatus.completed
+        for entry in atm_extraction.entries:
+            entry.status, entry.completed_at = TransactionStatus.completed, datetime(2020, 4, 20, 10)
+        publish(Event.balance_changed, owner=normal_user.username, transaction=atm_extraction,
+                entries=atm_extraction.entries, reverted=False, accounts=[])
+        publish(Event.data_changed, collection='values', operation='update', key={'_id': 1},
+                document={'instrument': {'code': 'USD'}, 'date': datetime(2020, 4, 20), 'values': {'EUR': 0.9}})
+
+        return await _read_events(response, 1), response
+
+    with patch.object(change_listener, 'watching', True):
+        events, response = asyncio.run(run())
+
+    assert events == [('value', {'instrument': 'USD', 'date': '2020-04-20T00:00:00', 'values': {'EUR': 0.9}})]
+    assert not mock_accounts.find.called
+
+
+@patch('src.operations.updates.database.accounts')
+def test_updates_own_events_pushed_without_change_stream(mock_accounts, normal_user, atm_extraction):
+    mock_accounts.distinct.return_value = ['USD']
+
+    async def run():
+        response = await get_updates(normal_user)
+        publish(Event.value_changed, instrument={'code': 'USD'}, date=datetime(2020, 4, 20), values={'EUR': 0.9})
+        atm_extraction.status = TransactionStatus.completed
+        atm_extraction.entries[1].status = TransactionStatus.completed
+        atm_extraction.entries[1].completed_at = datetime(2020, 4, 20, 10)
+        publish(Event.balance_changed, owner=normal_user.username, transaction=atm_extraction,
+                entries=atm_extraction.entries[1:2], reverted=False,
+                accounts=[{'code': 'WALLET', 'assets': [{'instrument': {'code': 'EUR'}, 'quantity': 50}]}])
+        return await _read_events(response, 3)
+
+    events = asyncio.run(run())
+
+    assert events == [
+        ('value', {'instrument': 'USD', 'date': '2020-04-20T00:00:00', 'values': {'EUR': 0.9}}),
+        ('transaction', {'code': atm_extraction.code, 'status': 'completed'}),
+        ('account', {'code': 'WALLET', 'assets': [{'instrument': 'EUR', 'quantity': 50}]})
+    ]
+    # Pushed from the event, without reading the accounts
+    assert not mock_accounts.find.called
+
+
+@patch('src.operations.updates.database.accounts')
+def test_updates_resubscribed_after_account_changes(mock_accounts, normal_user):
+    mock_accounts.distinct.side_effect = [[], ['USD']]
+
+    async def run():
+        response = await get_updates(normal_user)
+        publish(Event.data_changed, collection='accounts', operation='update', key={'_id': 1},
+                document={'owner': normal_user.username, 'code': 'WALLET', 'assets': []})
+        await _read_events(response, 1)
+
+    with patch.object(broker, 'resubscribe', wraps=broker.resubscribe) as resubscribe:
+        asyncio.run(run())
+
+    assert resubscribe.call_args.args[1] == [('balances', normal_user.username), ('values', 'USD')]